@@ -0,0 +1,135 @@
+# backend/cli.py
+"""
+Служебные команды backend.
+
+Повторная пост-обработка звонков, завершившихся в интервале (например, после
+сбоя MinIO или воркера). Пройденные этапы задач не повторяются:
+
+    python -m backend.cli requeue --since 2024-05-01T10:00 --until 2024-05-01T14:00
+    python -m backend.cli requeue --since 2024-05-01 --until 2024-05-02 --dry-run
+
+Время без часового пояса считается UTC.
+
+Один проход уборки брошенных чанков (см. services.sweeper):
+
+    python -m backend.cli sweep --dry-run
+
+Перенос файлов резюме и вакансий из колонок file_data в хранилище (см.
+services.documents). Можно прервать и запустить снова; место в Postgres
+освобождается после VACUUM:
+
+    python -m backend.cli migrate-files --batch-size 50
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+
+from . import database, models
+from .services.documents import DOCUMENTS_MIGRATION_BATCH, migrate_documents
+from .services.post_processing_jobs import requeue_jobs_sync
+from .services.storage import get_storage
+from .services.sweeper import Sweeper
+
+
+def _parse_time(value: str) -> datetime.datetime:
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid ISO 8601 time: {value}")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def _requeue(args) -> int:
+    if args.since >= args.until:
+        print("--since must be earlier than --until")
+        return 2
+    result = requeue_jobs_sync(
+        args.since, args.until, include_done=args.include_done, dry_run=args.dry_run
+    )
+    print(json.dumps(result))
+    return 0
+
+
+def _sweep(args) -> int:
+    async def run():
+        try:
+            sweeper = Sweeper(page_delay=args.page_delay)
+            if args.max_deletes is not None:
+                sweeper.max_deletes = args.max_deletes
+            return await sweeper.run_pass(dry_run=args.dry_run)
+        finally:
+            await get_storage().close()
+
+    print(json.dumps(asyncio.run(run())))
+    return 0
+
+
+def _migrate_files(args) -> int:
+    async def run():
+        try:
+            return await migrate_documents(args.batch_size, dry_run=args.dry_run)
+        finally:
+            await get_storage().close()
+
+    print(json.dumps(asyncio.run(run())))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m backend.cli",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    requeue = commands.add_parser(
+        "requeue", help="re-run post-processing for calls that ended in a time range"
+    )
+    requeue.add_argument("--since", type=_parse_time, required=True)
+    requeue.add_argument("--until", type=_parse_time, required=True)
+    requeue.add_argument(
+        "--include-done",
+        action="store_true",
+        help="also re-run jobs marked done (finished stages are still skipped)",
+    )
+    requeue.add_argument(
+        "--dry-run", action="store_true", help="only count affected sessions"
+    )
+    requeue.set_defaults(handler=_requeue)
+
+    sweep = commands.add_parser(
+        "sweep", help="one pass over abandoned call chunks and orphaned objects"
+    )
+    sweep.add_argument(
+        "--dry-run", action="store_true", help="only count what would be done"
+    )
+    sweep.add_argument("--max-deletes", type=int, default=None)
+    sweep.add_argument(
+        "--page-delay", type=float, default=0, help="pause between pages, seconds"
+    )
+    sweep.set_defaults(handler=_sweep)
+
+    migrate_files = commands.add_parser(
+        "migrate-files", help="move resume and vacancy files into object storage"
+    )
+    migrate_files.add_argument(
+        "--batch-size", type=int, default=DOCUMENTS_MIGRATION_BATCH
+    )
+    migrate_files.add_argument(
+        "--dry-run", action="store_true", help="only count rows and bytes to move"
+    )
+    migrate_files.set_defaults(handler=_migrate_files)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(database.engine)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
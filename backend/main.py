@@ -7,20 +7,48 @@ from fastapi.staticfiles import StaticFiles
 from sqlalchemy.exc import OperationalError
 
 from . import database, models
-from .routers import meetings, resumes, similarity, users, vacancies, ws
-from .utils import s3_async
+from .routers import meetings, metrics, resumes, similarity, users, vacancies, ws
+from .services.audio_spool import (prune_shipped_spools, recover_spools,
+                                   spool_pruner)
+from .services.audio_store import metadata_batcher
+from .services.documents import (DocumentSizeLimitMiddleware,
+                                 ensure_document_columns_sync)
+from .services.post_processing import ensure_final_recording_index_sync
+from .services.storage import get_storage
+from .services.stt_tts_client import STT_TTS_WARMUP, get_stt_client
 
 logger = logging.getLogger("uvicorn.error")
 app = FastAPI()
+# Загрузки резюме и вакансий сверх лимита отклоняются до чтения тела
+app.add_middleware(DocumentSizeLimitMiddleware, prefixes=("/resumes", "/vacancies"))
 
 
 @app.on_event("startup")
 async def startup_event():
     await anyio.to_thread.run_sync(models.Base.metadata.create_all, database.engine)
+    await anyio.to_thread.run_sync(ensure_document_columns_sync)
+    await anyio.to_thread.run_sync(ensure_final_recording_index_sync)
     try:
-        await s3_async.ensure_bucket()
+        await get_storage().ensure_bucket()
     except Exception as e:
         logger.warning("Could not ensure S3 bucket: %s", e)
+    try:
+        await recover_spools()
+        await anyio.to_thread.run_sync(prune_shipped_spools)
+    except Exception as e:
+        logger.warning("Could not recover audio spools: %s", e)
+    metadata_batcher.start()
+    spool_pruner.start()
+    if STT_TTS_WARMUP:
+        await get_stt_client().warm_up()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await spool_pruner.stop()
+    await metadata_batcher.stop()
+    await get_stt_client().close()
+    await get_storage().close()
 
 
 app.include_router(vacancies.router, prefix="/vacancies", tags=["vacancies"])
@@ -29,5 +57,6 @@ app.include_router(similarity.router, prefix="/similarity", tags=["similarity"])
 app.include_router(users.router, prefix="/user", tags=["user"])
 app.include_router(meetings.router, prefix="", tags=["meetings"])
 app.include_router(ws.router, prefix="", tags=["call"])
+app.include_router(metrics.router, prefix="", tags=["metrics"])
 
 app.mount("/static", StaticFiles(directory="backend/static"), name="static")
@@ -1,7 +1,7 @@
 # backend/models.py
-from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Integer,
-                        LargeBinary, String, Text, func)
-from sqlalchemy.orm import relationship
+from sqlalchemy import (Boolean, Column, DateTime, Float, ForeignKey, Index,
+                        Integer, LargeBinary, String, Text, func, text)
+from sqlalchemy.orm import deferred, relationship
 
 from .database import Base
 
@@ -13,7 +13,15 @@ class Vacancy(Base):
     telegram_user_id = Column(String, nullable=True)
     title = Column(String, nullable=False)
     file_name = Column(String, nullable=True)
-    file_data = Column(LargeBinary, nullable=True)
+    # Байты файла загружаются только при обращении к атрибуту (скачивание
+    # еще не перенесенных строк), а не в каждом запросе списков и метаданных
+    file_data = deferred(Column(LargeBinary, nullable=True))
+    # Файл в хранилище под ключом от SHA-256 (см. services.documents);
+    # file_data заполнен только у строк, еще не перенесенных migrate-files
+    file_key = Column(String, nullable=True)
+    file_size = Column(Integer, nullable=True)
+    file_sha256 = Column(String(64), nullable=True)
+    file_mime = Column(String, nullable=True)
     resumes = relationship("Resume", back_populates="vacancy")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -25,7 +33,12 @@ class Resume(Base):
     telegram_username = Column(String, nullable=True)
     telegram_user_id = Column(String, nullable=True)
     original_filename = Column(String, nullable=False)
-    file_data = Column(LargeBinary, nullable=False)
+    # Файл хранится так же, как у Vacancy
+    file_data = deferred(Column(LargeBinary, nullable=True))
+    file_key = Column(String, nullable=True)
+    file_size = Column(Integer, nullable=True)
+    file_sha256 = Column(String(64), nullable=True)
+    file_mime = Column(String, nullable=True)
     vacancy = relationship("Vacancy", back_populates="resumes")
     similarity = relationship("Similarity", back_populates="resume", uselist=False)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -63,6 +76,19 @@ class AudioObject(Base):
     is_final = Column(Boolean, default=False, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        # Не больше одной финальной записи каждой роли (merged, производные)
+        # на сессию, даже если ее регистрируют два процесса одновременно
+        Index(
+            "uq_audio_objects_final_role",
+            "session_id",
+            "role",
+            unique=True,
+            postgresql_where=text("is_final"),
+            sqlite_where=text("is_final = 1"),
+        ),
+    )
+
 
 class Meeting(Base):
     __tablename__ = "meetings"
@@ -78,3 +104,26 @@ class Meeting(Base):
     audio_objects = relationship(
         "AudioObject", back_populates="meeting", cascade="all, delete-orphan"
     )
+
+
+class PostProcessingJob(Base):
+    __tablename__ = "post_processing_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, unique=True, index=True, nullable=False)
+    meeting_id = Column(Integer, ForeignKey("meetings.id"), nullable=False, index=True)
+    # pending -> running -> done | failed (после исчерпания попыток)
+    status = Column(String, default="pending", nullable=False, index=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_run_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    last_error = Column(Text, nullable=True)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime(timezone=True), nullable=True)
+    # Последний завершенный этап: final_uploaded -> final_registered ->
+    # sources_deleted (повтор пропускает пройденные этапы)
+    stage = Column(String, nullable=True)
+    final_object_key = Column(String, nullable=True)
+    final_size_bytes = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
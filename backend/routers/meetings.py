@@ -1,17 +1,15 @@
 # backend/routers/meetings.py
 import datetime
-import io
 import logging
-import os
 import uuid
 from typing import List
 
-from fastapi import APIRouter, Depends, Header, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 from sqlalchemy.orm import Session
 
 from .. import database, models, schemas
-from ..services.minio_client import get_minio_client
+from ..services.object_delivery import deliver_object
+from ..services.post_processing import FINAL_RECORDING_ROLE
 
 router = APIRouter()
 logger = logging.getLogger("Meetings")
@@ -121,9 +119,43 @@ def list_user_meetings(
     return meetings
 
 
+@router.get(
+    "/meetings/{token}/processing", response_model=schemas.PostProcessingJobResponse
+)
+def get_meeting_processing_status(
+        token: str,
+        db: Session = Depends(database.get_db),
+        x_telegram_user: str = Depends(get_user),
+):
+    """Статус пост-обработки записи последней сессии встречи."""
+    meeting = db.query(models.Meeting).filter(models.Meeting.token == token).first()
+    if not meeting:
+        raise HTTPException(status_code=404, detail="Meeting not found")
+
+    allowed = (meeting.organizer_username == x_telegram_user) or (
+            meeting.candidate_username == x_telegram_user
+    )
+    if not allowed:
+        raise HTTPException(
+            status_code=403, detail="Forbidden: You cannot access this meeting"
+        )
+
+    job = (
+        db.query(models.PostProcessingJob)
+        .filter(models.PostProcessingJob.session_id == meeting.last_session_id)
+        .first()
+    )
+    if not job:
+        raise HTTPException(
+            status_code=404, detail="Пост-обработка для этой встречи не найдена"
+        )
+    return job
+
+
 @router.get("/meetings/{token}/recording")
 def download_meeting_recording(
         token: str,
+        request: Request,
         db: Session = Depends(database.get_db),
         x_telegram_user: str = Depends(get_user),
 ):
@@ -140,12 +172,13 @@ def download_meeting_recording(
         )
 
     # Вызываем нашу новую вспомогательную функцию
-    return get_recording_response(meeting)
+    return get_recording_response(meeting, request)
 
 
-def get_recording_response(meeting: models.Meeting):
+def get_recording_response(meeting: models.Meeting, request: Request):
     """
-    Находит финальную запись для встречи и возвращает StreamingResponse.
+    Находит финальную запись для встречи и отдает ее из хранилища потоково, с
+    поддержкой Range, или presigned URL (см. FILE_DELIVERY_MODE).
     """
     if not meeting.last_session_id:
         raise HTTPException(
@@ -160,6 +193,7 @@ def get_recording_response(meeting: models.Meeting):
             .filter(
                 models.AudioObject.session_id == meeting.last_session_id,
                 models.AudioObject.is_final == True,
+                models.AudioObject.role == FINAL_RECORDING_ROLE,
             )
             .first()
         )
@@ -171,20 +205,10 @@ def get_recording_response(meeting: models.Meeting):
             status_code=404, detail="Финальная запись не найдена для этой встречи"
         )
 
-    try:
-        minio_client = get_minio_client()
-        response = minio_client.client.get_object(
-            bucket_name=os.getenv("MINIO_BUCKET", "audio"),
-            object_name=final_recording.object_key,
-        )
-        data = response.read()
-
-        filename = f"recording_meeting_{meeting.id}.ogg"
-        return StreamingResponse(
-            io.BytesIO(data),
-            media_type="audio/ogg",
-            headers={"Content-Disposition": f"attachment; filename={filename}"},
-        )
-    except Exception as e:
-        logger.error(f"Error downloading recording {final_recording.object_key}: {e}")
-        raise HTTPException(status_code=500, detail="Error retrieving recording")
+    filename = f"recording_meeting_{meeting.id}.ogg"
+    return deliver_object(
+        final_recording.object_key,
+        request,
+        media_type="audio/ogg",
+        content_disposition=f"attachment; filename={filename}",
+    )
@@ -0,0 +1,15 @@
+# backend/routers/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from ..services.metrics import render_metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Метрики процесса в текстовом формате Prometheus."""
+    return PlainTextResponse(
+        render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,16 +1,17 @@
 # backend/routers/resumes.py
 import io
-import mimetypes
 import random
 from typing import List
 from urllib.parse import quote, unquote
 
 from fastapi import (APIRouter, Depends, File, Form, Header, HTTPException,
-                     UploadFile, status)
+                     Request, UploadFile, status)
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from .. import database, models, schemas
+from ..services.documents import apply_document, guess_mime, ingest_upload
+from ..services.object_delivery import deliver_object
 from .meetings import get_recording_response
 
 router = APIRouter()
@@ -26,18 +27,15 @@ async def upload_resume(
     telegram_user_id: str = Form(...),
     db: Session = Depends(database.get_db),
 ):
-    file_bytes = await file.read()
-    MAX_SIZE = 30 * 1024 * 1024
-    if len(file_bytes) > MAX_SIZE:
-        raise HTTPException(status_code=413, detail="Файл слишком большой (макс 30 MB)")
-
+    original_filename = unquote(file.filename)
+    stored = await ingest_upload(file, guess_mime(original_filename, file.content_type))
     resume = models.Resume(
         vacancy_id=vacancy_id,
-        original_filename=unquote(file.filename),
-        file_data=file_bytes,
+        original_filename=original_filename,
         telegram_username=telegram_username,
         telegram_user_id=telegram_user_id,
     )
+    apply_document(resume, stored)
     db.add(resume)
     db.commit()
     db.refresh(resume)
@@ -87,6 +85,7 @@ def get_resume_info(resume_id: int, db: Session = Depends(database.get_db)):
 @router.get("/{resume_id}/download")
 def download_resume(
     resume_id: int,
+    request: Request,
     db: Session = Depends(database.get_db),
     x_telegram_user: str | None = Header(None),
 ):
@@ -108,20 +107,31 @@ def download_resume(
             status_code=403, detail="Forbidden: you cannot download this resume"
         )
 
-    mime_type = (
-        mimetypes.guess_type(resume.original_filename)[0] or "application/octet-stream"
-    )
+    mime_type = resume.file_mime or guess_mime(resume.original_filename)
     quoted = quote(resume.original_filename or f"resume_{resume_id}")
-    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{quoted}"}
-
+    disposition = f"attachment; filename*=UTF-8''{quoted}"
+
+    if resume.file_key:
+        return deliver_object(
+            resume.file_key,
+            request,
+            media_type=mime_type,
+            content_disposition=disposition,
+        )
+    # Строка еще не перенесена в хранилище (migrate-files)
+    if resume.file_data is None:
+        raise HTTPException(404, "Файл резюме не найден")
     return StreamingResponse(
-        io.BytesIO(resume.file_data), media_type=mime_type, headers=headers
+        io.BytesIO(resume.file_data),
+        media_type=mime_type,
+        headers={"Content-Disposition": disposition},
     )
 
 
 @router.get("/{resume_id}/recording")
 def download_recording_by_resume(
     resume_id: int,
+    request: Request,
     db: Session = Depends(database.get_db),
     x_telegram_user: str = Header(None),
 ):
@@ -161,4 +171,4 @@ def download_recording_by_resume(
         )
 
     # Вызываем нашу новую вспомогательную функцию
-    return get_recording_response(meeting)
+    return get_recording_response(meeting, request)
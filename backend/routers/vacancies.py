@@ -1,13 +1,15 @@
 # backend/routers/vacancies.py
 import io
-import mimetypes
 from urllib.parse import quote, unquote
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import (APIRouter, Depends, File, Form, HTTPException, Request,
+                     UploadFile)
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
 from .. import database, models, schemas
+from ..services.documents import apply_document, guess_mime, ingest_upload
+from ..services.object_delivery import deliver_object
 
 router = APIRouter()
 
@@ -20,15 +22,16 @@ async def create_vacancy(
     telegram_user_id: str = Form(...),
     db: Session = Depends(database.get_db),
 ):
-    file_bytes = await file.read() if file else None
     filename = unquote(file.filename) if file else None
     vacancy = models.Vacancy(
         title=title,
         file_name=filename,
-        file_data=file_bytes,
         telegram_username=telegram_username,
         telegram_user_id=telegram_user_id,
     )
+    if file:
+        stored = await ingest_upload(file, guess_mime(filename, file.content_type))
+        apply_document(vacancy, stored)
     db.add(vacancy)
     db.commit()
     db.refresh(vacancy)
@@ -44,15 +47,27 @@ async def get_vacancy(vacancy_id: int, db: Session = Depends(database.get_db)):
 
 
 @router.get("/{vacancy_id}/download")
-def download_vacancy(vacancy_id: int, db: Session = Depends(database.get_db)):
+def download_vacancy(
+    vacancy_id: int, request: Request, db: Session = Depends(database.get_db)
+):
     vacancy = db.query(models.Vacancy).filter(models.Vacancy.id == vacancy_id).first()
-    if not vacancy or not vacancy.file_data:
+    if not vacancy or not (vacancy.file_key or vacancy.file_data):
         raise HTTPException(status_code=404, detail="Файл вакансии не найден")
 
-    mime_type = mimetypes.guess_type(vacancy.file_name)[0] or "application/octet-stream"
+    mime_type = vacancy.file_mime or guess_mime(vacancy.file_name)
     quoted = quote(vacancy.file_name or f"vacancy_{vacancy_id}")
-    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{quoted}"}
+    disposition = f"attachment; filename*=UTF-8''{quoted}"
 
+    if vacancy.file_key:
+        return deliver_object(
+            vacancy.file_key,
+            request,
+            media_type=mime_type,
+            content_disposition=disposition,
+        )
+    # Строка еще не перенесена в хранилище (migrate-files)
     return StreamingResponse(
-        io.BytesIO(vacancy.file_data), media_type=mime_type, headers=headers
+        io.BytesIO(vacancy.file_data),
+        media_type=mime_type,
+        headers={"Content-Disposition": disposition},
     )
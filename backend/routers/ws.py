@@ -1,6 +1,7 @@
 # backend/routers/ws.py
 import asyncio
 import logging
+import time
 import uuid
 
 import aiohttp
@@ -8,39 +9,40 @@ import anyio
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
 from backend.routers.meetings import finish_meeting_sync, get_meeting_by_token
-from backend.services.audio_store import save_audio_chunk_sync
-from backend.services.stt_tts_client import STTClient, get_stt_client
+from backend.services.audio_queue import SessionAudioQueue
+from backend.services.audio_store import metadata_batcher, open_track_writer
+from backend.services.call_admission import CLOSE_CODE_BUSY, call_admission
+from backend.services.live_mix import LIVE_MIX_ENABLED, LiveMixer
+from backend.services.metrics import CallStats
+from backend.services.post_processing_jobs import enqueue_post_processing_sync
+from backend.services.stt_tts_client import get_stt_client
 
 logger = logging.getLogger("uvicorn.error")
 router = APIRouter()
 
 
 async def client_to_stt(
-    client_ws: WebSocket, stt_ws: aiohttp.ClientWebSocketResponse, session_id: str
+    client_ws: WebSocket,
+    stt_ws: aiohttp.ClientWebSocketResponse,
+    session_id: str,
+    persist: SessionAudioQueue,
+    stats: CallStats,
 ):
-    """Принимает аудио от клиента, сохраняет и пересылает в STT/TTS сервис."""
+    """Принимает аудио от клиента, пересылает в STT/TTS сервис и сохраняет в фоне."""
     try:
         while True:
             data = await client_ws.receive_bytes()
             if data:
-                # Сохраняем аудио клиента
-                try:
-                    await anyio.to_thread.run_sync(
-                        save_audio_chunk_sync,
-                        data,
-                        session_id,
-                        "participant",
-                        "audio/webm",
-                    )
-                    logger.debug(f"Saved client audio chunk for session {session_id}")
-                except Exception as e:
-                    logger.exception(
-                        "Failed saving client audio chunk for session %s", session_id
-                    )
-
-                # Пересылаем байты в STT/TTS сервис
+                received_at = time.perf_counter()
+                stats.record_frame("participant", len(data))
+
+                # Сначала пересылаем байты в STT/TTS сервис
                 if not stt_ws.closed:
                     await stt_ws.send_bytes(data)
+                    stats.record_client_to_stt(time.perf_counter() - received_at)
+
+                # Сохраняем аудио клиента в фоне
+                await persist.submit("participant", data)
     except WebSocketDisconnect:
         logger.info("Client disconnected (client_to_stt)")
     except Exception as e:
@@ -55,28 +57,30 @@ async def client_to_stt(
 
 
 async def stt_to_client(
-    stt_ws: aiohttp.ClientWebSocketResponse, client_ws: WebSocket, session_id: str
+    stt_ws: aiohttp.ClientWebSocketResponse,
+    client_ws: WebSocket,
+    session_id: str,
+    persist: SessionAudioQueue,
+    stats: CallStats,
 ):
-    """Принимает аудио/текст от STT/TTS сервиса, сохраняет и пересылает клиенту."""
+    """Принимает аудио/текст от STT/TTS сервиса, пересылает клиенту и сохраняет в фоне."""
     try:
         async for msg in stt_ws:
             if msg.type == aiohttp.WSMsgType.BINARY:
-                # Сохраняем аудио бота
-                try:
-                    await anyio.to_thread.run_sync(
-                        save_audio_chunk_sync, msg.data, session_id, "bot", "audio/webm"
-                    )
-                    logger.debug(f"Saved bot audio chunk for session {session_id}")
-                except Exception as e:
-                    logger.exception(
-                        "Failed saving bot audio chunk for session %s", session_id
-                    )
+                received_at = time.perf_counter()
+                stats.record_frame("bot", len(msg.data))
 
                 if client_ws.client_state.name == "CONNECTED":
                     await client_ws.send_bytes(msg.data)
+                    stats.record_stt_to_client(time.perf_counter() - received_at)
+
+                # Сохраняем аудио бота в фоне
+                await persist.submit("bot", msg.data)
             elif msg.type == aiohttp.WSMsgType.TEXT:
                 # Обработка текстовых сообщений от STT/TTS
-                logger.info(f"Received text message from STT/TTS: {msg.data}")
+                logger.debug(
+                    f"Received text message from STT/TTS: {len(msg.data)} chars"
+                )
                 if client_ws.client_state.name == "CONNECTED":
                     await client_ws.send_text(msg.data)
             elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
@@ -88,9 +92,28 @@ async def stt_to_client(
         logger.exception("Error in stt_to_client: %s", e)
 
 
+@router.get("/calls/status")
+def calls_status():
+    """Состояние контроля допуска звонков в этом воркере."""
+    return call_admission.status()
+
+
 @router.websocket("/call/{token}")
 async def call_ws(websocket: WebSocket, token: str):
     await websocket.accept()
+
+    # Контроль допуска: при перегрузке отклоняем звонок до любой работы с БД и STT
+    if not await call_admission.acquire():
+        await websocket.close(code=CLOSE_CODE_BUSY, reason="Server busy")
+        return
+
+    try:
+        await _handle_call(websocket, token)
+    finally:
+        call_admission.release()
+
+
+async def _handle_call(websocket: WebSocket, token: str):
     session_id = uuid.uuid4().hex
 
     # Проверка токена и состояния встречи
@@ -110,27 +133,32 @@ async def call_ws(websocket: WebSocket, token: str):
     )
 
     stt_ws = None
-    temp_stt_client = None
     tasks = []
+    writers = {}
+    mixer = LiveMixer(meeting.id, session_id) if LIVE_MIX_ENABLED else None
+    persist = SessionAudioQueue(session_id, writers, mixer=mixer)
+    stats = CallStats(session_id)
 
     try:
-        # Устанавливаем соединение с STT/TTS сервисом
-        stt_client = get_stt_client()
-        stt_url_with_token = f"{stt_client.url}/{token}"
-
-        # Создаем временный клиент с правильным URL
-        temp_stt_client = STTClient(stt_url_with_token)
-        stt_ws = await temp_stt_client.connect()
+        # Открываем дорожки записи (в режиме multipart - по upload на роль)
+        for role in ("participant", "bot"):
+            writers[role] = await open_track_writer(session_id, role, "audio/webm")
+        if mixer is not None:
+            await mixer.start()
+        persist.start()
+
+        # Устанавливаем соединение с STT/TTS сервисом через общую сессию
+        stt_ws = await get_stt_client().connect(token)
         logger.info(
             "Successfully connected to STT/TTS service for session %s", session_id
         )
 
         # Запускаем задачи обмена аудио
         task_client_to_stt = asyncio.create_task(
-            client_to_stt(websocket, stt_ws, session_id)
+            client_to_stt(websocket, stt_ws, session_id, persist, stats)
         )
         task_stt_to_client = asyncio.create_task(
-            stt_to_client(stt_ws, websocket, session_id)
+            stt_to_client(stt_ws, websocket, session_id, persist, stats)
         )
 
         tasks = [task_client_to_stt, task_stt_to_client]
@@ -168,13 +196,6 @@ async def call_ws(websocket: WebSocket, token: str):
             except Exception as e:
                 logger.warning(f"Error closing STT/TTS connection: {e}")
 
-        # Закрываем клиентскую сессию STT/TTS
-        if temp_stt_client:
-            try:
-                await temp_stt_client.close()
-            except Exception as e:
-                logger.warning(f"Error closing STT/TTS client session: {e}")
-
         # Закрываем клиентское соединение если оно еще открыто
         if websocket.client_state.name == "CONNECTED":
             try:
@@ -182,6 +203,30 @@ async def call_ws(websocket: WebSocket, token: str):
             except Exception as e:
                 logger.warning(f"Error closing client WebSocket connection: {e}")
 
+        # Дописываем очередь и дорожки до запуска пост-обработки
+        await persist.close()
+        logger.info(
+            "Call session %s summary: relay=%s, write_queue=%s",
+            session_id,
+            stats.summary(),
+            persist.stats(),
+        )
+        try:
+            await metadata_batcher.flush()
+        except Exception as e:
+            logger.exception(
+                "Failed to flush audio metadata for session %s: %s", session_id, e
+            )
+
+        # Дописываем хвост live-сведения; при неудаче запись соберет воркер
+        if mixer is not None:
+            try:
+                await mixer.finalize()
+            except Exception as e:
+                logger.exception(
+                    "Failed to finalize live mix for session %s: %s", session_id, e
+                )
+
         # Помечаем встречу как завершенную в БД и сохраняем session_id
         try:
             await anyio.to_thread.run_sync(finish_meeting_sync, token, session_id)
@@ -191,16 +236,10 @@ async def call_ws(websocket: WebSocket, token: str):
                 "Failed to finish meeting for token %s in DB: %s", token, e
             )
 
-        # Инициируем пост-обработку (объединение аудио)
+        # Ставим пост-обработку (объединение аудио) в очередь воркера
         try:
-            from backend.services import post_processing
-
-            # Запускаем асинхронно, чтобы не блокировать завершение websocket
-            asyncio.create_task(
-                post_processing.process_and_merge_audio(meeting.id, session_id)
-            )
-            logger.info(
-                f"Post-processing task scheduled for meeting {meeting.id}, session {session_id}"
+            await anyio.to_thread.run_sync(
+                enqueue_post_processing_sync, meeting.id, session_id
             )
         except Exception as e:
             logger.exception(
@@ -55,3 +55,17 @@ class MeetingResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class PostProcessingJobResponse(BaseModel):
+    session_id: str
+    meeting_id: int
+    status: str
+    stage: Optional[str]
+    attempts: int
+    last_error: Optional[str]
+    next_run_at: Optional[datetime]
+    updated_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,167 @@
+# backend/services/audio_queue.py
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from .metrics import (AUDIO_DROPPED_TOTAL, AUDIO_PERSIST_FAILURES_TOTAL,
+                      AUDIO_PERSIST_SECONDS)
+
+logger = logging.getLogger("uvicorn.error")
+
+# Максимальное число чанков в очереди записи одной сессии (обе роли)
+AUDIO_QUEUE_MAX_CHUNKS = int(os.getenv("AUDIO_QUEUE_MAX_CHUNKS", "300"))
+# Поведение при переполнении: "wait" - ждать место до AUDIO_QUEUE_PUT_TIMEOUT,
+# затем отбросить чанк; "drop" - сразу отбросить чанк
+AUDIO_QUEUE_OVERFLOW = os.getenv("AUDIO_QUEUE_OVERFLOW", "wait").lower()
+AUDIO_QUEUE_PUT_TIMEOUT = float(os.getenv("AUDIO_QUEUE_PUT_TIMEOUT", "0.05"))
+# Чанк считается опоздавшим, если пролежал в очереди дольше этого времени
+AUDIO_QUEUE_LATE_SEC = float(os.getenv("AUDIO_QUEUE_LATE_SEC", "2"))
+
+_CLOSE = object()
+
+
+class SessionAudioQueue:
+    """
+    Очередь отложенной записи аудио одной сессии звонка.
+
+    Пересылка аудио между клиентом и STT/TTS не ждет хранилище: чанк кладется в
+    ограниченную asyncio.Queue, а фоновая задача по очереди передает его
+    писателю дорожки соответствующей роли. При переполнении очереди действует
+    политика AUDIO_QUEUE_OVERFLOW. Если задан mixer (LiveMixer), записанные
+    чанки дополнительно отдаются ему для сведения на лету.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        writers: Dict[str, object],
+        maxsize: int = AUDIO_QUEUE_MAX_CHUNKS,
+        overflow: str = AUDIO_QUEUE_OVERFLOW,
+        put_timeout: float = AUDIO_QUEUE_PUT_TIMEOUT,
+        mixer=None,
+    ):
+        self.session_id = session_id
+        self.writers = writers
+        self.mixer = mixer
+        self.overflow = overflow
+        self.put_timeout = put_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.late = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.persist_seconds_total = 0.0
+        self.persist_seconds_max = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def submit(self, role: str, data: bytes) -> bool:
+        """Ставит чанк в очередь записи. Возвращает False, если чанк отброшен."""
+        if not data:
+            return False
+        item = (role, data, time.monotonic())
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            if self.overflow != "wait":
+                return self._drop(role)
+            # Backpressure: ненадолго притормаживаем источник
+            self.blocked += 1
+            try:
+                await asyncio.wait_for(self._queue.put(item), self.put_timeout)
+            except asyncio.TimeoutError:
+                return self._drop(role)
+
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    async def close(self):
+        """Дописывает все, что осталось в очереди, и закрывает писателей дорожек."""
+        if self._task is not None:
+            await self._queue.put(_CLOSE)
+            await self._task
+            self._task = None
+
+        for role, writer in self.writers.items():
+            try:
+                await writer.close()
+            except Exception as e:
+                AUDIO_PERSIST_FAILURES_TOTAL.inc(role=role)
+                logger.exception(
+                    "Failed closing %s audio track for session %s: %s",
+                    role,
+                    self.session_id,
+                    e,
+                )
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "late": self.late,
+            "failed": self.failed,
+            "persist_avg_ms": round(
+                self.persist_seconds_total / self.written * 1000 if self.written else 0,
+                2,
+            ),
+            "persist_max_ms": round(self.persist_seconds_max * 1000, 2),
+        }
+
+    def _drop(self, role: str) -> bool:
+        self.dropped += 1
+        AUDIO_DROPPED_TOTAL.inc(role=role)
+        if self.dropped == 1 or self.dropped % 100 == 0:
+            logger.warning(
+                "Audio write queue full for session %s, dropped %d chunks (last role: %s)",
+                self.session_id,
+                self.dropped,
+                role,
+            )
+        return False
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is _CLOSE:
+                break
+            role, data, enqueued_at = item
+            if time.monotonic() - enqueued_at > AUDIO_QUEUE_LATE_SEC:
+                self.late += 1
+            started = time.perf_counter()
+            try:
+                await self.writers[role].write(data)
+                self.written += 1
+                if self.mixer is not None:
+                    self.mixer.feed(role, data)
+            except Exception:
+                self.failed += 1
+                AUDIO_PERSIST_FAILURES_TOTAL.inc(role=role)
+                logger.exception(
+                    "Failed saving %s audio chunk for session %s",
+                    role,
+                    self.session_id,
+                )
+                continue
+            # Учитываются только успешные записи (в режиме segments - и те,
+            # что легли в буфер сегмента); сохраненные объекты считает
+            # call_audio_objects_persisted_total
+            elapsed = time.perf_counter() - started
+            self.persist_seconds_total += elapsed
+            self.persist_seconds_max = max(self.persist_seconds_max, elapsed)
+            AUDIO_PERSIST_SECONDS.observe(elapsed, role=role)
@@ -0,0 +1,313 @@
+# backend/services/audio_spool.py
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import Optional
+
+import anyio
+
+from ..utils.webm import webm_file_duration_seconds
+from .audio_store import TrackDuration, metadata_batcher, register_audio_object
+from .metrics import AUDIO_OBJECTS_PERSISTED_TOTAL
+from .storage import get_storage
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки файлов спула недоступны
+    fcntl = None
+
+logger = logging.getLogger("uvicorn.error")
+
+AUDIO_SPOOL_DIR = os.getenv(
+    "AUDIO_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "aihr_spool")
+)
+# Сколько хранить уже отправленные в MinIO спулы, которые никто не забрал
+AUDIO_SPOOL_RETENTION_SEC = float(os.getenv("AUDIO_SPOOL_RETENTION_SEC", "86400"))
+# Как часто API удаляет отправленные спулы старше AUDIO_SPOOL_RETENTION_SEC
+AUDIO_SPOOL_PRUNE_INTERVAL_SEC = float(
+    os.getenv("AUDIO_SPOOL_PRUNE_INTERVAL_SEC", "600")
+)
+# Хранить ли отправленную дорожку для пост-обработки на этом узле. Имеет смысл,
+# только если воркер видит тот же AUDIO_SPOOL_DIR (тот же хост или общий том);
+# иначе копию некому забрать, и ее лучше удалить сразу после отправки
+AUDIO_SPOOL_KEEP_SHIPPED = os.getenv("AUDIO_SPOOL_KEEP_SHIPPED", "1").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+# Состояния файла дорожки в спуле:
+#   {role}.webm.part    - идет запись
+#   {role}.webm         - запись закрыта, но в MinIO еще не отправлена
+#   {role}.shipped.webm - отправлена в MinIO, хранится для локальной пост-обработки
+_PART_SUFFIX = ".webm.part"
+_CLOSED_SUFFIX = ".webm"
+_SHIPPED_SUFFIX = ".shipped.webm"
+
+
+def _session_dir(session_id: str) -> str:
+    return os.path.join(AUDIO_SPOOL_DIR, session_id)
+
+
+def _track_object_name(session_id: str, role: str) -> str:
+    return f"calls/{session_id}/{role}.webm"
+
+
+def _try_lock(fd: int) -> bool:
+    """Берет эксклюзивную блокировку на файл. Без fcntl считаем, что удалось."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class SpoolTrackWriter:
+    """
+    Пишет дорожку (session_id, role) в локальный append-only файл: один вызов
+    write() на чанк, без обращения к MinIO и БД во время звонка. В close() файл
+    отправляется в MinIO одним объектом и регистрируется в AudioObject, а сам
+    файл остается на диске для пост-обработки, если воркер видит этот же
+    AUDIO_SPOOL_DIR (см. AUDIO_SPOOL_KEEP_SHIPPED).
+
+    Пока звонок идет и пока дорожка отправляется, файл заблокирован (flock),
+    чтобы восстановление после сбоя в соседнем воркере не забрало живую
+    дорожку и не отправило ее второй раз.
+    """
+
+    def __init__(self, session_id: str, role: str, content_type: str = "audio/webm"):
+        self.session_id = session_id
+        self.role = role
+        self.content_type = content_type
+        self.path = os.path.join(_session_dir(session_id), role + _PART_SUFFIX)
+        self._fd: Optional[int] = None
+        self._size = 0
+        self._duration = TrackDuration(session_id, role)
+
+    async def open(self):
+        os.makedirs(_session_dir(self.session_id), exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if not _try_lock(fd):
+            os.close(fd)
+            raise RuntimeError(f"Spool track {self.path} is locked by another process")
+        self._fd = fd
+
+    async def write(self, data: bytes):
+        if not data:
+            return
+        # Дозапись в page cache локального диска, вне event loop
+        await anyio.to_thread.run_sync(os.write, self._fd, data)
+        self._size += len(data)
+        self._duration.feed(data)
+
+    async def close(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        # Блокировка держится до конца отправки: переименованный файл - тот же
+        # inode, и recover_spools в другом процессе его пропустит
+        try:
+            await anyio.to_thread.run_sync(os.fsync, fd)
+            if self._size == 0:
+                os.unlink(self.path)
+                return
+
+            closed_path = self.path[: -len(_PART_SUFFIX)] + _CLOSED_SUFFIX
+            os.replace(self.path, closed_path)
+            await ship_spooled_track(
+                self.session_id,
+                self.role,
+                closed_path,
+                self.content_type,
+                duration_sec=self._duration.total_seconds,
+            )
+        finally:
+            os.close(fd)
+
+
+async def ship_spooled_track(
+    session_id: str,
+    role: str,
+    path: str,
+    content_type: str = "audio/webm",
+    duration_sec: Optional[float] = None,
+) -> str:
+    """
+    Отправляет закрытый файл дорожки в MinIO и регистрирует AudioObject.
+    Если длительность не передана (восстановление после сбоя), она считается
+    по файлу. Возвращает путь к сохраненной копии или None, если
+    AUDIO_SPOOL_KEEP_SHIPPED выключен и файл удален.
+    """
+    object_name = _track_object_name(session_id, role)
+    size = os.path.getsize(path)
+    await get_storage().put_file(object_name, path, content_type=content_type)
+    AUDIO_OBJECTS_PERSISTED_TOTAL.inc(role=role)
+    if duration_sec is None:
+        try:
+            duration_sec = round(
+                await anyio.to_thread.run_sync(webm_file_duration_seconds, path), 3
+            )
+        except Exception as e:
+            logger.warning(f"Cannot measure duration of spooled track {path}: {e}")
+    register_audio_object(session_id, object_name, role, size, duration_sec)
+    logger.info(f"Spooled track shipped to MinIO: {object_name} ({size} bytes)")
+
+    if not AUDIO_SPOOL_KEEP_SHIPPED:
+        os.unlink(path)
+        _remove_empty_dir(_session_dir(session_id))
+        return None
+    shipped_path = os.path.join(_session_dir(session_id), role + _SHIPPED_SUFFIX)
+    os.replace(path, shipped_path)
+    return shipped_path
+
+
+def _remove_empty_dir(path: str):
+    try:
+        os.rmdir(path)
+    except OSError:
+        pass  # не пуста или уже удалена
+
+
+def find_spooled_track(session_id: str, role: str) -> Optional[str]:
+    """Возвращает путь к локальной копии уже отправленной дорожки, если она есть."""
+    path = os.path.join(_session_dir(session_id), role + _SHIPPED_SUFFIX)
+    return path if os.path.exists(path) else None
+
+
+def remove_spool(session_id: str):
+    """Удаляет спул сессии после успешной пост-обработки."""
+    session_dir = _session_dir(session_id)
+    if not os.path.isdir(session_dir):
+        return
+    for name in os.listdir(session_dir):
+        try:
+            os.unlink(os.path.join(session_dir, name))
+        except OSError as e:
+            logger.warning(f"Could not delete spool file {name}: {e}")
+    _remove_empty_dir(session_dir)
+
+
+def prune_shipped_spools(retention: float = AUDIO_SPOOL_RETENTION_SEC) -> int:
+    """
+    Удаляет отправленные в MinIO дорожки старше retention секунд, которые не
+    забрала пост-обработка, и опустевшие каталоги сессий. Возвращает число
+    удаленных файлов.
+    """
+    if not os.path.isdir(AUDIO_SPOOL_DIR):
+        return 0
+
+    removed = 0
+    now = time.time()
+    for session_id in os.listdir(AUDIO_SPOOL_DIR):
+        session_dir = _session_dir(session_id)
+        if not os.path.isdir(session_dir):
+            continue
+        for name in os.listdir(session_dir):
+            if not name.endswith(_SHIPPED_SUFFIX):
+                continue
+            path = os.path.join(session_dir, name)
+            try:
+                if now - os.path.getmtime(path) > retention:
+                    os.unlink(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # удалил remove_spool после пост-обработки
+        if not os.listdir(session_dir):
+            _remove_empty_dir(session_dir)
+
+    if removed:
+        logger.info(f"Pruned {removed} shipped audio spool tracks")
+    return removed
+
+
+class SpoolPruner:
+    """
+    Периодически удаляет устаревшие отправленные спулы в процессе API: спулы
+    пишет API, а удаляет их только пост-обработка на узле, который их видит.
+    """
+
+    def __init__(self, interval: float = AUDIO_SPOOL_PRUNE_INTERVAL_SEC):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await anyio.to_thread.run_sync(prune_shipped_spools)
+            except Exception as e:
+                logger.error(f"Failed to prune audio spools: {e}")
+
+
+spool_pruner = SpoolPruner()
+
+
+async def recover_spools() -> int:
+    """
+    Находит спулы, оставшиеся после падения воркера, отправляет их в MinIO и
+    регистрирует в БД. Дорожки, которые еще пишет живой воркер, пропускаются.
+    Возвращает число восстановленных дорожек.
+    """
+    if not os.path.isdir(AUDIO_SPOOL_DIR):
+        return 0
+
+    recovered = 0
+    for session_id in os.listdir(AUDIO_SPOOL_DIR):
+        session_dir = _session_dir(session_id)
+        if not os.path.isdir(session_dir):
+            continue
+
+        for name in os.listdir(session_dir):
+            path = os.path.join(session_dir, name)
+            if name.endswith(_SHIPPED_SUFFIX):
+                continue
+            if name.endswith(_PART_SUFFIX):
+                role = name[: -len(_PART_SUFFIX)]
+            elif name.endswith(_CLOSED_SUFFIX):
+                role = name[: -len(_CLOSED_SUFFIX)]
+            else:
+                continue
+
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue  # дорожку только что отправил живой воркер
+            try:
+                if not _try_lock(fd):
+                    continue  # дорожку пишет или отправляет живой звонок
+                if not os.path.exists(path):
+                    continue  # отправлена, пока мы ждали блокировку
+                if os.path.getsize(path) == 0:
+                    os.unlink(path)
+                    continue
+                await ship_spooled_track(session_id, role, path)
+                recovered += 1
+            except Exception as e:
+                logger.error(f"Failed to recover spooled track {path}: {e}")
+            finally:
+                os.close(fd)
+
+        if not os.listdir(session_dir):
+            _remove_empty_dir(session_dir)
+
+    if recovered:
+        await metadata_batcher.flush()
+        logger.info(f"Recovered {recovered} spooled audio tracks")
+    return recovered
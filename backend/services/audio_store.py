@@ -1,27 +1,66 @@
 # backend/services/audio_store.py
+import asyncio
+import datetime
 import logging
+import os
+import threading
 import time
 import uuid
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError, OperationalError
 
 from .. import database, models
-from .minio_client import get_minio_client
+from ..utils.webm import WebMDurationCounter
+from .metrics import AUDIO_OBJECTS_PERSISTED_TOTAL
+from .storage import MultipartUpload, get_storage
 
 logger = logging.getLogger("uvicorn.error")
 
+# Пороги склейки 100 мс чанков MediaRecorder в один сегмент
+AUDIO_SEGMENT_MAX_BYTES = int(os.getenv("AUDIO_SEGMENT_MAX_BYTES", str(256 * 1024)))
+AUDIO_SEGMENT_MAX_SECONDS = float(os.getenv("AUDIO_SEGMENT_MAX_SECONDS", "5"))
+
+# Режим загрузки дорожек звонка: "segments" - отдельный объект на сегмент,
+# "multipart" - один S3 multipart upload на (session_id, role),
+# "spool" - локальный файл на (session_id, role), отправляется в MinIO после звонка
+AUDIO_UPLOAD_MODE = os.getenv("AUDIO_UPLOAD_MODE", "segments").lower()
+# S3 требует, чтобы все части, кроме последней, были не меньше 5 MiB
+AUDIO_MULTIPART_PART_SIZE = max(
+    int(os.getenv("AUDIO_MULTIPART_PART_SIZE", str(5 * 1024 * 1024))),
+    5 * 1024 * 1024,
+)
+
+# Пакетная запись метаданных AudioObject
+AUDIO_METADATA_FLUSH_INTERVAL = float(os.getenv("AUDIO_METADATA_FLUSH_INTERVAL", "1"))
+AUDIO_METADATA_MAX_BATCH = int(os.getenv("AUDIO_METADATA_MAX_BATCH", "500"))
+# Сколько раз строка возвращается в очередь после неудачной вставки по одной.
+# Недоступность БД попыткой не считается: такие строки ждут в очереди
+AUDIO_METADATA_MAX_RETRIES = int(os.getenv("AUDIO_METADATA_MAX_RETRIES", "5"))
+# Предел очереди строк (например, пока БД недоступна); старые строки сверх
+# него отбрасываются - их объекты позже удалит уборщик
+AUDIO_METADATA_MAX_PENDING = int(os.getenv("AUDIO_METADATA_MAX_PENDING", "50000"))
 
-def save_audio_chunk_sync(
-    data: bytes, session_id: str, role: str, content_type: str = "audio/webm"
+
+async def save_audio_chunk(
+    data: bytes,
+    session_id: str,
+    role: str,
+    content_type: str = "audio/webm",
+    duration_sec: Optional[float] = None,
 ) -> Dict:
     """
-    Синхронная функция: сохраняет байты аудио в MinIO и создает запись AudioObject в БД.
-    Вызывается через anyio.to_thread.run_sync.
+    Сохраняет байты аудио в MinIO через асинхронный слой хранилища и ставит
+    запись AudioObject в пакетную вставку.
 
     Args:
         data: Байты аудио данных.
         session_id: Уникальный идентификатор сессии звонка.
         role: Роль отправителя ('participant' или 'bot').
         content_type: MIME-тип аудио файла.
+        duration_sec: Длительность аудио в чанке, если известна.
     """
     if not data:
         logger.warning(
@@ -34,39 +73,20 @@ def save_audio_chunk_sync(
     )
 
     try:
-        minio = get_minio_client()
         ts = int(time.time() * 1000)
         # Используем роль в имени объекта для будущего удобства
         object_name = f"calls/{session_id}/{role}_{ts}_{uuid.uuid4().hex}.webm"
 
         # положить в minio
-        minio.put_bytes(object_name, data, content_type=content_type)
-        logger.info(f"Audio chunk saved to MinIO: {object_name}")
+        await get_storage().put_bytes(object_name, data, content_type=content_type)
+        logger.debug(f"Audio chunk saved to MinIO: {object_name}")
 
-        # записать метаданные в БД (синхронно)
-        db = database.SessionLocal()
-        try:
-            ao = models.AudioObject(
-                session_id=session_id,
-                object_key=object_name,
-                role=role,  # Сохраняем роль
-                duration_sec=None,  # Пока не определяем
-                size_bytes=len(data),
-                is_final=False,  # Чанк, не финальный файл
-            )
-            db.add(ao)
-            db.commit()
-            db.refresh(ao)
-            logger.debug(f"AudioObject record created in DB: ID {ao.id}")
-            return {
-                "id": ao.id,
-                "object_key": ao.object_key,
-                "size_bytes": ao.size_bytes,
-                "created_at": ao.created_at,
-                "role": ao.role,
-            }
-        finally:
-            db.close()
+        AUDIO_OBJECTS_PERSISTED_TOTAL.inc(role=role)
+
+        # метаданные попадут в БД со следующей пакетной вставкой
+        return register_audio_object(
+            session_id, object_name, role, len(data), duration_sec
+        )
     except Exception as e:
         logger.exception(
             "Failed to save audio chunk (session_id=%s, role=%s): %s",
@@ -75,3 +95,375 @@ def save_audio_chunk_sync(
             e,
         )
         raise  # Перебрасываем исключение, чтобы вызывающая функция могла обработать ошибку
+
+
+class AudioMetadataBatcher:
+    """
+    Накапливает записи AudioObject от всех активных сессий и пишет их в БД одной
+    многострочной вставкой раз в AUDIO_METADATA_FLUSH_INTERVAL секунд, без
+    refresh. created_at проставляется в момент сохранения чанка, чтобы порядок
+    чанков в пост-обработке не зависел от момента вставки.
+
+    add() потокобезопасен: его можно вызывать и из event loop, и из потоков.
+    """
+
+    def __init__(
+        self,
+        interval: float = AUDIO_METADATA_FLUSH_INTERVAL,
+        max_batch: int = AUDIO_METADATA_MAX_BATCH,
+        max_retries: int = AUDIO_METADATA_MAX_RETRIES,
+        max_pending: int = AUDIO_METADATA_MAX_PENDING,
+    ):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        # (строка, число неудачных попыток)
+        self._rows: List[Tuple[Dict, int]] = []
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, row: Dict):
+        with self._lock:
+            self._rows.append((row, 0))
+            self._trim()
+
+    def _trim(self):
+        # Вызывается под self._lock
+        overflow = len(self._rows) - self.max_pending
+        if overflow > 0:
+            del self._rows[:overflow]
+            logger.error(
+                f"AudioObject queue is full, dropped {overflow} oldest records"
+            )
+
+    def _requeue(self, entries: List[Tuple[Dict, int]], count: bool = True):
+        """
+        Возвращает строки в начало очереди. С count=True неудача считается
+        попыткой, и строки, исчерпавшие попытки, отбрасываются; с count=False
+        (БД недоступна) строки ждут без ограничения, кроме max_pending.
+        """
+        if not count:
+            with self._lock:
+                self._rows[:0] = entries
+                self._trim()
+            return
+        retry = []
+        for row, attempts in entries:
+            if attempts + 1 >= self.max_retries:
+                logger.error(
+                    f"Dropping AudioObject record {row['object_key']} "
+                    f"after {attempts + 1} failed inserts"
+                )
+            else:
+                retry.append((row, attempts + 1))
+        with self._lock:
+            self._rows[:0] = retry
+            self._trim()
+
+    def flush_sync(self) -> int:
+        """Записывает все накопленные строки. Возвращает число вставленных."""
+        with self._lock:
+            entries, self._rows = self._rows, []
+        if not entries:
+            return 0
+
+        db = database.SessionLocal()
+        try:
+            for start in range(0, len(entries), self.max_batch):
+                db.execute(
+                    insert(models.AudioObject),
+                    [row for row, _ in entries[start : start + self.max_batch]],
+                )
+            db.commit()
+            logger.debug(f"Inserted {len(entries)} AudioObject records in batch")
+            return len(entries)
+        except OperationalError:
+            # БД недоступна: повторим всю пачку на следующем цикле, не тратя
+            # попытки строк
+            db.rollback()
+            self._requeue(entries, count=False)
+            raise
+        except Exception as e:
+            db.rollback()
+            logger.warning(
+                f"AudioObject batch insert failed, retrying row by row: {e}"
+            )
+        finally:
+            db.close()
+        return self._insert_one_by_one(entries)
+
+    def _insert_one_by_one(self, entries: List[Tuple[Dict, int]]) -> int:
+        """
+        Вставляет строки по одной, чтобы одна плохая строка (например, с
+        несуществующим meeting_id) не блокировала остальные. Строки с
+        нарушением ограничений отбрасываются сразу, прочие - возвращаются в
+        очередь с учетом попытки. Если БД становится недоступна, оставшиеся
+        строки возвращаются в очередь без учета попытки.
+        """
+        inserted = 0
+        failed = []
+        db = database.SessionLocal()
+        try:
+            for index, (row, attempts) in enumerate(entries):
+                try:
+                    db.execute(insert(models.AudioObject), [row])
+                    db.commit()
+                    inserted += 1
+                except OperationalError:
+                    db.rollback()
+                    self._requeue(failed)
+                    self._requeue(entries[index:], count=False)
+                    raise
+                except (IntegrityError, DataError) as e:
+                    db.rollback()
+                    logger.error(
+                        f"Dropping invalid AudioObject record {row['object_key']}: {e}"
+                    )
+                except Exception as e:
+                    db.rollback()
+                    logger.warning(
+                        f"Cannot insert AudioObject record {row['object_key']}: {e}"
+                    )
+                    failed.append((row, attempts))
+        finally:
+            db.close()
+        if failed:
+            self._requeue(failed)
+        return inserted
+
+    async def flush(self) -> int:
+        return await anyio.to_thread.run_sync(self.flush_sync)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to insert AudioObject batch: {e}")
+
+
+metadata_batcher = AudioMetadataBatcher()
+
+
+def register_audio_object(
+    session_id: str,
+    object_key: str,
+    role: str,
+    size_bytes: int,
+    duration_sec: Optional[float] = None,
+) -> Dict:
+    """
+    Ставит запись AudioObject для уже сохраненного в MinIO объекта в пакетную
+    вставку и сразу возвращает ее данные (без id).
+    """
+    row = {
+        "session_id": session_id,
+        "object_key": object_key,
+        "role": role,
+        "duration_sec": duration_sec,
+        "size_bytes": size_bytes,
+        "is_final": False,  # Чанк, не финальный файл
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+    }
+    metadata_batcher.add(row)
+    return {
+        "object_key": object_key,
+        "size_bytes": size_bytes,
+        "created_at": row["created_at"],
+        "role": role,
+    }
+
+
+class TrackDuration:
+    """
+    Длительность дорожки по мере записи: чанки разбираются как поток WebM.
+    Разбор - лучшее усилие: на любой ошибке длительность становится
+    неизвестной (None), а запись аудио продолжается.
+    """
+
+    def __init__(self, session_id: str, role: str):
+        self.session_id = session_id
+        self.role = role
+        self._counter: Optional[WebMDurationCounter] = WebMDurationCounter()
+
+    def feed(self, data: bytes) -> Optional[float]:
+        """Возвращает длительность блоков, завершившихся в data, секунд."""
+        if self._counter is None:
+            return None
+        try:
+            return round(self._counter.feed(data), 3)
+        except Exception as e:
+            logger.warning(
+                f"Cannot measure {self.role} audio duration for session {self.session_id}: {e}"
+            )
+            self._counter = None
+            return None
+
+    @property
+    def total_seconds(self) -> Optional[float]:
+        if self._counter is None:
+            return None
+        return round(self._counter.total_seconds, 3)
+
+
+class AudioSegmentWriter:
+    """
+    Буферизует входящие чанки одной дорожки (session_id, role) в памяти и
+    сохраняет их одним объектом и одной записью AudioObject, когда буфер
+    достигает порога по размеру или по времени. Остаток сбрасывается в close().
+
+    Чанки MediaRecorder являются последовательными кусками одного потока WebM,
+    поэтому их конкатенация не меняет результат пост-обработки.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        role: str,
+        content_type: str = "audio/webm",
+        max_bytes: int = AUDIO_SEGMENT_MAX_BYTES,
+        max_seconds: float = AUDIO_SEGMENT_MAX_SECONDS,
+    ):
+        self.session_id = session_id
+        self.role = role
+        self.content_type = content_type
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self._buffer = bytearray()
+        self._started_at: Optional[float] = None
+        self._duration = TrackDuration(session_id, role)
+
+    async def open(self):
+        """Сегменты создаются по мере записи, открывать ничего не нужно."""
+
+    def append(self, data: bytes) -> Optional[bytes]:
+        """Добавляет чанк в буфер. Возвращает готовый сегмент, если порог достигнут."""
+        if not data:
+            return None
+        if self._started_at is None:
+            self._started_at = time.monotonic()
+        self._buffer += data
+
+        if (
+            len(self._buffer) >= self.max_bytes
+            or time.monotonic() - self._started_at >= self.max_seconds
+        ):
+            return self.drain()
+        return None
+
+    def drain(self) -> Optional[bytes]:
+        """Забирает содержимое буфера целиком."""
+        if not self._buffer:
+            return None
+        segment = bytes(self._buffer)
+        self._buffer.clear()
+        self._started_at = None
+        return segment
+
+    async def write(self, data: bytes):
+        segment = self.append(data)
+        if segment:
+            await self._flush(segment)
+
+    async def close(self):
+        """Сохраняет остаток буфера. Вызывается при отключении."""
+        segment = self.drain()
+        if segment:
+            await self._flush(segment)
+
+    async def _flush(self, segment: bytes):
+        await save_audio_chunk(
+            segment,
+            self.session_id,
+            self.role,
+            self.content_type,
+            duration_sec=self._duration.feed(segment),
+        )
+        logger.debug(
+            f"Flushed {len(segment)} bytes segment for session {self.session_id}, role {self.role}"
+        )
+
+
+class MultipartTrackWriter:
+    """
+    Пишет всю дорожку (session_id, role) в один объект MinIO через S3 multipart
+    upload. Upload открывается при старте звонка, части по
+    AUDIO_MULTIPART_PART_SIZE дописываются по мере поступления аудио, а в close()
+    загружается хвост, upload завершается и создается одна запись AudioObject.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        role: str,
+        content_type: str = "audio/webm",
+        part_size: int = AUDIO_MULTIPART_PART_SIZE,
+    ):
+        self.session_id = session_id
+        self.role = role
+        self.object_name = f"calls/{session_id}/{role}.webm"
+        self._upload = MultipartUpload(self.object_name, content_type, part_size)
+        self._duration = TrackDuration(session_id, role)
+
+    async def open(self):
+        await self._upload.open()
+
+    async def write(self, data: bytes):
+        self._duration.feed(data)
+        parts = self._upload.part_count
+        await self._upload.write(data)
+        self._count_parts(parts)
+
+    async def close(self):
+        """Загружает последнюю часть и завершает upload."""
+        parts = self._upload.part_count
+        size = await self._upload.complete()
+        self._count_parts(parts)
+        if size:
+            register_audio_object(
+                self.session_id,
+                self.object_name,
+                self.role,
+                size,
+                self._duration.total_seconds,
+            )
+
+    async def abort(self):
+        await self._upload.abort()
+
+    def _count_parts(self, before: int):
+        uploaded = self._upload.part_count - before
+        if uploaded:
+            AUDIO_OBJECTS_PERSISTED_TOTAL.inc(uploaded, role=self.role)
+
+
+async def open_track_writer(
+    session_id: str, role: str, content_type: str = "audio/webm"
+):
+    """Создает и открывает писатель дорожки согласно AUDIO_UPLOAD_MODE."""
+    if AUDIO_UPLOAD_MODE == "multipart":
+        writer = MultipartTrackWriter(session_id, role, content_type)
+    elif AUDIO_UPLOAD_MODE == "spool":
+        from .audio_spool import SpoolTrackWriter
+
+        writer = SpoolTrackWriter(session_id, role, content_type)
+    else:
+        writer = AudioSegmentWriter(session_id, role, content_type)
+    await writer.open()
+    return writer
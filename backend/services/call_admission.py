@@ -0,0 +1,93 @@
+# backend/services/call_admission.py
+import asyncio
+import logging
+import os
+from typing import Dict
+
+logger = logging.getLogger("uvicorn.error")
+
+# Максимум одновременных звонков на воркер (0 - без ограничения)
+CALL_MAX_CONCURRENT = int(os.getenv("CALL_MAX_CONCURRENT", "50"))
+# Сколько ждать свободного места в очереди, секунд (0 - сразу отклонять)
+CALL_QUEUE_TIMEOUT = float(os.getenv("CALL_QUEUE_TIMEOUT", "0"))
+# Максимальная длина очереди ожидающих звонков
+CALL_MAX_QUEUED = int(os.getenv("CALL_MAX_QUEUED", "20"))
+
+# Код закрытия WebSocket для звонков, не прошедших контроль допуска
+CLOSE_CODE_BUSY = 4003
+
+
+class CallAdmission:
+    """
+    Контроль допуска звонков: ограничивает число одновременных сессий на воркер.
+    Звонки сверх лимита либо сразу отклоняются, либо ждут в очереди не дольше
+    queue_timeout секунд.
+    """
+
+    def __init__(
+        self,
+        limit: int = CALL_MAX_CONCURRENT,
+        queue_timeout: float = CALL_QUEUE_TIMEOUT,
+        max_queued: int = CALL_MAX_QUEUED,
+    ):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.max_queued = max_queued
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    async def acquire(self) -> bool:
+        """Пытается занять место под звонок. Возвращает False, если звонок отклонен."""
+        if self._semaphore is None:
+            return self._admit()
+
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return self._admit()
+
+        if self.queue_timeout <= 0 or self.queued >= self.max_queued:
+            return self._reject()
+
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return self._reject()
+        finally:
+            self.queued -= 1
+        return self._admit()
+
+    def release(self):
+        self.active -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def status(self) -> Dict[str, int]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+    def _admit(self) -> bool:
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def _reject(self) -> bool:
+        self.rejected += 1
+        logger.warning(
+            "Call rejected by admission control: %d active, %d queued (limit %d)",
+            self.active,
+            self.queued,
+            self.limit,
+        )
+        return False
+
+
+call_admission = CallAdmission()
@@ -0,0 +1,93 @@
+# backend/services/chunk_downloader.py
+import asyncio
+import collections
+import logging
+import os
+from typing import AsyncIterator, Deque, Iterable, Optional
+
+from .storage import AsyncStorage, get_storage
+
+logger = logging.getLogger("uvicorn.error")
+
+# Сколько GET-запросов чанков держать в полете одновременно (на одну дорожку)
+CHUNK_DOWNLOAD_WINDOW = int(os.getenv("CHUNK_DOWNLOAD_WINDOW", "16"))
+# Повторы скачивания одного чанка и базовая задержка между ними, секунд
+CHUNK_DOWNLOAD_RETRIES = int(os.getenv("CHUNK_DOWNLOAD_RETRIES", "3"))
+CHUNK_DOWNLOAD_RETRY_DELAY = float(os.getenv("CHUNK_DOWNLOAD_RETRY_DELAY", "0.5"))
+
+# Ошибки S3, которые повтором не исправить
+_PERMANENT_ERROR_CODES = {"NoSuchKey", "NoSuchBucket", "AccessDenied", "404", "403"}
+
+
+def _is_permanent(error: Exception) -> bool:
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in _PERMANENT_ERROR_CODES
+
+
+class OrderedChunkDownloader:
+    """
+    Скачивает объекты из MinIO с ограниченным окном одновременных запросов и
+    отдает их байты строго в порядке ключей.
+
+    В памяти одновременно не больше window чанков: следующий GET ставится,
+    только когда потребитель забрал очередной результат, поэтому склейка
+    дорожки начинается, пока хвост звонка еще скачивается. Каждый чанк при
+    временной ошибке повторяется отдельно, не роняя всю сборку.
+    """
+
+    def __init__(
+        self,
+        keys: Iterable[str],
+        window: int = CHUNK_DOWNLOAD_WINDOW,
+        retries: int = CHUNK_DOWNLOAD_RETRIES,
+        retry_delay: float = CHUNK_DOWNLOAD_RETRY_DELAY,
+        storage: Optional[AsyncStorage] = None,
+    ):
+        self.keys = keys
+        self.window = max(1, window)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.storage = storage or get_storage()
+        self.downloaded = 0
+        self.retried = 0
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        keys = iter(self.keys)
+        in_flight: Deque[asyncio.Task] = collections.deque()
+
+        def fill():
+            while len(in_flight) < self.window:
+                key = next(keys, None)
+                if key is None:
+                    return
+                in_flight.append(asyncio.create_task(self._download(key)))
+
+        try:
+            fill()
+            while in_flight:
+                data = await in_flight.popleft()
+                fill()
+                self.downloaded += 1
+                yield data
+        finally:
+            # Потребитель остановился или случилась ошибка: гасим хвост окна
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def _download(self, key: str) -> bytes:
+        attempt = 0
+        while True:
+            try:
+                return await self.storage.get_bytes(key)
+            except Exception as e:
+                if attempt >= self.retries or _is_permanent(e):
+                    logger.error(f"Error downloading object {key} from MinIO: {e}")
+                    raise
+                attempt += 1
+                self.retried += 1
+                delay = self.retry_delay * 2 ** (attempt - 1)
+                logger.warning(
+                    f"Download of {key} failed (attempt {attempt}), retry in {delay:.1f}s: {e}"
+                )
+                await asyncio.sleep(delay)
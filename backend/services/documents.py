@@ -0,0 +1,388 @@
+# backend/services/documents.py
+"""
+Файлы резюме и вакансий в объектном хранилище.
+
+Файл хранится под ключом documents/sha256/<hex> от SHA-256 содержимого,
+поэтому одинаковые загрузки занимают в хранилище один объект; в строке БД
+остаются только ключ, размер, хеш и MIME-тип. Объекты никогда не
+перезаписываются и не удаляются из-под строк: на один объект может ссылаться
+несколько резюме и вакансий.
+
+Загрузка из запроса (ingest_upload) читает файл кусками, считая SHA-256 по
+ходу, и сразу пишет его в хранилище: в памяти держится не больше одной части
+multipart upload. Но Starlette читает тело формы целиком (во временный
+файл) еще до вызова обработчика, поэтому сам размер тела ограничивает
+DocumentSizeLimitMiddleware: по Content-Length до чтения, а для chunked -
+по мере чтения.
+
+Строки, загруженные до переноса, еще держат байты в file_data; их переносит
+migrate_documents() (python -m backend.cli migrate-files) пачками и с
+возможностью продолжить после остановки.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import uuid
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import anyio
+from botocore.exceptions import ClientError
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import inspect, text
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .. import database, models
+from .storage import MULTIPART_MIN_PART_SIZE, MultipartUpload, get_storage
+
+logger = logging.getLogger("uvicorn.error")
+
+DOCUMENTS_PREFIX = "documents/sha256/"
+# Незавершенные загрузки больших файлов до переноса под ключ по хешу; то,
+# что осталось здесь после падения процесса, удаляет уборщик
+DOCUMENTS_INCOMING_PREFIX = "documents/incoming/"
+# Максимальный размер файла резюме или вакансии, байт
+MAX_DOCUMENT_SIZE = int(os.getenv("MAX_DOCUMENT_SIZE", str(30 * 1024 * 1024)))
+# Запас на поля формы и границы multipart при ограничении размера тела
+_FORM_OVERHEAD = 64 * 1024
+# Размер куска чтения загружаемого файла
+DOCUMENT_READ_CHUNK_SIZE = 256 * 1024
+# Строк на пачку при переносе file_data в хранилище
+DOCUMENTS_MIGRATION_BATCH = int(os.getenv("DOCUMENTS_MIGRATION_BATCH", "50"))
+
+DOCUMENT_MODELS = (models.Resume, models.Vacancy)
+# Колонки, добавленные к существующим таблицам (create_all их не добавляет)
+_DOCUMENT_COLUMNS = ("file_key", "file_size", "file_sha256", "file_mime")
+
+
+class StoredDocument(NamedTuple):
+    key: str
+    size: int
+    sha256: str
+    mime: str
+
+
+def document_key(sha256: str) -> str:
+    return f"{DOCUMENTS_PREFIX}{sha256}"
+
+
+def guess_mime(filename: Optional[str], fallback: Optional[str] = None) -> str:
+    guessed = mimetypes.guess_type(filename)[0] if filename else None
+    return guessed or fallback or "application/octet-stream"
+
+
+async def _object_exists(key: str) -> bool:
+    try:
+        await get_storage().head_object(key)
+        return True
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+
+
+async def store_document(data: bytes, mime: str) -> StoredDocument:
+    """
+    Кладет файл в хранилище под ключом от SHA-256 содержимого. Если такой
+    объект уже есть, повторно не загружает.
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    key = document_key(sha256)
+    if await _object_exists(key):
+        logger.info(f"Document {key} already stored, {len(data)} bytes")
+    else:
+        await get_storage().put_bytes(key, data, content_type=mime)
+    return StoredDocument(key=key, size=len(data), sha256=sha256, mime=mime)
+
+
+def _too_large(max_size: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Файл слишком большой (макс {max_size // (1024 * 1024)} MB)",
+    )
+
+
+async def ingest_upload(
+    file: UploadFile,
+    mime: str,
+    max_size: int = MAX_DOCUMENT_SIZE,
+    part_size: int = MULTIPART_MIN_PART_SIZE,
+) -> StoredDocument:
+    """
+    Потоково переносит загруженный файл (уже принятый Starlette во временный
+    файл) в хранилище, прерываясь с 413, как только он превысит max_size:
+    тело запроса ограничивает DocumentSizeLimitMiddleware, а здесь - сам файл
+    без полей формы.
+
+    Файл до part_size целиком (почти все резюме) хешируется в памяти и
+    кладется сразу под ключ по хешу. Больший файл пишется multipart upload во
+    временный объект и затем копируется под ключ по хешу на стороне
+    хранилища, если такого объекта еще нет.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    head = bytearray()
+    upload: Optional[MultipartUpload] = None
+    try:
+        while True:
+            chunk = await file.read(DOCUMENT_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise _too_large(max_size)
+            sha256.update(chunk)
+            if upload is not None:
+                await upload.write(chunk)
+                continue
+            head += chunk
+            if len(head) >= part_size:
+                upload = MultipartUpload(
+                    f"{DOCUMENTS_INCOMING_PREFIX}{uuid.uuid4().hex}", mime, part_size
+                )
+                await upload.open()
+                await upload.write(bytes(head))
+                head.clear()
+
+        if upload is None:
+            return await store_document(bytes(head), mime)
+        await upload.complete()
+    except BaseException:
+        if upload is not None:
+            await upload.abort()
+        raise
+
+    digest = sha256.hexdigest()
+    stored = StoredDocument(document_key(digest), size, digest, mime)
+    storage = get_storage()
+    try:
+        if await _object_exists(stored.key):
+            logger.info(f"Document {stored.key} already stored, {size} bytes")
+        else:
+            await storage.copy_object(upload.key, stored.key)
+    finally:
+        await storage.delete_objects([upload.key])
+    return stored
+
+
+class DocumentSizeLimitMiddleware:
+    """
+    Ограничивает размер тела POST-запросов на пути с префиксами prefixes
+    лимитом файла с запасом на поля формы, пока Starlette его еще только
+    читает (разбор multipart идет до вызова обработчика):
+
+    - Content-Length больше лимита - 413 сразу, тело не читается;
+    - без Content-Length (chunked) байты тела считаются по мере чтения, и
+      при превышении клиенту уходит 413, а приложение получает
+      http.disconnect и дальше ничего отправить не может.
+    """
+
+    def __init__(
+        self, app: ASGIApp, prefixes: Sequence[str], max_size: int = MAX_DOCUMENT_SIZE
+    ):
+        self.app = app
+        self.prefixes = tuple(prefixes)
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not scope["path"].startswith(self.prefixes)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.max_size + _FORM_OVERHEAD
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    rejected = True
+                    await self._reject(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+    async def _reject(self, scope: Scope, receive: Receive, send: Send):
+        error = _too_large(self.max_size)
+        response = JSONResponse(
+            {"detail": error.detail},
+            status_code=error.status_code,
+            headers={"Connection": "close"},
+        )
+        await response(scope, receive, send)
+
+
+def apply_document(row, stored: StoredDocument):
+    """Записывает в строку Resume/Vacancy ссылку на файл в хранилище."""
+    row.file_key = stored.key
+    row.file_size = stored.size
+    row.file_sha256 = stored.sha256
+    row.file_mime = stored.mime
+    row.file_data = None
+
+
+# --- СХЕМА ---
+
+
+def ensure_document_columns_sync(engine=None):
+    """
+    Добавляет колонки file_* в существующие таблицы resumes и vacancies и
+    снимает NOT NULL с resumes.file_data. DDL выполняется, только если схема
+    еще не обновлена, так что обычный запуск не берет блокировок таблиц.
+    Безопасна при одновременном запуске нескольких процессов на Postgres.
+    """
+    engine = engine or database.engine
+    postgres = engine.dialect.name == "postgresql"
+    # Postgres пропускает уже добавленную колонку сам, даже если ее только что
+    # добавил соседний процесс
+    add_column = "ADD COLUMN IF NOT EXISTS" if postgres else "ADD COLUMN"
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for model in DOCUMENT_MODELS:
+            table = model.__table__
+            existing = {
+                column["name"]: column for column in inspector.get_columns(table.name)
+            }
+            for name in _DOCUMENT_COLUMNS:
+                if name in existing:
+                    continue
+                column_type = table.c[name].type.compile(dialect=engine.dialect)
+                conn.execute(
+                    text(f"ALTER TABLE {table.name} {add_column} {name} {column_type}")
+                )
+                logger.info(f"Added column {table.name}.{name}")
+            # SQLite не умеет менять ограничения колонок; новые таблицы там и
+            # так создаются с nullable file_data
+            file_data = existing.get("file_data")
+            if postgres and file_data is not None and not file_data["nullable"]:
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table.name} "
+                        "ALTER COLUMN file_data DROP NOT NULL"
+                    )
+                )
+                logger.info(f"Made {table.name}.file_data nullable")
+
+
+# --- ПЕРЕНОС file_data В ХРАНИЛИЩЕ ---
+
+
+def unmigrated_ids_page_sync(model, after_id: int, limit: int) -> List[int]:
+    """Следующая страница id строк, у которых файл еще лежит в file_data."""
+    db = database.SessionLocal()
+    try:
+        return [
+            row_id
+            for (row_id,) in db.query(model.id)
+            .filter(
+                model.id > after_id,
+                model.file_data.isnot(None),
+                model.file_key.is_(None),
+            )
+            .order_by(model.id)
+            .limit(limit)
+        ]
+    finally:
+        db.close()
+
+
+def load_file_data_sync(model, row_id: int) -> Tuple[Optional[str], Optional[bytes]]:
+    """(имя файла, байты) одной строки: в памяти всегда не больше одного файла."""
+    filename_column = (
+        model.original_filename if model is models.Resume else model.file_name
+    )
+    db = database.SessionLocal()
+    try:
+        row = (
+            db.query(filename_column, model.file_data)
+            .filter(model.id == row_id, model.file_key.is_(None))
+            .first()
+        )
+        return (row[0], row[1]) if row else (None, None)
+    finally:
+        db.close()
+
+
+def attach_documents_sync(model, stored: List[Tuple[int, StoredDocument]]):
+    """Одним коммитом проставляет ключи пачке строк и очищает их file_data."""
+    db = database.SessionLocal()
+    try:
+        for row_id, document in stored:
+            db.query(model).filter(model.id == row_id).update(
+                {
+                    model.file_key: document.key,
+                    model.file_size: document.size,
+                    model.file_sha256: document.sha256,
+                    model.file_mime: document.mime,
+                    model.file_data: None,
+                },
+                synchronize_session=False,
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def migrate_documents(
+    batch_size: int = DOCUMENTS_MIGRATION_BATCH, dry_run: bool = False
+) -> dict:
+    """
+    Переносит file_data резюме и вакансий в хранилище. Строки читаются по
+    одной, ключи записываются коммитом на пачку; после остановки перенос
+    продолжается с непереработанных строк (у них file_key еще пуст), а уже
+    загруженные объекты повторно не отправляются.
+    """
+    await anyio.to_thread.run_sync(ensure_document_columns_sync)
+    stats = {}
+    for model in DOCUMENT_MODELS:
+        name = model.__tablename__
+        moved = 0
+        moved_bytes = 0
+        after_id = 0
+        while True:
+            ids = await anyio.to_thread.run_sync(
+                unmigrated_ids_page_sync, model, after_id, batch_size
+            )
+            if not ids:
+                break
+            after_id = ids[-1]
+
+            batch = []
+            for row_id in ids:
+                filename, data = await anyio.to_thread.run_sync(
+                    load_file_data_sync, model, row_id
+                )
+                if data is None:
+                    continue
+                moved += 1
+                moved_bytes += len(data)
+                if not dry_run:
+                    stored = await store_document(data, guess_mime(filename))
+                    batch.append((row_id, stored))
+            if batch:
+                await anyio.to_thread.run_sync(attach_documents_sync, model, batch)
+            logger.info(
+                f"Documents migration: {name} up to id {after_id}, {moved} rows"
+            )
+        stats[name] = {"rows": moved, "bytes": moved_bytes}
+    return stats
@@ -0,0 +1,244 @@
+# backend/services/live_mix.py
+import asyncio
+import collections
+import logging
+import os
+import shutil
+import tempfile
+from typing import Deque, Dict, List, Optional, Sequence
+
+from . import post_processing
+from .storage import MultipartUpload
+
+logger = logging.getLogger("uvicorn.error")
+
+# Сводить запись прямо во время звонка, чтобы она была готова к отбою
+LIVE_MIX_ENABLED = os.getenv("LIVE_MIX_ENABLED", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+# Максимум одновременных live-сведений на процесс; сверх лимита звонок
+# сводится пакетно воркером пост-обработки
+LIVE_MIX_MAX_SESSIONS = int(os.getenv("LIVE_MIX_MAX_SESSIONS", "20"))
+# Сколько байт одной дорожки можно держать, пока ffmpeg ждет другую дорожку
+# (amix не выдает звук, пока нет данных со всех входов)
+LIVE_MIX_MAX_BUFFER_BYTES = int(
+    os.getenv("LIVE_MIX_MAX_BUFFER_BYTES", str(32 * 1024 * 1024))
+)
+# Сколько ждать досведения хвоста после отбоя, секунд
+LIVE_MIX_FINALIZE_TIMEOUT = float(os.getenv("LIVE_MIX_FINALIZE_TIMEOUT", "60"))
+
+_active_sessions = 0
+
+
+class _TrackInput:
+    """Буфер байтов одной дорожки перед FIFO входа ffmpeg."""
+
+    def __init__(self, fifo_path: str):
+        self.fifo_path = fifo_path
+        self.chunks: Deque[bytes] = collections.deque()
+        self.size = 0
+        self.ready = asyncio.Event()
+        self.closed = False
+
+
+class LiveMixer:
+    """
+    Сведение записи звонка на лету.
+
+    Очередь записи (SessionAudioQueue) после сохранения чанка отдает его байты
+    в feed(); отдельные задачи пишут дорожки в FIFO входов ffmpeg, а его Ogg/Opus
+    выход сразу уходит multipart upload'ом в final_recording.ogg. При отбое
+    finalize() дописывает хвост и регистрирует финальный AudioObject, так что
+    запись доступна через секунды после звонка.
+
+    Live-сведение - лучшее усилие: при любой ошибке или переполнении буфера
+    микшер отключается, а запись собирает пакетный process_and_merge_audio.
+    """
+
+    def __init__(
+        self,
+        meeting_id: int,
+        session_id: str,
+        roles: Sequence[str] = ("participant", "bot"),
+        max_buffer_bytes: int = LIVE_MIX_MAX_BUFFER_BYTES,
+    ):
+        self.meeting_id = meeting_id
+        self.session_id = session_id
+        self.roles = tuple(roles)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.object_name = post_processing.final_recording_key(meeting_id)
+        self.failed = False
+        self._inputs: Dict[str, _TrackInput] = {}
+        self._upload: Optional[MultipartUpload] = None
+        self._task: Optional[asyncio.Task] = None
+        self._work_dir: Optional[str] = None
+        self._derivatives: List[post_processing.RecordingDerivative] = []
+        self._counted = False
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None and not self.failed
+
+    async def start(self) -> bool:
+        """Запускает ffmpeg. Возвращает False, если live-сведение недоступно."""
+        global _active_sessions
+        if not hasattr(os, "mkfifo"):
+            return False
+        if _active_sessions >= LIVE_MIX_MAX_SESSIONS:
+            logger.info(
+                f"Live mix limit reached, session {self.session_id} will be merged in batch"
+            )
+            return False
+        _active_sessions += 1
+        self._counted = True
+
+        try:
+            self._work_dir = tempfile.mkdtemp(prefix=f"aihr_live_{self.meeting_id}_")
+            for role in self.roles:
+                fifo_path = os.path.join(self._work_dir, f"{role}.webm")
+                os.mkfifo(fifo_path)
+                self._inputs[role] = _TrackInput(fifo_path)
+            self._derivatives = post_processing.recording_derivatives(
+                self.roles, self._work_dir
+            )
+
+            self._upload = MultipartUpload(
+                self.object_name, post_processing.FINAL_RECORDING_CONTENT_TYPE
+            )
+            await self._upload.open()
+        except Exception as e:
+            logger.warning(f"Could not start live mix for session {self.session_id}: {e}")
+            await self._release()
+            return False
+
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Live mix started for session {self.session_id}")
+        return True
+
+    def feed(self, role: str, data: bytes):
+        """Передает чанк дорожки в микшер; не блокирует очередь записи."""
+        if not self.active or not data:
+            return
+        track = self._inputs.get(role)
+        if track is None or track.closed:
+            return
+        if track.size + len(data) > self.max_buffer_bytes:
+            self._fail(f"{role} buffer exceeded {self.max_buffer_bytes} bytes")
+            return
+        track.chunks.append(data)
+        track.size += len(data)
+        track.ready.set()
+
+    async def finalize(self) -> bool:
+        """
+        Закрывает входы, ждет досведения хвоста и регистрирует финальную запись.
+        Возвращает True, если запись собрана на лету.
+        """
+        if self._task is None:
+            return False
+        try:
+            if self.failed:
+                return False
+            for track in self._inputs.values():
+                track.closed = True
+                track.ready.set()
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(self._task), LIVE_MIX_FINALIZE_TIMEOUT
+                )
+                size = await self._upload.complete()
+            except Exception as e:
+                self._fail(repr(e))
+                return False
+            if not size:
+                self._fail("ffmpeg produced no output")
+                return False
+
+            await post_processing.register_final_recording(
+                self.meeting_id, self.session_id, self.object_name, size
+            )
+            try:
+                await post_processing.upload_recording_derivatives(
+                    self.meeting_id, self.session_id, self._derivatives
+                )
+            except Exception as e:
+                logger.error(
+                    f"Could not save recording derivatives for session {self.session_id}: {e}"
+                )
+            logger.info(
+                f"Live mix finalized for session {self.session_id}: {self.object_name}"
+            )
+            return True
+        finally:
+            await self._release()
+
+    def _fail(self, reason: str):
+        if self.failed:
+            return
+        self.failed = True
+        logger.warning(
+            f"Live mix disabled for session {self.session_id}, "
+            f"falling back to batch merge: {reason}"
+        )
+        for track in self._inputs.values():
+            track.chunks.clear()
+            track.size = 0
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _release(self):
+        global _active_sessions
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._upload is not None:
+            await self._upload.abort()
+        if self._work_dir:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+        if self._counted:
+            _active_sessions -= 1
+            self._counted = False
+
+    async def _run(self):
+        try:
+            await post_processing._mix_audio_tracks_ffmpeg(
+                [track.fifo_path for track in self._inputs.values()],
+                "pipe:1",
+                self._derivatives,
+                feeders=[self._feed_fifo(track) for track in self._inputs.values()],
+                stdout_consumer=self._consume,
+                timeout=None,
+                slots=None,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._fail(repr(e))
+            raise
+
+    async def _feed_fifo(self, track: _TrackInput):
+        writer = await post_processing.open_fifo_writer(track.fifo_path)
+        try:
+            while True:
+                await track.ready.wait()
+                track.ready.clear()
+                while track.chunks:
+                    data = track.chunks.popleft()
+                    track.size -= len(data)
+                    writer.write(data)
+                    await writer.drain()
+                if track.closed:
+                    return
+        finally:
+            writer.close()
+
+    async def _consume(self, stdout: asyncio.StreamReader):
+        while True:
+            data = await stdout.read(self._upload.part_size)
+            if not data:
+                break
+            await self._upload.write(data)
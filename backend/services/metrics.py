@@ -0,0 +1,209 @@
+# backend/services/metrics.py
+import bisect
+import time
+from typing import Dict, List, Sequence, Tuple
+
+# Границы гистограмм задержек горячего пути звонка, секунд
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def _format_labels(
+    names: Sequence[str], values: Tuple[str, ...], extra: str = ""
+) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # значение: [счетчики по корзинам (не кумулятивные) + корзина +Inf, сумма]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# --- МЕТРИКИ РЕЛЕ ЗВОНКА ---
+
+RELAY_CLIENT_TO_STT_SECONDS = Histogram(
+    "call_relay_client_to_stt_seconds",
+    "Time from receiving a client frame to stt_ws.send_bytes completing",
+)
+RELAY_STT_TO_CLIENT_SECONDS = Histogram(
+    "call_relay_stt_to_client_seconds",
+    "Time from receiving an STT/TTS frame to client_ws.send_bytes completing",
+)
+AUDIO_PERSIST_SECONDS = Histogram(
+    "call_audio_persist_seconds",
+    "Duration of successfully passing one audio frame to the track writer",
+    labelnames=("role",),
+)
+AUDIO_OBJECTS_PERSISTED_TOTAL = Counter(
+    "call_audio_objects_persisted_total",
+    "Audio objects written to storage: chunks, segments, multipart parts, "
+    "spooled tracks",
+    labelnames=("role",),
+)
+AUDIO_PERSIST_FAILURES_TOTAL = Counter(
+    "call_audio_persist_failures_total",
+    "Audio frames or track closes that failed to persist",
+    labelnames=("role",),
+)
+AUDIO_FRAMES_TOTAL = Counter(
+    "call_audio_frames_total", "Audio frames relayed", labelnames=("role",)
+)
+AUDIO_BYTES_TOTAL = Counter(
+    "call_audio_bytes_total", "Audio bytes relayed", labelnames=("role",)
+)
+AUDIO_DROPPED_TOTAL = Counter(
+    "call_audio_dropped_total",
+    "Audio frames dropped by the write-behind queue",
+    labelnames=("role",),
+)
+
+REGISTRY = [
+    RELAY_CLIENT_TO_STT_SECONDS,
+    RELAY_STT_TO_CLIENT_SECONDS,
+    AUDIO_PERSIST_SECONDS,
+    AUDIO_FRAMES_TOTAL,
+    AUDIO_BYTES_TOTAL,
+    AUDIO_DROPPED_TOTAL,
+]
+
+
+def render_metrics() -> str:
+    """Все метрики процесса в текстовом формате Prometheus."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _Timing:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def summary(self) -> Dict[str, float]:
+        avg = self.total / self.count if self.count else 0.0
+        return {
+            "count": self.count,
+            "avg_ms": round(avg * 1000, 2),
+            "max_ms": round(self.max * 1000, 2),
+        }
+
+
+class CallStats:
+    """
+    Статистика одной сессии звонка: кадры и байты по ролям и задержки реле.
+    Одновременно обновляет глобальные метрики процесса; сводка пишется в лог
+    при отключении.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.started_at = time.monotonic()
+        self.frames: Dict[str, int] = {}
+        self.bytes: Dict[str, int] = {}
+        self.client_to_stt = _Timing()
+        self.stt_to_client = _Timing()
+
+    def record_frame(self, role: str, size: int):
+        self.frames[role] = self.frames.get(role, 0) + 1
+        self.bytes[role] = self.bytes.get(role, 0) + size
+        AUDIO_FRAMES_TOTAL.inc(role=role)
+        AUDIO_BYTES_TOTAL.inc(size, role=role)
+
+    def record_client_to_stt(self, seconds: float):
+        self.client_to_stt.add(seconds)
+        RELAY_CLIENT_TO_STT_SECONDS.observe(seconds)
+
+    def record_stt_to_client(self, seconds: float):
+        self.stt_to_client.add(seconds)
+        RELAY_STT_TO_CLIENT_SECONDS.observe(seconds)
+
+    def summary(self) -> Dict:
+        return {
+            "duration_sec": round(time.monotonic() - self.started_at, 1),
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "client_to_stt": self.client_to_stt.summary(),
+            "stt_to_client": self.stt_to_client.summary(),
+        }
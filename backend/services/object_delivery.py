@@ -0,0 +1,224 @@
+# backend/services/object_delivery.py
+import email.utils
+import logging
+import os
+import re
+from typing import Dict, Mapping, Optional
+
+from botocore.exceptions import ClientError
+from fastapi import HTTPException, Request
+from starlette.responses import (JSONResponse, RedirectResponse, Response,
+                                 StreamingResponse)
+from starlette.types import Send
+
+from .storage import STORAGE_READ_CHUNK_SIZE, get_storage
+
+logger = logging.getLogger("uvicorn.error")
+
+# Как отдавать файлы из хранилища после проверки прав:
+#   proxy    - байты идут через backend (ObjectStreamResponse, с Range)
+#   redirect - 307 на короткоживущий presigned URL хранилища
+#   json     - {"url": ..., "expires_in": ...}, клиент скачивает сам
+# Клиент может выбрать режим на запрос параметром ?delivery=...
+DELIVERY_MODES = ("proxy", "redirect", "json")
+FILE_DELIVERY_MODE = os.getenv("FILE_DELIVERY_MODE", "proxy").lower()
+if FILE_DELIVERY_MODE not in DELIVERY_MODES:
+    logger.warning(f"Unknown FILE_DELIVERY_MODE {FILE_DELIVERY_MODE!r}, using proxy")
+    FILE_DELIVERY_MODE = "proxy"
+# Время жизни presigned URL, секунд
+FILE_URL_EXPIRES_SEC = int(os.getenv("FILE_URL_EXPIRES_SEC", "300"))
+
+# Один диапазон байтов: "bytes=0-99", "bytes=100-", "bytes=-500"
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+_NOT_FOUND_CODES = {"NoSuchKey", "404", "NotFound"}
+_INVALID_RANGE_CODES = {"InvalidRange", "416"}
+_PRECONDITION_FAILED_CODES = {"PreconditionFailed", "412"}
+_NOT_MODIFIED_CODES = {"NotModified", "304"}
+
+
+def parse_range_header(value: Optional[str]) -> Optional[str]:
+    """
+    Нормализованный заголовок Range для S3 или None. Несколько диапазонов
+    S3 не поддерживает; такой запрос, как и некорректный, отдается целиком.
+    """
+    if not value:
+        return None
+    match = _RANGE_RE.match(value.strip().replace(" ", ""))
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if start and end and int(end) < int(start):
+        return None
+    return f"bytes={start}-{end}"
+
+
+def _error_code(error: ClientError) -> str:
+    return str(error.response.get("Error", {}).get("Code", ""))
+
+
+class ObjectStreamResponse(StreamingResponse):
+    """
+    Отдает объект хранилища потоково кусками STORAGE_READ_CHUNK_SIZE, не
+    загружая его в память целиком.
+
+    Поддерживает Range (206 Partial Content, один диапазон), If-Range по
+    ETag и If-None-Match (304); отправляет Content-Length, ETag,
+    Last-Modified и Accept-Ranges. Запрос к хранилищу выполняется в момент
+    отправки ответа, поэтому ответ можно вернуть из синхронного обработчика.
+    Тело объекта закрывается и при обрыве соединения клиентом.
+    """
+
+    def __init__(
+        self,
+        object_key: str,
+        request_headers: Mapping[str, str],
+        media_type: str = "application/octet-stream",
+        headers: Optional[Dict[str, str]] = None,
+        chunk_size: int = STORAGE_READ_CHUNK_SIZE,
+    ):
+        self.object_key = object_key
+        self.chunk_size = chunk_size
+        self.byte_range = parse_range_header(request_headers.get("range"))
+        self.if_range = request_headers.get("if-range")
+        self.if_none_match = request_headers.get("if-none-match")
+        self.extra_headers = dict(headers or {})
+        super().__init__(iter(()), media_type=media_type, headers=self.extra_headers)
+
+    async def stream_response(self, send: Send):
+        storage = get_storage()
+        byte_range = self.byte_range
+        if_match = None
+        if byte_range and self.if_range:
+            if self.if_range.startswith('"'):
+                if_match = self.if_range
+            else:
+                # If-Range с датой или слабым ETag: отдаем объект целиком
+                byte_range = None
+
+        try:
+            try:
+                obj = await storage.open_object(
+                    self.object_key,
+                    byte_range=byte_range,
+                    if_match=if_match,
+                    if_none_match=self.if_none_match,
+                )
+            except ClientError as e:
+                if _error_code(e) not in _PRECONDITION_FAILED_CODES or not if_match:
+                    raise
+                # Объект изменился с момента первого куска: отдаем его целиком
+                byte_range = None
+                obj = await storage.open_object(
+                    self.object_key, if_none_match=self.if_none_match
+                )
+        except ClientError as e:
+            await self._send_error(send, e)
+            return
+
+        async with obj["Body"] as body:
+            status = 206 if byte_range and obj.get("ContentRange") else 200
+            headers = {
+                "Accept-Ranges": "bytes",
+                "Content-Length": str(obj["ContentLength"]),
+            }
+            if obj.get("ETag"):
+                headers["ETag"] = obj["ETag"]
+            if obj.get("LastModified"):
+                headers["Last-Modified"] = email.utils.format_datetime(
+                    obj["LastModified"], usegmt=True
+                )
+            if status == 206:
+                headers["Content-Range"] = obj["ContentRange"]
+            await self._send_start(send, status, headers)
+
+            while True:
+                chunk = await body.read(self.chunk_size)
+                if not chunk:
+                    break
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _send_start(self, send: Send, status: int, headers: Dict[str, str]):
+        self.status_code = status
+        raw_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers.items()
+        ]
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": self.raw_headers + raw_headers,
+            }
+        )
+
+    async def _send_error(self, send: Send, error: ClientError):
+        code = _error_code(error)
+        headers = {}
+        if code in _NOT_MODIFIED_CODES:
+            status = 304
+            if self.if_none_match:
+                headers["ETag"] = self.if_none_match
+        elif code in _NOT_FOUND_CODES:
+            status = 404
+        elif code in _INVALID_RANGE_CODES:
+            status = 416
+            try:
+                head = await get_storage().head_object(self.object_key)
+                headers["Content-Range"] = f"bytes */{head['ContentLength']}"
+            except ClientError:
+                pass
+        else:
+            logger.error(f"Error streaming object {self.object_key}: {error}")
+            status = 500
+        # Пустое тело ошибки: без Content-Type и Content-Disposition объекта
+        self.raw_headers = []
+        headers["Content-Length"] = "0"
+        await self._send_start(send, status, headers)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def deliver_object(
+    object_key: str,
+    request: Request,
+    media_type: str = "application/octet-stream",
+    content_disposition: Optional[str] = None,
+) -> Response:
+    """
+    Ответ, отдающий объект хранилища клиенту в режиме FILE_DELIVERY_MODE (или
+    ?delivery=... из запроса). Вызывается после проверки прав: presigned URL
+    дает доступ к объекту любому, у кого он есть, до истечения срока.
+    """
+    mode = request.query_params.get("delivery", FILE_DELIVERY_MODE).lower()
+    if mode not in DELIVERY_MODES:
+        raise HTTPException(
+            status_code=400, detail=f"delivery must be one of {DELIVERY_MODES}"
+        )
+
+    if mode == "proxy":
+        headers = {}
+        if content_disposition:
+            headers["Content-Disposition"] = content_disposition
+        return ObjectStreamResponse(
+            object_key, request.headers, media_type=media_type, headers=headers
+        )
+
+    url = get_storage().presign_get_url(
+        object_key,
+        FILE_URL_EXPIRES_SEC,
+        content_type=media_type,
+        content_disposition=content_disposition,
+    )
+    # Ссылка временная: не даем кэшировать ответ с ней
+    headers = {"Cache-Control": "no-store"}
+    if mode == "redirect":
+        return RedirectResponse(url, status_code=307, headers=headers)
+    return JSONResponse(
+        {"url": url, "expires_in": FILE_URL_EXPIRES_SEC, "media_type": media_type},
+        headers=headers,
+    )
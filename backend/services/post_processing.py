@@ -1,43 +1,91 @@
 import asyncio
+import contextlib
+import errno
+import functools
 import logging
 import os
+import shutil
 import tempfile
-from typing import Dict, List
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence
 
+import anyio
 import ffmpeg
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from .. import database, models
-from .minio_client import DEFAULT_BUCKET, get_minio_client
+from ..utils.webm import EBML_ID, WebMRemuxer
+from .audio_spool import find_spooled_track, remove_spool
+from .chunk_downloader import OrderedChunkDownloader
+from .post_processing_jobs import (STAGE_FINAL_REGISTERED, STAGE_FINAL_UPLOADED,
+                                   STAGE_SOURCES_DELETED, get_job_checkpoint_sync,
+                                   record_stage_sync, stage_reached)
+from .storage import MultipartUpload, get_storage
 
 logger = logging.getLogger("uvicorn.error")
 
+# Ограничения для процессов ffmpeg (отдельно от пула потоков по умолчанию)
+FFMPEG_TIMEOUT_SEC = float(os.getenv("FFMPEG_TIMEOUT_SEC", "1800"))
+FFMPEG_MAX_PROCESSES = int(os.getenv("FFMPEG_MAX_PROCESSES", "2"))
+_ffmpeg_slots = asyncio.Semaphore(FFMPEG_MAX_PROCESSES)
+# Потоковая сборка: чанки идут в ffmpeg через именованные каналы (FIFO), а его
+# stdout - сразу в multipart upload. Без FIFO (Windows) - через временные файлы
+POSTPROCESS_STREAMING = hasattr(os, "mkfifo") and os.getenv(
+    "POSTPROCESS_STREAMING", "true"
+).lower() in ("1", "true", "yes")
+# Сколько байт хвоста stderr ffmpeg держать для диагностики
+_FFMPEG_STDERR_TAIL = 64 * 1024
+_FIFO_OPEN_POLL_SEC = 0.05
+FINAL_RECORDING_CONTENT_TYPE = "audio/ogg"
+FINAL_RECORDING_ROLE = "merged"
+WEBM_MAGIC = EBML_ID.to_bytes(4, "big")
+# Производные записи, которые кодируются тем же запуском ffmpeg, что и сведение,
+# через запятую: telegram (моно Opus низкого битрейта), stems (отдельная дорожка
+# каждой роли), preview (начало записи). По умолчанию не создаются
+RECORDING_DERIVATIVES = {
+    name.strip()
+    for name in os.getenv("RECORDING_DERIVATIVES", "").split(",")
+    if name.strip()
+}
+TELEGRAM_AUDIO_BITRATE = os.getenv("TELEGRAM_AUDIO_BITRATE", "32k")
+STEM_AUDIO_BITRATE = os.getenv("STEM_AUDIO_BITRATE", "64k")
+# Длина превью, секунд
+RECORDING_PREVIEW_SEC = float(os.getenv("RECORDING_PREVIEW_SEC", "60"))
+_KNOWN_DERIVATIVES = ("telegram", "stems", "preview")
+
 
 # --- НОВЫЕ ФУНКЦИИ ДЛЯ ОЧИСТКИ ---
 
 
 def _cleanup_temp_files(files: List[str]):
-    """Удаляет список временных файлов с диска."""
+    """Удаляет список временных файлов (и рабочих каталогов) с диска."""
     for path in files:
         try:
-            if os.path.exists(path):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+                logger.debug(f"Deleted temp dir {path}")
+            elif os.path.exists(path):
                 os.unlink(path)
                 logger.debug(f"Deleted temp file {path}")
         except OSError as e:
             logger.warning(f"Could not delete temp file {path}: {e}")
 
 
-def _cleanup_source_data(object_keys: List[str], object_ids: List[int]):
+async def _cleanup_source_data(object_keys: List[str], object_ids: List[int]):
     """Удаляет исходные чанки из MinIO и записи из БД."""
     # 1. Удаление из MinIO
     try:
-        minio_client = get_minio_client()
-        minio_client.delete_objects(object_keys)
+        await get_storage().delete_objects(object_keys)
         logger.info(f"Deleted {len(object_keys)} source chunks from MinIO.")
     except Exception as e:
         logger.error(f"Error deleting source chunks from MinIO: {e}")
 
     # 2. Удаление из БД
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, _delete_audio_objects_sync, object_ids)
+
+
+def _delete_audio_objects_sync(object_ids: List[int]):
     db: Session = database.SessionLocal()
     try:
         if object_ids:
@@ -58,132 +106,504 @@ def _cleanup_source_data(object_keys: List[str], object_ids: List[int]):
 # --- СУЩЕСТВУЮЩИЕ, НО МОДИФИЦИРОВАННЫЕ ФУНКЦИИ ---
 
 
-async def _download_audio_object_bytes(object_key: str) -> bytes:
-    """Асинхронно скачивает байты аудио объекта из MinIO."""
-    loop = asyncio.get_event_loop()
+async def _read_stderr_tail(stream: asyncio.StreamReader) -> bytes:
+    """Читает stderr ffmpeg до конца, сохраняя только последние байты."""
+    tail = bytearray()
+    while True:
+        data = await stream.read(8192)
+        if not data:
+            return bytes(tail)
+        tail += data
+        del tail[:-_FFMPEG_STDERR_TAIL]
 
-    def _sync_get():
-        minio_client = get_minio_client()
-        response = minio_client.client.get_object(
-            bucket_name=DEFAULT_BUCKET, object_name=object_key  # ИСПРАВЛЕНО
+
+async def _supervise_ffmpeg(
+    process: asyncio.subprocess.Process,
+    feeder_tasks: List[asyncio.Task],
+    consumer_task: Optional[asyncio.Task],
+):
+    """
+    Ждет завершения ffmpeg вместе с задачами, которые пишут его входы и читают
+    выход. Ошибка любой задачи поднимается сразу, не дожидаясь ffmpeg.
+    """
+    waiter = asyncio.ensure_future(process.wait())
+    pending = {waiter, *feeder_tasks}
+    if consumer_task is not None:
+        pending.add(consumer_task)
+    while waiter in pending:
+        done, pending = await asyncio.wait(
+            pending, return_when=asyncio.FIRST_COMPLETED
         )
-        return response.read()
+        for task in done:
+            task.result()
+    # ffmpeg завершился: недописанные входы ему больше не нужны
+    for task in feeder_tasks:
+        task.cancel()
+    if consumer_task is not None:
+        await consumer_task
+
+
+async def _run_ffmpeg(
+    stream_spec,
+    timeout: Optional[float] = FFMPEG_TIMEOUT_SEC,
+    feeders: Sequence[Awaitable] = (),
+    stdout_consumer: Optional[Callable[[asyncio.StreamReader], Awaitable]] = None,
+    slots: Optional[asyncio.Semaphore] = _ffmpeg_slots,
+):
+    """
+    Запускает ffmpeg как asyncio subprocess, не блокируя event loop.
 
-    try:
-        data = await loop.run_in_executor(None, _sync_get)
-        logger.debug(f"Downloaded {len(data)} bytes from MinIO object {object_key}")
-        return data
-    except Exception as e:
-        logger.error(f"Error downloading object {object_key} from MinIO: {e}")
-        raise
+    feeders - корутины, которые пишут входы ffmpeg (например, в FIFO);
+    stdout_consumer получает stdout процесса, если выход идет в pipe:1.
+    slots=None запускает процесс вне лимита FFMPEG_MAX_PROCESSES.
+    При таймауте, отмене или ошибке feeder/consumer процесс убивается;
+    при ненулевом коде возврата поднимается ffmpeg.Error с хвостом stderr.
+    """
+    args = ffmpeg.compile(
+        stream_spec.global_args("-hide_banner", "-nostdin").overwrite_output()
+    )
+    async with slots or contextlib.nullcontext():
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=(
+                asyncio.subprocess.PIPE
+                if stdout_consumer
+                else asyncio.subprocess.DEVNULL
+            ),
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stderr_task = asyncio.create_task(_read_stderr_tail(process.stderr))
+        feeder_tasks = [asyncio.create_task(feeder) for feeder in feeders]
+        consumer_task = (
+            asyncio.create_task(stdout_consumer(process.stdout))
+            if stdout_consumer
+            else None
+        )
+        tasks = feeder_tasks + ([consumer_task] if consumer_task else [])
+        try:
+            await asyncio.wait_for(
+                _supervise_ffmpeg(process, feeder_tasks, consumer_task), timeout
+            )
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, stderr_task, return_exceptions=True)
+            logger.error("FFmpeg process killed (timeout, cancellation or I/O error)")
+            raise
+        stderr = await stderr_task
+
+    if process.returncode != 0:
+        raise ffmpeg.Error("ffmpeg", None, stderr)
+    return stderr
+
+
+async def open_fifo_writer(path: str) -> asyncio.StreamWriter:
+    """
+    Открывает FIFO на запись, не блокируя event loop: пока ffmpeg не открыл
+    канал на чтение, open с O_NONBLOCK возвращает ENXIO.
+    """
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            await asyncio.sleep(_FIFO_OPEN_POLL_SEC)
+
+    loop = asyncio.get_running_loop()
+    pipe = os.fdopen(fd, "wb", buffering=0)
+    transport, protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, pipe
+    )
+    return asyncio.StreamWriter(transport, protocol, None, loop)
 
 
-def _concatenate_audio_files(input_files: List[str], output_file: str):
+async def _iter_source_bytes(object_keys: List[str]):
     """
-    Объединяет (конкатенирует) список аудио файлов в один с помощью concat фильтра.
-    Этот метод более надежен на Windows, так как не использует внешний текстовый файл.
+    Сырые байты дорожки по порядку чанков. Дорожка одним объектом (multipart,
+    спул) читается потоково; мелкие чанки скачиваются окном
+    OrderedChunkDownloader.
     """
-    if not input_files:
-        logger.warning("No input files provided for concatenation.")
+    if len(object_keys) == 1:
+        async for data in get_storage().iter_object(object_keys[0]):
+            yield data
         return
 
-    logger.info(
-        f"Starting FFmpeg concatenation of {len(input_files)} files into {output_file}"
-    )
+    downloader = OrderedChunkDownloader(object_keys)
+    async for data in downloader:
+        yield data
+    if downloader.retried:
+        logger.info(
+            f"Downloaded {downloader.downloaded} chunks with {downloader.retried} retries"
+        )
+
+
+async def _iter_track_bytes(object_keys: List[str]):
+    """
+    Дорожка одним корректным WebM: чанки склеиваются WebMRemuxer в процессе,
+    без отдельного запуска ffmpeg. Если дорожка не WebM, байты идут как есть.
+    """
+    remuxer = None
+    async for data in _iter_source_bytes(object_keys):
+        if remuxer is None:
+            remuxer = WebMRemuxer() if data.startswith(WEBM_MAGIC) else False
+        if remuxer:
+            data = remuxer.feed(data)
+        if data:
+            yield data
+    if remuxer and remuxer.parser.skipped_bytes:
+        logger.warning(
+            f"Remuxed track: {remuxer.blocks} blocks, "
+            f"skipped {remuxer.parser.skipped_bytes} damaged bytes"
+        )
+
+
+async def _feed_track_to_fifo(fifo_path: str, object_keys: List[str]):
+    """Пишет чанки дорожки в FIFO, с учетом backpressure со стороны ffmpeg."""
+    writer = await open_fifo_writer(fifo_path)
     try:
-        # Если файл один, просто копируем его, чтобы не вызывать сложную логику FFmpeg.
-        if len(input_files) == 1:
-            ffmpeg.input(input_files[0]).output(
-                output_file, acodec="copy"
-            ).overwrite_output().run(quiet=True)
-            logger.info(f"Successfully copied single audio file to {output_file}")
-            return
+        async for data in _iter_track_bytes(object_keys):
+            writer.write(data)
+            await writer.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        # ffmpeg закрыл вход раньше времени; причину покажет его код возврата
+        logger.warning(f"FFmpeg closed input {fifo_path} before end of track")
+    finally:
+        # Транспорт сам дописывает остаток буфера и закрывает канал (EOF для ffmpeg)
+        writer.close()
 
-        # Создаем список входных потоков для FFmpeg
-        input_streams = [ffmpeg.input(f) for f in input_files]
 
-        # Используем concat ФИЛЬТР для объединения всех потоков.
-        # v=0 (video=0), a=1 (audio=1) - говорим, что на выходе должен быть один аудиопоток.
-        concatenated_stream = ffmpeg.concat(*input_streams, v=0, a=1)
+async def _download_track_to_file(object_keys: List[str], file_path: str):
+    """Склеивает чанки дорожки в файл на диске (запасной путь без FIFO)."""
+    async with await anyio.open_file(file_path, "wb") as f:
+        async for data in _iter_track_bytes(object_keys):
+            await f.write(data)
 
-        # Запускаем процесс. Используем 'copy' кодек, так как исходные файлы уже в webm.
-        (
-            ffmpeg.output(concatenated_stream, output_file, acodec="copy")
-            .overwrite_output()
-            .run(quiet=True)
+
+class NoAudioChunksError(RuntimeError):
+    """
+    У сессии нет ни чанков, ни финальной записи. Метаданные чанков могут еще
+    ждать в пакетной вставке (например, БД была недоступна), поэтому задача
+    повторяется с задержкой, а не завершается.
+    """
+
+
+class RecordingDerivative(NamedTuple):
+    """Дополнительный выход ffmpeg, который сохраняется отдельным AudioObject."""
+
+    role: str
+    path: str
+    # Индекс входной дорожки (stem) или None, если выход строится из сведения
+    track_index: Optional[int]
+    output_kwargs: Dict[str, object]
+
+
+def recording_derivatives(
+    track_roles: Sequence[str], work_dir: str, names=None
+) -> List[RecordingDerivative]:
+    """
+    Производные записи из RECORDING_DERIVATIVES для дорожек track_roles (в
+    порядке входов ffmpeg). Файлы пишутся в work_dir.
+    """
+    names = RECORDING_DERIVATIVES if names is None else names
+    unknown = set(names) - set(_KNOWN_DERIVATIVES)
+    if unknown:
+        logger.warning(f"Unknown recording derivatives ignored: {sorted(unknown)}")
+
+    derivatives = []
+
+    def add(role: str, track_index: Optional[int], **output_kwargs):
+        derivatives.append(
+            RecordingDerivative(
+                role,
+                os.path.join(work_dir, f"{role}.ogg"),
+                track_index,
+                dict(format="ogg", acodec="libopus", **output_kwargs),
+            )
         )
 
-        logger.info(f"Successfully concatenated audio files into {output_file}")
-    except ffmpeg.Error as e:
-        # Логируем stderr от ffmpeg для детальной диагностики в случае будущих проблем
-        stderr_output = (
-            e.stderr.decode("utf8", errors="ignore") if e.stderr else "No stderr"
+    if "telegram" in names:
+        add(
+            "telegram",
+            None,
+            audio_bitrate=TELEGRAM_AUDIO_BITRATE,
+            ac=1,
+            vbr="on",
+            application="voip",
         )
-        logger.error(f"FFmpeg error during concatenation: {stderr_output}")
-        raise
+    if "preview" in names:
+        add("preview", None, audio_bitrate=STEM_AUDIO_BITRATE, t=RECORDING_PREVIEW_SEC)
+    if "stems" in names:
+        for index, role in enumerate(track_roles):
+            add(f"stem_{role}", index, audio_bitrate=STEM_AUDIO_BITRATE)
+    return derivatives
 
 
 # --- НОВАЯ ФУНКЦИЯ ДЛЯ СМЕШИВАНИЯ ---
-def _mix_audio_tracks_ffmpeg(track_files: List[str], output_file: str):
+async def _mix_audio_tracks_ffmpeg(
+    track_files: List[str],
+    output_file: str,
+    derivatives: Sequence[RecordingDerivative] = (),
+    **run_kwargs,
+):
     """
-    Смешивает (микширует) несколько аудио дорожек в одну.
+    Смешивает (микширует) несколько аудио дорожек в одну Ogg/Opus.
+    output_file может быть "pipe:1"; run_kwargs (feeders, stdout_consumer,
+    timeout, slots) передаются в _run_ffmpeg.
+
+    derivatives кодируются тем же процессом: сведение делится фильтром asplit,
+    а stems берут входную дорожку напрямую, так что каждый источник
+    декодируется один раз.
     """
     if not track_files:
         logger.warning("No track files provided for mixing.")
         return
 
-    if len(track_files) == 1:
+    inputs = [ffmpeg.input(f) for f in track_files]
+    from_mix = sum(1 for d in derivatives if d.track_index is None)
+    if len(inputs) == 1:
         logger.warning("Only one track provided. Copying instead of mixing.")
-        ffmpeg.input(track_files[0]).output(
-            output_file, acodec="libopus", audio_bitrate="128k"
-        ).overwrite_output().run(quiet=True)
-        return
-
-    logger.info(f"Starting FFmpeg mix of {len(track_files)} tracks into {output_file}")
-    try:
-        inputs = [ffmpeg.input(f) for f in track_files]
+        mixed_streams = [inputs[0].audio] * (from_mix + 1)
+    else:
+        logger.info(
+            f"Starting FFmpeg mix of {len(track_files)} tracks into {output_file}"
+        )
         # Используем фильтр amix для смешивания дорожек
         mixed_audio = ffmpeg.filter(
             inputs, "amix", inputs=len(inputs), duration="longest"
         )
-
-        (
-            ffmpeg.output(
-                mixed_audio, output_file, acodec="libopus", audio_bitrate="128k"
-            )
-            .overwrite_output()
-            .run(quiet=True)
+        if from_mix:
+            split = mixed_audio.filter_multi_output("asplit", from_mix + 1)
+            mixed_streams = [split[i] for i in range(from_mix + 1)]
+        else:
+            mixed_streams = [mixed_audio]
+
+    outputs = [
+        ffmpeg.output(
+            mixed_streams[0],
+            output_file,
+            format="ogg",
+            acodec="libopus",
+            audio_bitrate="128k",
         )
+    ]
+    next_mixed = iter(mixed_streams[1:])
+    for derivative in derivatives:
+        if derivative.track_index is None:
+            stream = next(next_mixed)
+        else:
+            stream = inputs[derivative.track_index].audio
+        outputs.append(ffmpeg.output(stream, derivative.path, **derivative.output_kwargs))
+
+    try:
+        await _run_ffmpeg(ffmpeg.merge_outputs(*outputs), **run_kwargs)
         logger.info(f"Successfully mixed tracks into {output_file}")
     except ffmpeg.Error as e:
         logger.error(
-            f"FFmpeg error during mixing: {e.stderr.decode('utf8') if e.stderr else 'No stderr'}"
+            f"FFmpeg error during mixing: {e.stderr.decode('utf8', errors='ignore') if e.stderr else 'No stderr'}"
         )
         raise
 
 
-def _save_final_file_and_update_db(meeting_id: int, session_id: str, file_path: str):
-    """Сохраняет финальный файл в MinIO и обновляет БД."""
-    # 1. Сохранение в MinIO
-    final_object_name = f"recordings/meeting_{meeting_id}/final_recording.ogg"
-    with open(file_path, "rb") as f:
-        file_data = f.read()
-
-    minio_client = get_minio_client()
-    minio_client.put_bytes(
-        object_name=final_object_name, data=file_data, content_type="audio/ogg"
+async def _mix_and_upload_streaming(
+    meeting_id: int,
+    session_id: str,
+    track_sources: Dict[str, object],
+    work_dir: str,
+    derivatives: Sequence[RecordingDerivative] = (),
+):
+    """
+    Потоковая сборка: дорожки из MinIO подаются в ffmpeg через FIFO, а
+    результат из stdout сразу уходит частями в multipart upload. Память и
+    временный диск не зависят от длины звонка. Возвращает (ключ финального
+    объекта, размер).
+    """
+    track_inputs = []
+    feeders = []
+    for role, source in track_sources.items():
+        if isinstance(source, str):
+            # Локальный файл (спул) ffmpeg читает сам
+            track_inputs.append(source)
+            continue
+        fifo_path = os.path.join(work_dir, f"{role}.webm")
+        os.mkfifo(fifo_path)
+        track_inputs.append(fifo_path)
+        feeders.append(_feed_track_to_fifo(fifo_path, source))
+
+    final_object_name = final_recording_key(meeting_id)
+    upload = MultipartUpload(final_object_name, FINAL_RECORDING_CONTENT_TYPE)
+
+    async def consume(stdout: asyncio.StreamReader):
+        while True:
+            data = await stdout.read(upload.part_size)
+            if not data:
+                break
+            await upload.write(data)
+
+    await upload.open()
+    try:
+        await _mix_audio_tracks_ffmpeg(
+            track_inputs,
+            "pipe:1",
+            derivatives,
+            feeders=feeders,
+            stdout_consumer=consume,
+        )
+        size = await upload.complete()
+    except BaseException:
+        for feeder in feeders:
+            feeder.close()  # корутины, которые так и не были запущены
+        await upload.abort()
+        raise
+    if not size:
+        raise RuntimeError(f"FFmpeg produced no output for session {session_id}")
+    logger.info(f"Final merged audio streamed to MinIO: {final_object_name}")
+    return final_object_name, size
+
+
+async def _mix_and_upload_via_files(
+    meeting_id: int,
+    session_id: str,
+    track_sources: Dict[str, object],
+    work_dir: str,
+    derivatives: Sequence[RecordingDerivative] = (),
+):
+    """
+    Запасной путь без FIFO: дорожки и результат проходят через временные
+    файлы. Возвращает (ключ финального объекта, размер).
+    """
+    track_files = []
+    for role, source in track_sources.items():
+        if isinstance(source, str):
+            track_files.append(source)
+            continue
+        track_path = os.path.join(work_dir, f"{role}.webm")
+        await _download_track_to_file(source, track_path)
+        logger.info(f"Created single concatenated track for role '{role}' at {track_path}")
+        track_files.append(track_path)
+
+    final_output_path = os.path.join(work_dir, "final_mixed.ogg")
+    await _mix_audio_tracks_ffmpeg(track_files, final_output_path, derivatives)
+
+    # Сохранение в MinIO (потоково с диска)
+    final_object_name = final_recording_key(meeting_id)
+    await get_storage().put_file(
+        final_object_name, final_output_path, content_type=FINAL_RECORDING_CONTENT_TYPE
     )
     logger.info(f"Final merged audio saved to MinIO: {final_object_name}")
+    return final_object_name, os.path.getsize(final_output_path)
+
+
+def final_recording_key(meeting_id: int) -> str:
+    return f"recordings/meeting_{meeting_id}/final_recording.ogg"
+
 
-    # 2. Обновление БД
+def recording_derivative_key(meeting_id: int, role: str) -> str:
+    return f"recordings/meeting_{meeting_id}/{role}.ogg"
+
+
+async def register_final_recording(
+    meeting_id: int,
+    session_id: str,
+    final_object_name: str,
+    size_bytes: int,
+    role: str = FINAL_RECORDING_ROLE,
+):
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(
+        None,
+        _create_final_audio_object_sync,
+        meeting_id,
+        session_id,
+        final_object_name,
+        size_bytes,
+        role,
+    )
+
+
+async def upload_recording_derivatives(
+    meeting_id: int, session_id: str, derivatives: Sequence[RecordingDerivative]
+) -> int:
+    """
+    Загружает готовые файлы производных записей в MinIO и регистрирует каждый
+    отдельным финальным AudioObject с ролью производной. Возвращает число
+    загруженных объектов.
+    """
+    storage = get_storage()
+    uploaded = 0
+    for derivative in derivatives:
+        size = os.path.getsize(derivative.path) if os.path.exists(derivative.path) else 0
+        if not size:
+            logger.warning(
+                f"FFmpeg produced no '{derivative.role}' output for session {session_id}"
+            )
+            continue
+        object_name = recording_derivative_key(meeting_id, derivative.role)
+        await storage.put_file(
+            object_name, derivative.path, content_type=FINAL_RECORDING_CONTENT_TYPE
+        )
+        await register_final_recording(
+            meeting_id, session_id, object_name, size, role=derivative.role
+        )
+        uploaded += 1
+    if uploaded:
+        logger.info(f"Saved {uploaded} recording derivatives for session {session_id}")
+    return uploaded
+
+
+def ensure_final_recording_index_sync(engine=None):
+    """
+    Создает уникальный индекс финальных записей в уже существующей таблице
+    audio_objects (create_all добавляет индексы только к новым таблицам).
+    Если в таблице уже есть дубликаты, индекс не создается и пишется ошибка.
+    """
+    engine = engine or database.engine
+    index = next(
+        index
+        for index in models.AudioObject.__table__.indexes
+        if index.name == "uq_audio_objects_final_role"
+    )
+    try:
+        index.create(engine, checkfirst=True)
+    except Exception as e:
+        logger.error(f"Could not create index {index.name}: {e}")
+
+
+def _create_final_audio_object_sync(
+    meeting_id: int,
+    session_id: str,
+    final_object_name: str,
+    size_bytes: int,
+    role: str = FINAL_RECORDING_ROLE,
+):
+    """Создает финальную запись AudioObject сессии с ролью role, если ее еще нет."""
     db: Session = database.SessionLocal()
     try:
+        existing = (
+            db.query(models.AudioObject)
+            .filter(
+                models.AudioObject.session_id == session_id,
+                models.AudioObject.is_final == True,
+                models.AudioObject.role == role,
+            )
+            .first()
+        )
+        if existing is not None:
+            logger.info(
+                f"Final AudioObject for session {session_id} already exists: {existing.object_key}"
+            )
+            return
         ao = models.AudioObject(
             session_id=session_id,
             meeting_id=meeting_id,
             object_key=final_object_name,
-            role="merged",
-            size_bytes=len(file_data),
+            role=role,
+            size_bytes=size_bytes,
             is_final=True,
         )
         db.add(ao)
@@ -191,6 +611,13 @@ def _save_final_file_and_update_db(meeting_id: int, session_id: str, file_path:
         logger.info(
             f"Final AudioObject record created in DB for key {final_object_name}"
         )
+    except IntegrityError:
+        # Ту же запись только что создал другой процесс (живая сборка и
+        # воркер, повторно забранная задача): уникальный индекс не дал дубль
+        db.rollback()
+        logger.info(
+            f"Final '{role}' AudioObject for session {session_id} was created concurrently"
+        )
     except Exception as e:
         logger.error(f"Error updating DB with final recording info: {e}")
         db.rollback()
@@ -198,26 +625,37 @@ def _save_final_file_and_update_db(meeting_id: int, session_id: str, file_path:
     finally:
         db.close()
 
-    return final_object_name
-
 
 # --- ОСНОВНАЯ ФУНКЦИЯ, ПОЛНОСТЬЮ ПЕРЕРАБОТАНА ---
 async def process_and_merge_audio(meeting_id: int, session_id: str):
     """
     Асинхронная функция для обработки и смешивания аудио записей после звонка.
-    Финальная версия, использующая конкатенацию байтов перед обработкой в FFmpeg.
+    Чанки каждой роли подаются в FFmpeg одной склеенной дорожкой, результат
+    сразу загружается в MinIO (см. POSTPROCESS_STREAMING).
+
+    Идемпотентна: завершенные этапы отмечаются в задаче сессии
+    (PostProcessingJob.stage), и повтор после сбоя продолжает с первого
+    незавершенного этапа, не создавая второй финальный объект или запись.
     """
     logger.info(
         f"Starting post-processing for meeting {meeting_id}, session {session_id}"
     )
 
+    loop = asyncio.get_event_loop()
     db: Session = database.SessionLocal()
     all_temp_files = []
-    source_object_keys = []
-    source_object_ids = []
 
     try:
-        # 1. Получаем все аудио чанки для сессии
+        checkpoint = await loop.run_in_executor(
+            None, get_job_checkpoint_sync, session_id
+        )
+        stage = checkpoint["stage"]
+        if stage_reached(stage, STAGE_SOURCES_DELETED):
+            logger.info(f"Session {session_id} is already post-processed, skipping")
+            return
+
+        # 1. Получаем все аудио чанки для сессии и уже созданную финальную запись
+        #    (собранную на лету или предыдущим запуском)
         audio_objects = (
             db.query(models.AudioObject)
             .filter(
@@ -227,95 +665,67 @@ async def process_and_merge_audio(meeting_id: int, session_id: str):
             .order_by(models.AudioObject.created_at)
             .all()
         )
-
-        if not audio_objects:
-            logger.warning(
-                f"No audio chunks found for session {session_id}. Aborting post-processing."
+        final_object = (
+            db.query(models.AudioObject)
+            .filter(
+                models.AudioObject.session_id == session_id,
+                models.AudioObject.is_final == True,
+                models.AudioObject.role == FINAL_RECORDING_ROLE,
             )
-            return
-
+            .first()
+        )
         logger.info(f"Found {len(audio_objects)} audio chunks for session {session_id}")
-        source_object_keys = [ao.object_key for ao in audio_objects]
-        source_object_ids = [ao.id for ao in audio_objects]
-
-        # 2. Разделяем чанки по ролям
-        chunks_by_role: Dict[str, List[models.AudioObject]] = {
-            "participant": [],
-            "bot": [],
-        }
-        for ao in audio_objects:
-            if ao.role in chunks_by_role:
-                chunks_by_role[ao.role].append(ao)
-
-        # 3. Обрабатываем каждую роль: скачиваем и КОНКАТЕНИРУЕМ БАЙТЫ в один файл
-        concatenated_tracks = []
-        for role, chunks in chunks_by_role.items():
-            if not chunks:
-                continue
-
-            logger.info(f"Processing {len(chunks)} chunks for role '{role}'")
-
-            # Скачиваем все чанки для текущей роли
-            download_tasks = [
-                _download_audio_object_bytes(chunk.object_key) for chunk in chunks
-            ]
-            chunks_data = await asyncio.gather(*download_tasks)
-
-            # --- ГЛАВНОЕ ИЗМЕНЕНИЕ ---
-            # Создаем ОДИН временный файл для всей дорожки и пишем в него все байты подряд.
-            if any(chunks_data):
-                with tempfile.NamedTemporaryFile(
-                    delete=False, suffix=f"_{role}_track.webm"
-                ) as track_file:
-                    for data in chunks_data:
-                        if data:
-                            track_file.write(data)
-
-                    track_path = track_file.name
-                    logger.info(
-                        f"Created single concatenated track for role '{role}' at {track_path}"
-                    )
-
-                concatenated_tracks.append(track_path)
-                all_temp_files.append(track_path)
-            else:
-                logger.warning(f"No data found for role '{role}' after download.")
-
-        # 4. Смешиваем (микшируем) полученные дорожки
-        if not concatenated_tracks:
-            logger.warning("No audio tracks were created for mixing. Aborting.")
-            return
-
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix="_final_mixed.ogg"
-        ) as final_output_file:
-            final_output_path = final_output_file.name
-        all_temp_files.append(final_output_path)
 
-        _mix_audio_tracks_ffmpeg(concatenated_tracks, final_output_path)
+        if final_object is not None:
+            logger.info(
+                f"Final recording for session {session_id} already exists, skipping merge"
+            )
+            final_object_name = final_object.object_key
+        elif stage_reached(stage, STAGE_FINAL_UPLOADED):
+            # Финальный объект загружен, но запись в БД не успела создаться
+            final_object_name = checkpoint["final_object_key"]
+            await register_final_recording(
+                meeting_id,
+                session_id,
+                final_object_name,
+                checkpoint["final_size_bytes"] or 0,
+            )
+        else:
+            if not audio_objects:
+                raise NoAudioChunksError(
+                    f"No audio chunks found for session {session_id}"
+                )
+            final_object_name = await _merge_tracks(
+                meeting_id, session_id, audio_objects, all_temp_files
+            )
 
-        # 5. Сохраняем финальный файл в MinIO и обновляем БД
-        loop = asyncio.get_event_loop()
         await loop.run_in_executor(
             None,
-            _save_final_file_and_update_db,
-            meeting_id,
-            session_id,
-            final_output_path,
-        )
-        logger.info(
-            f"Successfully mixed and saved final recording for session {session_id}"
+            functools.partial(
+                record_stage_sync,
+                session_id,
+                STAGE_FINAL_REGISTERED,
+                final_object_key=final_object_name,
+            ),
         )
 
         # 6. Очистка исходных данных (чанки в MinIO и записи в БД)
+        await _cleanup_source_data(
+            [ao.object_key for ao in audio_objects], [ao.id for ao in audio_objects]
+        )
+        remove_spool(session_id)
         await loop.run_in_executor(
-            None, _cleanup_source_data, source_object_keys, source_object_ids
+            None, record_stage_sync, session_id, STAGE_SOURCES_DELETED
         )
 
+    except NoAudioChunksError as e:
+        logger.warning(f"{e}, post-processing will be retried")
+        raise
     except Exception as e:
         logger.exception(
             f"Critical error during post-processing for meeting {meeting_id}: {e}"
         )
+        raise  # Задача будет повторена воркером пост-обработки
     finally:
         # 7. Гарантированная очистка временных файлов на диске
         _cleanup_temp_files(all_temp_files)
@@ -323,3 +733,70 @@ async def process_and_merge_audio(meeting_id: int, session_id: str):
         logger.info(
             f"Post-processing finished for meeting {meeting_id}, session {session_id}"
         )
+
+
+async def _merge_tracks(
+    meeting_id: int,
+    session_id: str,
+    audio_objects: List[models.AudioObject],
+    all_temp_files: List[str],
+) -> str:
+    """Сводит дорожки сессии, загружает результат и регистрирует его в БД."""
+    loop = asyncio.get_event_loop()
+
+    # 2. Разделяем чанки по ролям
+    chunks_by_role: Dict[str, List[models.AudioObject]] = {
+        "participant": [],
+        "bot": [],
+    }
+    for ao in audio_objects:
+        if ao.role in chunks_by_role:
+            chunks_by_role[ao.role].append(ao)
+
+    # 3. Источник каждой дорожки: локальный файл спула этого узла
+    #    или упорядоченный список чанков в MinIO
+    track_sources: Dict[str, object] = {}
+    for role, chunks in chunks_by_role.items():
+        if not chunks:
+            continue
+
+        logger.info(f"Processing {len(chunks)} chunks for role '{role}'")
+
+        spooled_path = find_spooled_track(session_id, role)
+        if len(chunks) == 1 and spooled_path:
+            logger.info(f"Using local spool {spooled_path} for role '{role}'")
+            track_sources[role] = spooled_path
+        else:
+            track_sources[role] = [chunk.object_key for chunk in chunks]
+
+    # 4-5. Смешиваем дорожки, сохраняем результат в MinIO и обновляем БД
+    work_dir = tempfile.mkdtemp(prefix=f"aihr_mix_{meeting_id}_")
+    all_temp_files.append(work_dir)
+    derivatives = recording_derivatives(list(track_sources), work_dir)
+    if POSTPROCESS_STREAMING:
+        final_object_name, size = await _mix_and_upload_streaming(
+            meeting_id, session_id, track_sources, work_dir, derivatives
+        )
+    else:
+        final_object_name, size = await _mix_and_upload_via_files(
+            meeting_id, session_id, track_sources, work_dir, derivatives
+        )
+    # Производные регистрируются до отметки этапа: при сбое весь этап
+    # повторится, а get-or-create не создаст дубликатов
+    await upload_recording_derivatives(meeting_id, session_id, derivatives)
+    await loop.run_in_executor(
+        None,
+        functools.partial(
+            record_stage_sync,
+            session_id,
+            STAGE_FINAL_UPLOADED,
+            final_object_key=final_object_name,
+            final_size_bytes=size,
+        ),
+    )
+
+    await register_final_recording(meeting_id, session_id, final_object_name, size)
+    logger.info(
+        f"Successfully mixed and saved final recording for session {session_id}"
+    )
+    return final_object_name
@@ -0,0 +1,343 @@
+# backend/services/post_processing_jobs.py
+import datetime
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import or_
+
+from .. import database, models
+
+logger = logging.getLogger("uvicorn.error")
+
+POSTPROCESS_MAX_ATTEMPTS = int(os.getenv("POSTPROCESS_MAX_ATTEMPTS", "5"))
+POSTPROCESS_BACKOFF_BASE_SEC = float(os.getenv("POSTPROCESS_BACKOFF_BASE_SEC", "30"))
+POSTPROCESS_BACKOFF_MAX_SEC = float(os.getenv("POSTPROCESS_BACKOFF_MAX_SEC", "3600"))
+# Через сколько задача в статусе running без продления аренды считается
+# брошенной упавшим воркером
+POSTPROCESS_JOB_LEASE_SEC = float(os.getenv("POSTPROCESS_JOB_LEASE_SEC", "300"))
+# Как часто воркер продлевает аренду выполняемой задачи
+POSTPROCESS_JOB_HEARTBEAT_SEC = float(
+    os.getenv("POSTPROCESS_JOB_HEARTBEAT_SEC", str(POSTPROCESS_JOB_LEASE_SEC / 5))
+)
+
+# Этапы пост-обработки по порядку; в задаче хранится последний завершенный
+STAGE_FINAL_UPLOADED = "final_uploaded"
+STAGE_FINAL_REGISTERED = "final_registered"
+STAGE_SOURCES_DELETED = "sources_deleted"
+STAGES = (STAGE_FINAL_UPLOADED, STAGE_FINAL_REGISTERED, STAGE_SOURCES_DELETED)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def enqueue_post_processing_sync(meeting_id: int, session_id: str) -> int:
+    """
+    Ставит пост-обработку сессии в очередь. Задача одна на session_id:
+    повторная постановка возвращает уже существующую.
+    """
+    db = database.SessionLocal()
+    try:
+        job = (
+            db.query(models.PostProcessingJob)
+            .filter(models.PostProcessingJob.session_id == session_id)
+            .first()
+        )
+        if job is None:
+            job = models.PostProcessingJob(
+                session_id=session_id,
+                meeting_id=meeting_id,
+                status="pending",
+                next_run_at=_now(),
+            )
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            logger.info(
+                f"Post-processing job {job.id} queued for meeting {meeting_id}, session {session_id}"
+            )
+        return job.id
+    finally:
+        db.close()
+
+
+def claim_jobs_sync(worker_id: str, limit: int) -> List[Tuple[int, int, str]]:
+    """
+    Забирает до limit готовых к запуску задач и помечает их running.
+    Задачи running с истекшей арендой (упавший воркер) забираются повторно;
+    если попытки такой задачи исчерпаны, она помечается failed.
+    Возвращает список (job_id, meeting_id, session_id).
+    """
+    if limit <= 0:
+        return []
+    now = _now()
+    lease_expired = now - datetime.timedelta(seconds=POSTPROCESS_JOB_LEASE_SEC)
+    Job = models.PostProcessingJob
+
+    db = database.SessionLocal()
+    try:
+        jobs = (
+            db.query(Job)
+            .filter(
+                or_(
+                    (Job.status == "pending") & (Job.next_run_at <= now),
+                    (Job.status == "running") & (Job.locked_at < lease_expired),
+                )
+            )
+            .order_by(Job.next_run_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        claimed = []
+        for job in jobs:
+            if job.status == "running" and job.attempts >= POSTPROCESS_MAX_ATTEMPTS:
+                # Задача раз за разом роняет воркер: больше не запускаем
+                job.status = "failed"
+                job.last_error = f"Lease expired on attempt {job.attempts}"
+                job.locked_by = None
+                job.locked_at = None
+                logger.error(
+                    f"Post-processing job {job.id} failed: lease expired after {job.attempts} attempts"
+                )
+                continue
+            job.status = "running"
+            job.attempts += 1
+            job.locked_by = worker_id
+            job.locked_at = now
+            claimed.append((job.id, job.meeting_id, job.session_id))
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def _owned_job(db, job_id: int, worker_id: Optional[str]):
+    """
+    Задача job_id, если ее аренда все еще у worker_id (None - без проверки).
+    Иначе None: задачу уже забрал другой воркер.
+    """
+    job = db.get(models.PostProcessingJob, job_id)
+    if job is None:
+        return None
+    if worker_id is not None and (
+        job.status != "running" or job.locked_by != worker_id
+    ):
+        logger.warning(
+            f"Post-processing job {job_id} is no longer leased by {worker_id}"
+        )
+        return None
+    return job
+
+
+def heartbeat_job_sync(job_id: int, worker_id: str) -> bool:
+    """Продлевает аренду задачи. False, если аренда уже потеряна."""
+    Job = models.PostProcessingJob
+    db = database.SessionLocal()
+    try:
+        updated = (
+            db.query(Job)
+            .filter(
+                Job.id == job_id, Job.status == "running", Job.locked_by == worker_id
+            )
+            .update({Job.locked_at: _now()}, synchronize_session=False)
+        )
+        db.commit()
+        return updated == 1
+    finally:
+        db.close()
+
+
+def complete_job_sync(job_id: int, worker_id: Optional[str] = None):
+    db = database.SessionLocal()
+    try:
+        job = _owned_job(db, job_id, worker_id)
+        if job:
+            job.status = "done"
+            job.last_error = None
+            job.locked_by = None
+            job.locked_at = None
+            db.commit()
+    finally:
+        db.close()
+
+
+def fail_job_sync(job_id: int, error: str, worker_id: Optional[str] = None):
+    """Планирует повтор с экспоненциальной задержкой или помечает задачу failed."""
+    db = database.SessionLocal()
+    try:
+        job = _owned_job(db, job_id, worker_id)
+        if not job:
+            return
+        job.last_error = error[:2000]
+        job.locked_by = None
+        job.locked_at = None
+        if job.attempts >= POSTPROCESS_MAX_ATTEMPTS:
+            job.status = "failed"
+            logger.error(
+                f"Post-processing job {job_id} failed after {job.attempts} attempts: {error}"
+            )
+        else:
+            delay = min(
+                POSTPROCESS_BACKOFF_BASE_SEC * 2 ** (job.attempts - 1),
+                POSTPROCESS_BACKOFF_MAX_SEC,
+            )
+            job.status = "pending"
+            job.next_run_at = _now() + datetime.timedelta(seconds=delay)
+            logger.warning(
+                f"Post-processing job {job_id} attempt {job.attempts} failed, retry in {delay:.0f}s: {error}"
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+def repend_job_sync(session_id: str) -> bool:
+    """
+    Возвращает завершенную (done или failed) задачу сессии в очередь со
+    сброшенными попытками. False, если задачи нет или она уже в очереди.
+    """
+    Job = models.PostProcessingJob
+    db = database.SessionLocal()
+    try:
+        updated = (
+            db.query(Job)
+            .filter(Job.session_id == session_id, Job.status.in_(("done", "failed")))
+            .update(
+                {
+                    Job.status: "pending",
+                    Job.attempts: 0,
+                    Job.next_run_at: _now(),
+                    Job.last_error: None,
+                },
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        if updated:
+            logger.info(f"Post-processing of session {session_id} queued again")
+        return updated == 1
+    finally:
+        db.close()
+
+
+def stage_reached(current: Optional[str], stage: str) -> bool:
+    """True, если этап stage уже пройден при последнем завершенном current."""
+    if current not in STAGES:
+        return False
+    return STAGES.index(current) >= STAGES.index(stage)
+
+
+def get_job_checkpoint_sync(session_id: str) -> Dict:
+    """Последний завершенный этап задачи сессии и данные финального объекта."""
+    db = database.SessionLocal()
+    try:
+        job = (
+            db.query(models.PostProcessingJob)
+            .filter(models.PostProcessingJob.session_id == session_id)
+            .first()
+        )
+        if job is None:
+            return {"stage": None, "final_object_key": None, "final_size_bytes": None}
+        return {
+            "stage": job.stage,
+            "final_object_key": job.final_object_key,
+            "final_size_bytes": job.final_size_bytes,
+        }
+    finally:
+        db.close()
+
+
+def record_stage_sync(session_id: str, stage: str, **fields):
+    """
+    Отмечает этап stage завершенным. Этап не откатывается назад, так что
+    повторный или запоздалый вызов безопасен. Без задачи (ручной запуск
+    process_and_merge_audio) ничего не делает.
+    """
+    db = database.SessionLocal()
+    try:
+        job = (
+            db.query(models.PostProcessingJob)
+            .filter(models.PostProcessingJob.session_id == session_id)
+            .first()
+        )
+        if job is None:
+            return
+        for name, value in fields.items():
+            setattr(job, name, value)
+        if not stage_reached(job.stage, stage):
+            job.stage = stage
+        db.commit()
+        logger.info(f"Post-processing of session {session_id} reached stage {stage}")
+    finally:
+        db.close()
+
+
+def requeue_jobs_sync(
+    since: datetime.datetime,
+    until: datetime.datetime,
+    include_done: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, int]:
+    """
+    Возвращает в очередь пост-обработку звонков, завершившихся в [since, until):
+    failed и pending задачи запускаются заново со сброшенными попытками, а
+    встречам без задачи (например, БД была недоступна при отбое) задача
+    создается. Задачи running не трогаются: их вернет истечение аренды.
+    С include_done перезапускаются и done-задачи; пройденные этапы при этом
+    пропускаются, так что повтор не переделывает работу.
+    """
+    Job = models.PostProcessingJob
+    now = _now()
+    statuses = ["failed", "pending"] + (["done"] if include_done else [])
+    result = {"requeued": 0, "created": 0}
+
+    db = database.SessionLocal()
+    try:
+        meetings = (
+            db.query(models.Meeting.id, models.Meeting.last_session_id)
+            .filter(
+                models.Meeting.last_session_id.isnot(None),
+                models.Meeting.ended_at >= since,
+                models.Meeting.ended_at < until,
+            )
+            .all()
+        )
+        session_ids = [session_id for _, session_id in meetings]
+        jobs = {
+            job.session_id: job
+            for job in db.query(Job).filter(Job.session_id.in_(session_ids))
+        }
+
+        for meeting_id, session_id in meetings:
+            job = jobs.get(session_id)
+            if job is None:
+                result["created"] += 1
+                if not dry_run:
+                    db.add(
+                        Job(
+                            session_id=session_id,
+                            meeting_id=meeting_id,
+                            status="pending",
+                            next_run_at=now,
+                        )
+                    )
+            elif job.status in statuses:
+                result["requeued"] += 1
+                if not dry_run:
+                    job.status = "pending"
+                    job.attempts = 0
+                    job.next_run_at = now
+                    job.last_error = None
+
+        if not dry_run:
+            db.commit()
+        logger.info(
+            f"Requeue {since.isoformat()}..{until.isoformat()}: "
+            f"{result['requeued']} requeued, {result['created']} created"
+            + (" (dry run)" if dry_run else "")
+        )
+        return result
+    finally:
+        db.close()
@@ -0,0 +1,413 @@
+# backend/services/storage.py
+import asyncio
+import contextlib
+import logging
+import os
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aioboto3
+import botocore.session
+from botocore.config import Config
+
+logger = logging.getLogger("uvicorn.error")
+
+MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
+MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY", "minio")
+MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY", "minio123")
+MINIO_SECURE = os.getenv("MINIO_SECURE", "false").lower() in ("1", "true", "yes")
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+DEFAULT_BUCKET = os.getenv("MINIO_BUCKET", "audio")
+# Размер пула HTTP-соединений с хранилищем на процесс
+STORAGE_MAX_CONNECTIONS = int(os.getenv("STORAGE_MAX_CONNECTIONS", "50"))
+STORAGE_READ_CHUNK_SIZE = int(os.getenv("STORAGE_READ_CHUNK_SIZE", str(256 * 1024)))
+# Адрес хранилища, доступный клиентам (например, https://files.example.com):
+# им подписываются presigned URL. По умолчанию - MINIO_ENDPOINT
+STORAGE_PUBLIC_ENDPOINT = os.getenv("STORAGE_PUBLIC_ENDPOINT", "")
+
+# S3 DeleteObjects принимает не более 1000 ключей за запрос
+_DELETE_BATCH_SIZE = 1000
+# S3 требует, чтобы все части multipart upload, кроме последней, были >= 5 MiB
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def _endpoint_url(endpoint: str = MINIO_ENDPOINT) -> str:
+    if "://" in endpoint:
+        return endpoint
+    scheme = "https" if MINIO_SECURE else "http"
+    return f"{scheme}://{endpoint}"
+
+
+class AsyncStorage:
+    """
+    Асинхронный слой объектного хранилища (MinIO/S3) поверх aioboto3.
+
+    Держит один долгоживущий клиент с пулом соединений на процесс, поэтому
+    горячий путь звонка и пост-обработка не занимают пул потоков и не
+    открывают клиента на каждый запрос.
+    """
+
+    def __init__(
+        self, bucket: str = DEFAULT_BUCKET, max_connections: int = STORAGE_MAX_CONNECTIONS
+    ):
+        self.bucket = bucket
+        self.max_connections = max_connections
+        self._session = aioboto3.Session()
+        self._stack: Optional[contextlib.AsyncExitStack] = None
+        self._client = None
+        self._presign_client = None
+        self._lock = asyncio.Lock()
+
+    async def client(self):
+        if self._client is None:
+            async with self._lock:
+                if self._client is None:
+                    stack = contextlib.AsyncExitStack()
+                    self._client = await stack.enter_async_context(
+                        self._session.client(
+                            "s3",
+                            endpoint_url=_endpoint_url(),
+                            aws_access_key_id=MINIO_ACCESS_KEY,
+                            aws_secret_access_key=MINIO_SECRET_KEY,
+                            region_name=MINIO_REGION,
+                            config=Config(
+                                max_pool_connections=self.max_connections,
+                                signature_version="s3v4",
+                            ),
+                        )
+                    )
+                    self._stack = stack
+        return self._client
+
+    async def close(self):
+        if self._stack is not None:
+            await self._stack.aclose()
+        self._stack = None
+        self._client = None
+
+    async def ensure_bucket(self):
+        s3 = await self.client()
+        try:
+            await s3.head_bucket(Bucket=self.bucket)
+        except Exception:
+            # create bucket (simple, not region-aware)
+            await s3.create_bucket(Bucket=self.bucket)
+
+    # --- ЗАПИСЬ ---
+
+    async def put_bytes(
+        self, key: str, data: bytes, content_type: str = "application/octet-stream"
+    ):
+        s3 = await self.client()
+        await s3.put_object(
+            Bucket=self.bucket, Key=key, Body=data, ContentType=content_type
+        )
+        return key
+
+    async def put_file(
+        self, key: str, file_path: str, content_type: str = "application/octet-stream"
+    ):
+        """Загружает файл с диска (для больших файлов - частями)."""
+        s3 = await self.client()
+        await s3.upload_file(
+            file_path, self.bucket, key, ExtraArgs={"ContentType": content_type}
+        )
+        return key
+
+    # --- ЧТЕНИЕ ---
+
+    async def get_bytes(self, key: str) -> bytes:
+        s3 = await self.client()
+        response = await s3.get_object(Bucket=self.bucket, Key=key)
+        async with response["Body"] as body:
+            return await body.read()
+
+    async def iter_object(
+        self, key: str, chunk_size: int = STORAGE_READ_CHUNK_SIZE
+    ) -> AsyncIterator[bytes]:
+        """Потоково читает объект кусками chunk_size и освобождает соединение."""
+        s3 = await self.client()
+        response = await s3.get_object(Bucket=self.bucket, Key=key)
+        async with response["Body"] as body:
+            while True:
+                chunk = await body.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    async def open_object(
+        self,
+        key: str,
+        byte_range: Optional[str] = None,
+        if_match: Optional[str] = None,
+        if_none_match: Optional[str] = None,
+    ) -> Dict:
+        """
+        GetObject с необязательными Range ("bytes=0-99") и условиями. Возвращает
+        ответ S3 как есть: тело response["Body"] вызывающий читает и закрывает
+        сам (async with), чтобы соединение вернулось в пул.
+        """
+        s3 = await self.client()
+        kwargs = {"Bucket": self.bucket, "Key": key}
+        if byte_range:
+            kwargs["Range"] = byte_range
+        if if_match:
+            kwargs["IfMatch"] = if_match
+        if if_none_match:
+            kwargs["IfNoneMatch"] = if_none_match
+        return await s3.get_object(**kwargs)
+
+    async def head_object(self, key: str) -> Dict:
+        s3 = await self.client()
+        return await s3.head_object(Bucket=self.bucket, Key=key)
+
+    async def list_objects_page(
+        self, prefix: str, start_after: Optional[str] = None, max_keys: int = 1000
+    ) -> List[Dict]:
+        """
+        Одна страница списка объектов с префиксом prefix, по возрастанию ключа
+        после start_after. Элементы - словари S3 (Key, Size, LastModified).
+        """
+        s3 = await self.client()
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix, "MaxKeys": max_keys}
+        if start_after:
+            kwargs["StartAfter"] = start_after
+        response = await s3.list_objects_v2(**kwargs)
+        return response.get("Contents", [])
+
+    # --- MULTIPART UPLOAD ---
+
+    async def create_multipart_upload(
+        self, key: str, content_type: str = "application/octet-stream"
+    ) -> str:
+        s3 = await self.client()
+        response = await s3.create_multipart_upload(
+            Bucket=self.bucket, Key=key, ContentType=content_type
+        )
+        return response["UploadId"]
+
+    async def upload_part(
+        self, key: str, upload_id: str, part_number: int, data: bytes
+    ) -> Dict:
+        """Загружает одну часть (все, кроме последней, должны быть >= 5 MiB)."""
+        s3 = await self.client()
+        response = await s3.upload_part(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    async def complete_multipart_upload(self, key: str, upload_id: str, parts: List):
+        s3 = await self.client()
+        await s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
+    async def abort_multipart_upload(self, key: str, upload_id: str):
+        s3 = await self.client()
+        await s3.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+    async def list_multipart_uploads_page(
+        self,
+        prefix: str,
+        key_marker: Optional[str] = None,
+        upload_id_marker: Optional[str] = None,
+        max_uploads: int = 1000,
+    ) -> Tuple[List[Dict], Optional[Tuple[str, str]]]:
+        """
+        Одна страница незавершенных multipart upload с префиксом prefix.
+        Возвращает элементы S3 (Key, UploadId, Initiated) и маркеры
+        (key_marker, upload_id_marker) следующей страницы или None.
+        """
+        s3 = await self.client()
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix, "MaxUploads": max_uploads}
+        if key_marker:
+            kwargs["KeyMarker"] = key_marker
+            if upload_id_marker:
+                kwargs["UploadIdMarker"] = upload_id_marker
+        response = await s3.list_multipart_uploads(**kwargs)
+        next_page = None
+        if response.get("IsTruncated"):
+            next_page = (
+                response.get("NextKeyMarker"),
+                response.get("NextUploadIdMarker"),
+            )
+        return response.get("Uploads", []), next_page
+
+    async def copy_object(self, source_key: str, key: str):
+        """Копирует объект внутри бакета на стороне хранилища (до 5 GiB)."""
+        s3 = await self.client()
+        await s3.copy_object(
+            Bucket=self.bucket,
+            Key=key,
+            CopySource={"Bucket": self.bucket, "Key": source_key},
+        )
+
+    # --- УДАЛЕНИЕ ---
+
+    async def delete_objects(self, keys: List[str]) -> int:
+        """Массово удаляет объекты пачками по 1000. Возвращает число ошибок."""
+        s3 = await self.client()
+        error_count = 0
+        for start in range(0, len(keys), _DELETE_BATCH_SIZE):
+            batch = keys[start : start + _DELETE_BATCH_SIZE]
+            response = await s3.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True},
+            )
+            for error in response.get("Errors", []):
+                error_count += 1
+                # Логируем ошибки, но не прерываем процесс
+                logger.warning(
+                    f"Error occurred when deleting object {error.get('Key')}: "
+                    f"{error.get('Message')}"
+                )
+        if error_count > 0:
+            logger.warning(f"Encountered {error_count} errors during object deletion.")
+        return error_count
+
+    async def generate_presigned_url(self, key: str, expires: int = 3600) -> str:
+        return self.presign_get_url(key, expires)
+
+    def presign_get_url(
+        self,
+        key: str,
+        expires: int = 3600,
+        content_type: Optional[str] = None,
+        content_disposition: Optional[str] = None,
+    ) -> str:
+        """
+        Presigned GET URL для клиентов (подписывается на STORAGE_PUBLIC_ENDPOINT).
+        Подпись считается локально, без запроса к хранилищу, поэтому метод
+        синхронный. content_type и content_disposition хранилище подставит в
+        заголовки ответа.
+        """
+        params = {"Bucket": self.bucket, "Key": key}
+        if content_type:
+            params["ResponseContentType"] = content_type
+        if content_disposition:
+            params["ResponseContentDisposition"] = content_disposition
+        return self._presigner().generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=expires
+        )
+
+    def _presigner(self):
+        if self._presign_client is None:
+            self._presign_client = botocore.session.get_session().create_client(
+                "s3",
+                endpoint_url=_endpoint_url(STORAGE_PUBLIC_ENDPOINT or MINIO_ENDPOINT),
+                aws_access_key_id=MINIO_ACCESS_KEY,
+                aws_secret_access_key=MINIO_SECRET_KEY,
+                region_name=MINIO_REGION,
+                config=Config(
+                    signature_version="s3v4", s3={"addressing_style": "path"}
+                ),
+            )
+        return self._presign_client
+
+
+class MultipartUpload:
+    """
+    Потоковая запись одного объекта через S3 multipart upload: данные
+    копятся в буфере и уходят частями по part_size, поэтому в памяти
+    одновременно лежит не больше одной части.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        content_type: str = "application/octet-stream",
+        part_size: int = MULTIPART_MIN_PART_SIZE,
+        storage: Optional[AsyncStorage] = None,
+    ):
+        self.key = key
+        self.content_type = content_type
+        self.part_size = max(part_size, MULTIPART_MIN_PART_SIZE)
+        self.size = 0
+        self._storage = storage
+        self._upload_id: Optional[str] = None
+        self._parts = []
+        self._buffer = bytearray()
+
+    @property
+    def storage(self) -> AsyncStorage:
+        return self._storage or get_storage()
+
+    @property
+    def part_count(self) -> int:
+        """Число уже загруженных частей."""
+        return len(self._parts)
+
+    async def open(self):
+        self._upload_id = await self.storage.create_multipart_upload(
+            self.key, self.content_type
+        )
+        logger.debug(f"Opened multipart upload {self._upload_id} for {self.key}")
+
+    async def write(self, data: bytes):
+        if not data:
+            return
+        self._buffer += data
+        self.size += len(data)
+        if len(self._buffer) >= self.part_size:
+            await self._upload_buffer()
+
+    async def complete(self) -> int:
+        """
+        Загружает последнюю часть и завершает upload. Возвращает размер
+        объекта; если данных не было, upload отменяется и возвращается 0.
+        """
+        if self._upload_id is None:
+            return 0
+        try:
+            if self._buffer:
+                await self._upload_buffer()
+            if not self._parts:
+                await self.storage.abort_multipart_upload(self.key, self._upload_id)
+                return 0
+            await self.storage.complete_multipart_upload(
+                self.key, self._upload_id, self._parts
+            )
+        except Exception:
+            await self.abort()
+            raise
+        finally:
+            self._upload_id = None
+
+        logger.info(
+            f"Object {self.key} uploaded: {len(self._parts)} parts, {self.size} bytes"
+        )
+        return self.size
+
+    async def abort(self):
+        if self._upload_id is None:
+            return
+        try:
+            await self.storage.abort_multipart_upload(self.key, self._upload_id)
+        except Exception as e:
+            logger.warning(f"Could not abort multipart upload {self.key}: {e}")
+        self._upload_id = None
+
+    async def _upload_buffer(self):
+        part_number = len(self._parts) + 1
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        part = await self.storage.upload_part(
+            self.key, self._upload_id, part_number, data
+        )
+        self._parts.append(part)
+
+
+_storage = None
+
+
+def get_storage() -> AsyncStorage:
+    global _storage
+    if _storage is None:
+        _storage = AsyncStorage()
+    return _storage
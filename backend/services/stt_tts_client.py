@@ -1,15 +1,27 @@
 # backend/services/stt_tts_client.py
 import logging
 import os
+from urllib.parse import urlsplit, urlunsplit
 
 import aiohttp
 
 logger = logging.getLogger("uvicorn.error")
 
 STT_TTS_WS_URL = os.getenv("STT_TTS_WS_URL", "ws://localhost:8080/call")
+# Лимит одновременных соединений с STT/TTS (0 - без лимита)
+STT_TTS_MAX_CONNECTIONS = int(os.getenv("STT_TTS_MAX_CONNECTIONS", "0"))
+# Время жизни кэша DNS коннектора, секунд (0 - не кэшировать)
+STT_TTS_DNS_CACHE_TTL = int(os.getenv("STT_TTS_DNS_CACHE_TTL", "300"))
+STT_TTS_WARMUP = os.getenv("STT_TTS_WARMUP", "true").lower() in ("1", "true", "yes")
 
 
 class STTClient:
+    """
+    Клиент STT/TTS сервиса с одной долгоживущей aiohttp-сессией и коннектором,
+    общими для всех звонков: DNS и пул соединений не создаются заново на каждый
+    звонок.
+    """
+
     def __init__(self, url: str = None):
         self.url = url or STT_TTS_WS_URL
         self._session = None
@@ -17,20 +29,44 @@ class STTClient:
 
     async def _ensure_session(self):
         if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=STT_TTS_MAX_CONNECTIONS,
+                use_dns_cache=STT_TTS_DNS_CACHE_TTL > 0,
+                ttl_dns_cache=STT_TTS_DNS_CACHE_TTL or None,
+            )
             timeout = aiohttp.ClientTimeout(total=30)
-            self._session = aiohttp.ClientSession(timeout=timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
 
-    async def connect(self):
+    async def connect(self, token: str = None):
+        """Открывает WebSocket звонка через общую сессию: {url}/{token}."""
         await self._ensure_session()
-        logger.info(f"Connecting to STT/TTS service: {self.url}")
+        url = f"{self.url}/{token}" if token else self.url
+        logger.info(f"Connecting to STT/TTS service: {url}")
         try:
-            ws = await self._session.ws_connect(self.url)
+            ws = await self._session.ws_connect(url)
             logger.info("Successfully connected to STT/TTS service")
             return ws
         except Exception as e:
             logger.error(f"Failed to connect to STT/TTS service: {e}")
             raise
 
+    async def warm_up(self):
+        """
+        Прогрев при старте приложения: создает сессию, разрешает DNS в кэш
+        коннектора и оставляет в пуле keep-alive соединение с сервисом.
+        """
+        await self._ensure_session()
+        parts = urlsplit(self.url)
+        scheme = "https" if parts.scheme == "wss" else "http"
+        base_url = urlunsplit((scheme, parts.netloc, "/", "", ""))
+        try:
+            async with self._session.head(base_url) as resp:
+                logger.info(
+                    f"STT/TTS service warmed up: {base_url} answered {resp.status}"
+                )
+        except Exception as e:
+            logger.warning(f"Could not warm up STT/TTS connection to {base_url}: {e}")
+
     async def close(self):
         if self._session and not self._session.closed:
             await self._session.close()
@@ -0,0 +1,482 @@
+# backend/services/sweeper.py
+"""
+Фоновая уборка брошенных чанков звонков.
+
+Если процесс упал посреди звонка или сборка так и не удалась, объекты
+calls/{session_id}/... и нефинальные AudioObject остаются навсегда. Уборщик
+постранично проходит сессии, чей последний чанк старше SWEEP_STALE_AFTER_SEC:
+
+- у сессии уже есть финальная запись - оставшиеся чанки удаляются;
+- звонок известен (Meeting.last_session_id), а задачи нет - ставится сборка;
+- задача done, а merged-записи нет (чанки зарегистрированы уже после сборки,
+  например после сбоя пакетной вставки), или задача failed, но чанки новее ее
+  последнего запуска - задача возвращается в очередь;
+- собрать нельзя (задача failed, встреча неизвестна) - чанки удаляются,
+  когда станут старше SWEEP_DELETE_AFTER_SEC (до этого их можно вернуть в
+  очередь командой requeue);
+- задача pending/running - сессия не трогается.
+
+Затем так же постранично проходит объекты calls/ в хранилище и удаляет те,
+для которых нет строки AudioObject (например, чанк загружен, а пакет
+метаданных потерян при падении процесса), а также брошенные временные
+объекты загрузок documents/incoming/. Незавершенные multipart upload под
+этими префиксами (процесс упал посреди звонка или загрузки) старше
+SWEEP_ABORT_UPLOADS_AFTER_SEC отменяются: их части не видны в списке объектов,
+но занимают место в хранилище.
+
+Проход ограничен SWEEP_MAX_DELETES_PER_PASS удалениями, между страницами
+выдерживается пауза SWEEP_PAGE_DELAY_SEC, а курсоры сохраняются между
+проходами, так что уборка растягивается во времени и не конкурирует с живыми
+звонками за хранилище и БД. Проход выполняется под advisory lock Postgres:
+если уборщик запущен в нескольких воркерах, одновременно проходит только один.
+"""
+import asyncio
+import datetime
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from sqlalchemy import func, text
+
+from .. import database, models
+from .documents import DOCUMENTS_INCOMING_PREFIX
+from .post_processing import FINAL_RECORDING_ROLE
+from .post_processing_jobs import (STAGE_SOURCES_DELETED,
+                                   enqueue_post_processing_sync,
+                                   repend_job_sync)
+from .storage import get_storage
+
+logger = logging.getLogger("uvicorn.error")
+
+# Запускать уборку в воркере пост-обработки (проходы разных воркеров
+# не пересекаются благодаря advisory lock)
+SWEEP_ENABLED = os.getenv("SWEEP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Пауза между проходами, секунд
+SWEEP_INTERVAL_SEC = float(os.getenv("SWEEP_INTERVAL_SEC", "900"))
+# Сессия считается брошенной, если ее последний чанк старше этого, секунд
+SWEEP_STALE_AFTER_SEC = float(os.getenv("SWEEP_STALE_AFTER_SEC", str(6 * 3600)))
+# Через сколько удалять чанки, которые собрать не получится, секунд
+SWEEP_DELETE_AFTER_SEC = float(
+    os.getenv("SWEEP_DELETE_AFTER_SEC", str(7 * 24 * 3600))
+)
+# Через сколько отменять незавершенный multipart upload, секунд; должно быть
+# больше самого длинного звонка
+SWEEP_ABORT_UPLOADS_AFTER_SEC = float(
+    os.getenv("SWEEP_ABORT_UPLOADS_AFTER_SEC", str(24 * 3600))
+)
+# Сессий (или объектов хранилища) на страницу и пауза между страницами
+SWEEP_PAGE_SIZE = int(os.getenv("SWEEP_PAGE_SIZE", "100"))
+SWEEP_PAGE_DELAY_SEC = float(os.getenv("SWEEP_PAGE_DELAY_SEC", "1"))
+# Сколько объектов можно удалить за один проход
+SWEEP_MAX_DELETES_PER_PASS = int(os.getenv("SWEEP_MAX_DELETES_PER_PASS", "20000"))
+
+CALLS_PREFIX = "calls/"
+# Ключ pg_advisory_lock прохода уборки
+SWEEP_LOCK_KEY = 0x5357_4545  # "SWEE"
+
+# Решения по сессии
+ENQUEUE = "enqueue"
+REPEND = "repend"
+DELETE = "delete"
+KEEP = "keep"
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    # SQLite возвращает время без часового пояса
+    return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+
+
+def stale_sessions_page_sync(
+    stale_before: datetime.datetime, after: Optional[str], limit: int
+) -> List[Tuple[str, datetime.datetime]]:
+    """
+    Следующая страница сессий (по возрастанию session_id после after), у
+    которых есть нефинальные чанки и самый новый из них старше stale_before.
+    """
+    AO = models.AudioObject
+    last_chunk_at = func.max(AO.created_at)
+    db = database.SessionLocal()
+    try:
+        query = db.query(AO.session_id, last_chunk_at).filter(AO.is_final == False)
+        if after is not None:
+            query = query.filter(AO.session_id > after)
+        return [
+            (session_id, _as_utc(last_at))
+            for session_id, last_at in query.group_by(AO.session_id)
+            .having(last_chunk_at < stale_before)
+            .order_by(AO.session_id)
+            .limit(limit)
+            .all()
+        ]
+    finally:
+        db.close()
+
+
+def classify_sessions_sync(
+    sessions: List[Tuple[str, datetime.datetime]], delete_before: datetime.datetime
+) -> Dict[str, Tuple[str, Optional[int]]]:
+    """Решение по каждой сессии: {session_id: (ENQUEUE|DELETE|KEEP, meeting_id)}."""
+    session_ids = [session_id for session_id, _ in sessions]
+    db = database.SessionLocal()
+    try:
+        with_final = {
+            session_id
+            for (session_id,) in db.query(models.AudioObject.session_id)
+            .filter(
+                models.AudioObject.session_id.in_(session_ids),
+                models.AudioObject.is_final == True,
+                # Производные (telegram, stem_*) без merged не заменяют чанки
+                models.AudioObject.role == FINAL_RECORDING_ROLE,
+            )
+            .distinct()
+        }
+        jobs = {
+            session_id: (status, stage, _as_utc(updated_at) if updated_at else None)
+            for session_id, status, stage, updated_at in db.query(
+                models.PostProcessingJob.session_id,
+                models.PostProcessingJob.status,
+                models.PostProcessingJob.stage,
+                models.PostProcessingJob.updated_at,
+            ).filter(models.PostProcessingJob.session_id.in_(session_ids))
+        }
+        meeting_ids = {
+            session_id: meeting_id
+            for meeting_id, session_id in db.query(
+                models.Meeting.id, models.Meeting.last_session_id
+            ).filter(models.Meeting.last_session_id.in_(session_ids))
+        }
+    finally:
+        db.close()
+
+    decisions = {}
+    for session_id, last_chunk_at in sessions:
+        status, stage, job_updated_at = jobs.get(session_id, (None, None, None))
+        meeting_id = meeting_ids.get(session_id)
+        if status in ("pending", "running"):
+            decision = KEEP
+        elif session_id in with_final:
+            decision = DELETE
+        elif status is None and meeting_id is not None:
+            decision = ENQUEUE
+        elif (status == "done" and stage != STAGE_SOURCES_DELETED) or (
+            status == "failed"
+            and job_updated_at is not None
+            and last_chunk_at > job_updated_at
+        ):
+            # Чанки есть, а merged нет: сборка шла без них. Задачу, дошедшую
+            # до удаления исходников, повтор бы сразу пропустил
+            decision = REPEND
+        elif last_chunk_at < delete_before:
+            decision = DELETE
+        else:
+            decision = KEEP
+        decisions[session_id] = (decision, meeting_id)
+    return decisions
+
+
+def session_chunks_sync(session_ids: List[str]) -> List[Tuple[int, str]]:
+    """(id, object_key) нефинальных чанков сессий."""
+    db = database.SessionLocal()
+    try:
+        return (
+            db.query(models.AudioObject.id, models.AudioObject.object_key)
+            .filter(
+                models.AudioObject.session_id.in_(session_ids),
+                models.AudioObject.is_final == False,
+            )
+            .all()
+        )
+    finally:
+        db.close()
+
+
+def delete_audio_rows_sync(object_ids: List[int], page_size: int = 1000) -> int:
+    """Удаляет строки AudioObject пачками по page_size. Возвращает их число."""
+    deleted = 0
+    db = database.SessionLocal()
+    try:
+        for start in range(0, len(object_ids), page_size):
+            deleted += (
+                db.query(models.AudioObject)
+                .filter(
+                    models.AudioObject.id.in_(object_ids[start : start + page_size])
+                )
+                .delete(synchronize_session=False)
+            )
+            db.commit()
+        return deleted
+    finally:
+        db.close()
+
+
+def known_object_keys_sync(keys: List[str]) -> set:
+    """Какие из ключей хранилища записаны в audio_objects."""
+    db = database.SessionLocal()
+    try:
+        return {
+            key
+            for (key,) in db.query(models.AudioObject.object_key).filter(
+                models.AudioObject.object_key.in_(keys)
+            )
+        }
+    finally:
+        db.close()
+
+
+def acquire_sweep_lock_sync():
+    """
+    Берет advisory lock прохода уборки на отдельном соединении. Возвращает
+    соединение (держать до release_sweep_lock_sync), True без Postgres или
+    None, если проход уже идет в другом процессе.
+    """
+    if database.engine.dialect.name != "postgresql":
+        return True
+    conn = database.engine.connect()
+    try:
+        acquired = conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": SWEEP_LOCK_KEY}
+        ).scalar()
+        conn.commit()
+    except Exception:
+        conn.close()
+        raise
+    if not acquired:
+        conn.close()
+        return None
+    return conn
+
+
+def release_sweep_lock_sync(lock):
+    if lock is True or lock is None:
+        return
+    try:
+        lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SWEEP_LOCK_KEY})
+        lock.commit()
+    finally:
+        lock.close()
+
+
+class Sweeper:
+    """
+    Уборщик брошенных сессий и объектов. run_pass() делает один ограниченный
+    проход и продолжает с того места, где остановился предыдущий.
+    """
+
+    def __init__(
+        self,
+        stale_after: float = SWEEP_STALE_AFTER_SEC,
+        delete_after: float = SWEEP_DELETE_AFTER_SEC,
+        page_size: int = SWEEP_PAGE_SIZE,
+        page_delay: float = SWEEP_PAGE_DELAY_SEC,
+        max_deletes: int = SWEEP_MAX_DELETES_PER_PASS,
+        abort_uploads_after: float = SWEEP_ABORT_UPLOADS_AFTER_SEC,
+    ):
+        self.stale_after = stale_after
+        self.delete_after = delete_after
+        self.abort_uploads_after = abort_uploads_after
+        self.page_size = max(1, page_size)
+        self.page_delay = page_delay
+        self.max_deletes = max_deletes
+        self._session_cursor: Optional[str] = None
+        self._object_cursor: Optional[str] = None
+
+    async def run_forever(self, interval: float = SWEEP_INTERVAL_SEC):
+        logger.info(f"Sweeper started, pass every {interval:.0f}s")
+        while True:
+            try:
+                await self.run_pass()
+            except Exception as e:
+                logger.error(f"Sweeper pass failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def run_pass(self, dry_run: bool = False) -> Dict[str, int]:
+        stats = {
+            "sessions_enqueued": 0,
+            "sessions_repended": 0,
+            "sessions_deleted": 0,
+            "sessions_kept": 0,
+            "chunks_deleted": 0,
+            "orphan_objects_deleted": 0,
+            "incoming_documents_deleted": 0,
+            "multipart_uploads_aborted": 0,
+        }
+        lock = await anyio.to_thread.run_sync(acquire_sweep_lock_sync)
+        if lock is None:
+            logger.info("Sweeper pass skipped: another process is sweeping")
+            return stats
+        try:
+            budget = [self.max_deletes]
+            await self._sweep_sessions(stats, budget, dry_run)
+            if budget[0] > 0:
+                await self._sweep_orphan_objects(stats, budget, dry_run)
+            if budget[0] > 0:
+                await self._sweep_incoming_documents(stats, budget, dry_run)
+            for prefix in (CALLS_PREFIX, DOCUMENTS_INCOMING_PREFIX):
+                if budget[0] > 0:
+                    await self._sweep_stale_uploads(prefix, stats, budget, dry_run)
+        finally:
+            await anyio.to_thread.run_sync(release_sweep_lock_sync, lock)
+        if any(stats.values()):
+            logger.info(
+                f"Sweeper pass{' (dry run)' if dry_run else ''}: "
+                + ", ".join(f"{name} {value}" for name, value in stats.items())
+            )
+        return stats
+
+    async def _sweep_sessions(self, stats: Dict, budget: List[int], dry_run: bool):
+        now = _now()
+        stale_before = now - datetime.timedelta(seconds=self.stale_after)
+        delete_before = now - datetime.timedelta(seconds=self.delete_after)
+
+        while budget[0] > 0:
+            sessions = await anyio.to_thread.run_sync(
+                stale_sessions_page_sync,
+                stale_before,
+                self._session_cursor,
+                self.page_size,
+            )
+            if not sessions:
+                # Дошли до конца: следующий проход начнется сначала
+                self._session_cursor = None
+                return
+            decisions = await anyio.to_thread.run_sync(
+                classify_sessions_sync, sessions, delete_before
+            )
+
+            to_delete = []
+            for session_id, (decision, meeting_id) in decisions.items():
+                if decision == ENQUEUE:
+                    stats["sessions_enqueued"] += 1
+                    if not dry_run:
+                        await anyio.to_thread.run_sync(
+                            enqueue_post_processing_sync, meeting_id, session_id
+                        )
+                elif decision == REPEND:
+                    stats["sessions_repended"] += 1
+                    if not dry_run:
+                        await anyio.to_thread.run_sync(repend_job_sync, session_id)
+                elif decision == DELETE:
+                    to_delete.append(session_id)
+                else:
+                    stats["sessions_kept"] += 1
+
+            if to_delete:
+                chunks = await anyio.to_thread.run_sync(session_chunks_sync, to_delete)
+                stats["sessions_deleted"] += len(to_delete)
+                stats["chunks_deleted"] += len(chunks)
+                budget[0] -= len(chunks)
+                if not dry_run:
+                    await self._delete_chunks(chunks)
+
+            self._session_cursor = sessions[-1][0]
+            await asyncio.sleep(self.page_delay)
+
+    async def _delete_chunks(self, chunks: List[Tuple[int, str]]):
+        # Сначала объекты: если удаление строк не пройдет, сессия попадет
+        # в следующий проход, а если не пройдет удаление объектов - их найдет
+        # проход по хранилищу
+        await get_storage().delete_objects([key for _, key in chunks])
+        await anyio.to_thread.run_sync(
+            delete_audio_rows_sync, [object_id for object_id, _ in chunks]
+        )
+
+    async def _sweep_orphan_objects(
+        self, stats: Dict, budget: List[int], dry_run: bool
+    ):
+        stale_before = _now() - datetime.timedelta(seconds=self.stale_after)
+        storage = get_storage()
+
+        while budget[0] > 0:
+            page = await storage.list_objects_page(
+                CALLS_PREFIX, start_after=self._object_cursor, max_keys=self.page_size
+            )
+            if not page:
+                self._object_cursor = None
+                return
+            candidates = [
+                item["Key"]
+                for item in page
+                if _as_utc(item["LastModified"]) < stale_before
+            ]
+            if candidates:
+                known = await anyio.to_thread.run_sync(
+                    known_object_keys_sync, candidates
+                )
+                orphans = [key for key in candidates if key not in known][: budget[0]]
+                if orphans:
+                    stats["orphan_objects_deleted"] += len(orphans)
+                    budget[0] -= len(orphans)
+                    if not dry_run:
+                        await storage.delete_objects(orphans)
+                    if budget[0] <= 0:
+                        self._object_cursor = orphans[-1]
+                        return
+
+            self._object_cursor = page[-1]["Key"]
+            await asyncio.sleep(self.page_delay)
+
+    async def _sweep_incoming_documents(
+        self, stats: Dict, budget: List[int], dry_run: bool
+    ):
+        # Временный объект живет секунды: старый остался от упавшей загрузки
+        stale_before = _now() - datetime.timedelta(seconds=self.stale_after)
+        storage = get_storage()
+        cursor = None
+
+        while budget[0] > 0:
+            page = await storage.list_objects_page(
+                DOCUMENTS_INCOMING_PREFIX, start_after=cursor, max_keys=self.page_size
+            )
+            if not page:
+                return
+            stale = [
+                item["Key"]
+                for item in page
+                if _as_utc(item["LastModified"]) < stale_before
+            ][: budget[0]]
+            if stale:
+                stats["incoming_documents_deleted"] += len(stale)
+                budget[0] -= len(stale)
+                if not dry_run:
+                    await storage.delete_objects(stale)
+            cursor = page[-1]["Key"]
+            await asyncio.sleep(self.page_delay)
+
+    async def _sweep_stale_uploads(
+        self, prefix: str, stats: Dict, budget: List[int], dry_run: bool
+    ):
+        stale_before = _now() - datetime.timedelta(seconds=self.abort_uploads_after)
+        storage = get_storage()
+        key_marker = upload_id_marker = None
+
+        while budget[0] > 0:
+            uploads, next_page = await storage.list_multipart_uploads_page(
+                prefix, key_marker, upload_id_marker, max_uploads=self.page_size
+            )
+            stale = [
+                upload
+                for upload in uploads
+                if _as_utc(upload["Initiated"]) < stale_before
+            ][: budget[0]]
+            for upload in stale:
+                stats["multipart_uploads_aborted"] += 1
+                budget[0] -= 1
+                if dry_run:
+                    continue
+                try:
+                    await storage.abort_multipart_upload(
+                        upload["Key"], upload["UploadId"]
+                    )
+                except Exception as e:
+                    logger.warning(
+                        f"Could not abort multipart upload {upload['Key']}: {e}"
+                    )
+            if next_page is None:
+                return
+            key_marker, upload_id_marker = next_page
+            await asyncio.sleep(self.page_delay)
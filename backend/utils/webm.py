@@ -0,0 +1,581 @@
+# backend/utils/webm.py
+"""
+Минимальный потоковый разбор и запись WebM/Matroska для аудиодорожек звонка.
+
+Чанки MediaRecorder - это последовательные куски одного потока WebM: заголовок
+EBML, Segment неизвестного размера, Info, Tracks и далее кластеры с блоками.
+Кластеры и Segment могут иметь неизвестный размер, а граница чанка может
+прийтись на середину элемента, поэтому разбор идет по накопительному буферу:
+Segment и Cluster только "открываются", а все остальные элементы читаются
+целиком, когда их байты пришли.
+
+Здесь же считается длительность блоков Opus (по TOC-байту пакета) и
+склеиваются чанки одной дорожки в один корректный WebM (WebMRemuxer) -
+без запуска ffmpeg.
+"""
+import logging
+from typing import List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger("uvicorn.error")
+
+# --- ИДЕНТИФИКАТОРЫ ЭЛЕМЕНТОВ ---
+
+EBML_ID = 0x1A45DFA3
+SEGMENT_ID = 0x18538067
+SEEK_HEAD_ID = 0x114D9B74
+INFO_ID = 0x1549A966
+TRACKS_ID = 0x1654AE6B
+CLUSTER_ID = 0x1F43B675
+CUES_ID = 0x1C53BB6B
+TAGS_ID = 0x1254C367
+CHAPTERS_ID = 0x1043A770
+ATTACHMENTS_ID = 0x1941A469
+VOID_ID = 0xEC
+CRC32_ID = 0xBF
+
+TIMECODE_SCALE_ID = 0x2AD7B1
+CLUSTER_TIMECODE_ID = 0xE7
+CLUSTER_POSITION_ID = 0xA7
+CLUSTER_PREV_SIZE_ID = 0xAB
+SIMPLE_BLOCK_ID = 0xA3
+BLOCK_GROUP_ID = 0xA0
+BLOCK_ID = 0xA1
+BLOCK_DURATION_ID = 0x9B
+
+TRACK_ENTRY_ID = 0xAE
+TRACK_NUMBER_ID = 0xD7
+CODEC_ID_ID = 0x86
+
+DEFAULT_TIMECODE_SCALE = 1_000_000  # нс на тик
+OPUS_CODEC_ID = "A_OPUS"
+
+# Элементы, внутрь которых парсер "входит", не дожидаясь их конца
+_CONTAINER_IDS = {SEGMENT_ID, CLUSTER_ID}
+# Все элементы, которые допустимы на уровне Segment/Cluster. Любой другой ID
+# означает потерянные или битые байты, и парсер ищет следующий кластер
+_KNOWN_IDS = _CONTAINER_IDS | {
+    EBML_ID,
+    SEEK_HEAD_ID,
+    INFO_ID,
+    TRACKS_ID,
+    CUES_ID,
+    TAGS_ID,
+    CHAPTERS_ID,
+    ATTACHMENTS_ID,
+    VOID_ID,
+    CRC32_ID,
+    CLUSTER_TIMECODE_ID,
+    CLUSTER_POSITION_ID,
+    CLUSTER_PREV_SIZE_ID,
+    SIMPLE_BLOCK_ID,
+    BLOCK_GROUP_ID,
+}
+# Элементы, с которых можно продолжить разбор после битых байтов
+_RESYNC_MARKERS = (CLUSTER_ID.to_bytes(4, "big"), EBML_ID.to_bytes(4, "big"))
+# Верхняя граница размера читаемого целиком элемента
+_MAX_ELEMENT_SIZE = 16 * 1024 * 1024
+
+# Размер "неизвестен" (все биты значения vint - единицы): для потоковой записи
+_UNKNOWN_SIZE = b"\x01\xff\xff\xff\xff\xff\xff\xff"
+_UNKNOWN_SIZE_SEGMENT = SEGMENT_ID.to_bytes(4, "big") + _UNKNOWN_SIZE
+_UNKNOWN_SIZE_CLUSTER = CLUSTER_ID.to_bytes(4, "big") + _UNKNOWN_SIZE
+
+# Длительность кадра Opus по номеру конфигурации TOC (RFC 6716, 3.1), мкс
+_OPUS_FRAME_US = (
+    [10000, 20000, 40000, 60000] * 3  # SILK
+    + [10000, 20000] * 2  # Hybrid
+    + [2500, 5000, 10000, 20000] * 4  # CELT
+)
+
+
+class WebMError(ValueError):
+    """Байты не являются корректным элементом EBML."""
+
+
+# --- EBML: ЧТЕНИЕ ---
+
+
+def read_element_id(buf, pos: int) -> Optional[Tuple[int, int]]:
+    """Читает ID элемента (с маркерными битами). None - байтов пока не хватает."""
+    if pos >= len(buf):
+        return None
+    first = buf[pos]
+    length = 8 - first.bit_length() + 1
+    if first == 0 or length > 4:
+        raise WebMError(f"invalid element ID byte 0x{first:02x}")
+    if pos + length > len(buf):
+        return None
+    return int.from_bytes(buf[pos : pos + length], "big"), length
+
+
+def read_vint(buf, pos: int) -> Optional[Tuple[Optional[int], int]]:
+    """
+    Читает размер (vint без маркера). Значение None - "неизвестный размер"
+    (все биты значения единицы). None целиком - байтов пока не хватает.
+    """
+    if pos >= len(buf):
+        return None
+    first = buf[pos]
+    if first == 0:
+        raise WebMError("invalid vint length")
+    length = 8 - first.bit_length() + 1
+    if pos + length > len(buf):
+        return None
+    value = int.from_bytes(buf[pos : pos + length], "big")
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def read_uint(payload: bytes) -> int:
+    return int.from_bytes(payload, "big") if payload else 0
+
+
+def iter_children(payload: bytes):
+    """Дочерние элементы мастер-элемента известного размера: (id, payload)."""
+    pos = 0
+    while pos < len(payload):
+        element_id = read_element_id(payload, pos)
+        if element_id is None:
+            raise WebMError("truncated child element ID")
+        eid, id_len = element_id
+        size = read_vint(payload, pos + id_len)
+        if size is None or size[0] is None:
+            raise WebMError("truncated or unknown-size child element")
+        value, size_len = size
+        start = pos + id_len + size_len
+        end = start + value
+        if end > len(payload):
+            raise WebMError("child element overruns its parent")
+        yield eid, payload[start:end]
+        pos = end
+
+
+# --- EBML: ЗАПИСЬ ---
+
+
+def encode_element_id(eid: int) -> bytes:
+    return eid.to_bytes((eid.bit_length() + 7) // 8, "big")
+
+
+def encode_size(size: int) -> bytes:
+    for length in range(1, 9):
+        if size < (1 << (7 * length)) - 1:
+            return (size | (1 << (7 * length))).to_bytes(length, "big")
+    raise WebMError(f"element size {size} is too large")
+
+
+def encode_uint(value: int) -> bytes:
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), "big")
+
+
+def encode_element(eid: int, payload: bytes) -> bytes:
+    return encode_element_id(eid) + encode_size(len(payload)) + payload
+
+
+# --- БЛОКИ ---
+
+
+def opus_packet_duration_ns(packet: bytes) -> Optional[int]:
+    """Длительность пакета Opus по его TOC-байту (RFC 6716, 3.1)."""
+    if not packet:
+        return None
+    toc = packet[0]
+    frame_us = _OPUS_FRAME_US[toc >> 3]
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        if len(packet) < 2:
+            return None
+        frames = packet[1] & 0x3F
+    return frame_us * frames * 1000
+
+
+def _split_laced_frames(data: bytes, lacing: int) -> List[bytes]:
+    """Разбирает лейсинг блока Matroska на отдельные кадры."""
+    if lacing == 0:
+        return [data]
+    if not data:
+        raise WebMError("empty laced block")
+    count = data[0] + 1
+    pos = 1
+    sizes: List[int] = []
+    if lacing == 1:  # Xiph
+        for _ in range(count - 1):
+            size = 0
+            while True:
+                if pos >= len(data):
+                    raise WebMError("truncated Xiph lacing")
+                byte = data[pos]
+                pos += 1
+                size += byte
+                if byte != 255:
+                    break
+            sizes.append(size)
+    elif lacing == 3:  # EBML
+        first = read_vint(data, pos)
+        if first is None or first[0] is None:
+            raise WebMError("truncated EBML lacing")
+        size, length = first
+        pos += length
+        sizes.append(size)
+        for _ in range(count - 2):
+            delta = read_vint(data, pos)
+            if delta is None or delta[0] is None:
+                raise WebMError("truncated EBML lacing")
+            raw, length = delta
+            pos += length
+            size += raw - ((1 << (7 * length - 1)) - 1)
+            sizes.append(size)
+    else:  # фиксированный размер
+        body = len(data) - pos
+        if body % count:
+            raise WebMError("fixed lacing does not divide block evenly")
+        sizes = [body // count] * (count - 1)
+
+    frames = []
+    for size in sizes:
+        frames.append(data[pos : pos + size])
+        pos += size
+    if pos > len(data):
+        raise WebMError("laced frames overrun block")
+    frames.append(data[pos:])
+    return frames
+
+
+class Block(NamedTuple):
+    track: int
+    timecode: int  # относительно кластера, в тиках TimecodeScale
+    frames: List[bytes]
+    duration: Optional[int]  # BlockDuration в тиках, если задан
+
+
+def parse_block(payload: bytes, duration: Optional[int] = None) -> Block:
+    """Разбирает тело SimpleBlock или Block."""
+    track = read_vint(payload, 0)
+    if track is None or track[0] is None or len(payload) < track[1] + 3:
+        raise WebMError("truncated block header")
+    track_number, pos = track
+    timecode = int.from_bytes(payload[pos : pos + 2], "big", signed=True)
+    flags = payload[pos + 2]
+    frames = _split_laced_frames(payload[pos + 3 :], (flags >> 1) & 0x03)
+    return Block(track_number, timecode, frames, duration)
+
+
+# --- ПОТОКОВЫЙ ПАРСЕР ---
+
+
+class StreamState(NamedTuple):
+    """Параметры потока, действующие в точке элемента."""
+
+    timecode_scale: int
+    codec_id: Optional[str]
+    cluster_timecode: Optional[int]
+
+
+class Event(NamedTuple):
+    element_id: int
+    raw: bytes  # байты элемента целиком (для контейнеров - только заголовок)
+    payload: bytes
+    # Один feed() может захватить несколько кластеров и даже новый поток,
+    # поэтому состояние фиксируется для каждого элемента, а не берется из парсера
+    state: StreamState
+
+
+class WebMParser:
+    """
+    Инкрементальный разбор потока WebM: feed() принимает очередной кусок байтов
+    и возвращает элементы, которые в нем завершились. Незавершенный хвост
+    остается в буфере до следующего вызова. Битые или потерянные байты
+    пропускаются до следующего кластера или заголовка EBML.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.timecode_scale = DEFAULT_TIMECODE_SCALE
+        self.codec_id: Optional[str] = None
+        self.cluster_timecode: Optional[int] = None
+        self.skipped_bytes = 0
+
+    def feed(self, data: bytes) -> List[Event]:
+        self._buffer += data
+        buf = self._buffer
+        events: List[Event] = []
+        pos = 0
+        while pos < len(buf):
+            try:
+                header = self._read_header(buf, pos)
+            except WebMError as e:
+                pos = self._resync(buf, pos, e)
+                continue
+            if header is None:
+                break
+            eid, size, header_len = header
+
+            if eid in _CONTAINER_IDS:
+                raw = bytes(buf[pos : pos + header_len])
+                pos += header_len
+                if eid == CLUSTER_ID:
+                    self.cluster_timecode = None
+                events.append(Event(eid, raw, b"", self.state))
+                continue
+
+            end = pos + header_len + size
+            if end > len(buf):
+                break
+            raw = bytes(buf[pos:end])
+            payload = raw[header_len:]
+            pos = end
+            try:
+                self._observe(eid, payload)
+            except WebMError as e:
+                logger.debug(f"Skipping malformed WebM element 0x{eid:x}: {e}")
+                continue
+            events.append(Event(eid, raw, payload, self.state))
+
+        del buf[:pos]
+        return events
+
+    @property
+    def state(self) -> StreamState:
+        return StreamState(self.timecode_scale, self.codec_id, self.cluster_timecode)
+
+    def _read_header(self, buf, pos: int) -> Optional[Tuple[int, int, int]]:
+        element_id = read_element_id(buf, pos)
+        if element_id is None:
+            return None
+        eid, id_len = element_id
+        if eid not in _KNOWN_IDS:
+            raise WebMError(f"unexpected element 0x{eid:x}")
+        size = read_vint(buf, pos + id_len)
+        if size is None:
+            return None
+        value, size_len = size
+        if eid not in _CONTAINER_IDS and (value is None or value > _MAX_ELEMENT_SIZE):
+            raise WebMError(f"bad size for element 0x{eid:x}")
+        return eid, value, id_len + size_len
+
+    def _resync(self, buf, pos: int, error: WebMError) -> int:
+        """Ищет следующий кластер или заголовок EBML после битых байтов."""
+        candidates = [buf.find(marker, pos + 1) for marker in _RESYNC_MARKERS]
+        found = [c for c in candidates if c != -1]
+        if found:
+            new_pos = min(found)
+        else:
+            # Маркер может прийти разрезанным между чанками
+            new_pos = max(pos + 1, len(buf) - 3)
+        self.skipped_bytes += new_pos - pos
+        logger.debug(f"WebM resync: skipped {new_pos - pos} bytes ({error})")
+        return new_pos
+
+    def _observe(self, eid: int, payload: bytes):
+        if eid == EBML_ID:
+            # Новый поток (например, перезапуск записи в браузере)
+            self.timecode_scale = DEFAULT_TIMECODE_SCALE
+            self.codec_id = None
+            self.cluster_timecode = None
+        elif eid == INFO_ID:
+            for child_id, child in iter_children(payload):
+                if child_id == TIMECODE_SCALE_ID:
+                    self.timecode_scale = read_uint(child) or DEFAULT_TIMECODE_SCALE
+        elif eid == TRACKS_ID:
+            for child_id, entry in iter_children(payload):
+                if child_id != TRACK_ENTRY_ID:
+                    continue
+                for field_id, value in iter_children(entry):
+                    if field_id == CODEC_ID_ID:
+                        self.codec_id = value.decode("ascii", errors="replace")
+                break
+        elif eid == CLUSTER_TIMECODE_ID:
+            self.cluster_timecode = read_uint(payload)
+
+    def block_of(self, event: Event) -> Optional[Block]:
+        """Блок из события SimpleBlock/BlockGroup, иначе None."""
+        if event.element_id == SIMPLE_BLOCK_ID:
+            return parse_block(event.payload)
+        if event.element_id == BLOCK_GROUP_ID:
+            block_payload, duration = None, None
+            for child_id, child in iter_children(event.payload):
+                if child_id == BLOCK_ID:
+                    block_payload = child
+                elif child_id == BLOCK_DURATION_ID:
+                    duration = read_uint(child)
+            if block_payload is not None:
+                return parse_block(block_payload, duration)
+        return None
+
+    def block_duration_ns(
+        self, block: Block, state: Optional[StreamState] = None
+    ) -> Optional[int]:
+        """
+        Длительность блока: BlockDuration или сумма пакетов Opus. state -
+        состояние потока из события блока (по умолчанию текущее).
+        """
+        state = state or self.state
+        if block.duration is not None:
+            return block.duration * state.timecode_scale
+        if state.codec_id == OPUS_CODEC_ID:
+            total = 0
+            for frame in block.frames:
+                duration = opus_packet_duration_ns(frame)
+                if duration is None:
+                    return None
+                total += duration
+            return total
+        return None
+
+
+# --- ДЛИТЕЛЬНОСТЬ ---
+
+
+class WebMDurationCounter:
+    """
+    Считает длительность аудио в потоке WebM по мере поступления чанков.
+    Для Opus длительность точная (по TOC пакетов); для других кодеков без
+    BlockDuration берется разница меток времени соседних блоков.
+    """
+
+    def __init__(self):
+        self.parser = WebMParser()
+        self.total_ns = 0
+        self._last_start_ns: Optional[int] = None
+
+    @property
+    def total_seconds(self) -> float:
+        return self.total_ns / 1e9
+
+    def feed(self, data: bytes) -> float:
+        """Принимает очередной кусок потока. Возвращает длительность новых блоков, с."""
+        added = 0
+        parser = self.parser
+        for event in parser.feed(data):
+            if event.element_id == EBML_ID:
+                self._last_start_ns = None
+                continue
+            try:
+                block = parser.block_of(event)
+            except WebMError:
+                continue
+            state = event.state
+            if block is None or state.cluster_timecode is None:
+                continue
+
+            start_ns = (state.cluster_timecode + block.timecode) * state.timecode_scale
+            duration = parser.block_duration_ns(block, state)
+            if duration is None and self._last_start_ns is not None:
+                # Длительность предыдущего блока - до начала текущего
+                gap = start_ns - self._last_start_ns
+                duration = gap if 0 < gap < 1_000_000_000 else 0
+            self._last_start_ns = start_ns
+            added += duration or 0
+
+        self.total_ns += added
+        return added / 1e9
+
+
+def webm_duration_seconds(data: bytes) -> float:
+    """Длительность аудио в WebM целиком в памяти."""
+    return WebMDurationCounter().feed(data)
+
+
+def webm_file_duration_seconds(path: str, chunk_size: int = 256 * 1024) -> float:
+    """Длительность аудио в файле WebM; файл читается кусками."""
+    counter = WebMDurationCounter()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            counter.feed(data)
+    return counter.total_seconds
+
+
+# --- СКЛЕЙКА ---
+
+
+class WebMRemuxer:
+    """
+    Склеивает чанки одной дорожки в один WebM без перекодирования.
+
+    Заголовки (EBML, Info, Tracks) берутся из первого потока, Segment и
+    кластеры пишутся с неизвестным размером, чтобы результат можно было
+    отдавать потоково. Если запись в браузере перезапускалась (новый заголовок
+    EBML посреди дорожки), метки кластеров следующего потока сдвигаются к концу
+    предыдущего, чтобы время оставалось монотонным. Индексы (Cues, SeekHead)
+    и прочие служебные элементы отбрасываются; кластеры, оборванные потерянным
+    чанком, пропускаются до следующего целого кластера.
+    """
+
+    def __init__(self):
+        self.parser = WebMParser()
+        self._header_written = False
+        self._timecode_scale = DEFAULT_TIMECODE_SCALE
+        self._stream_index = -1
+        self._offset_ticks = 0
+        self._end_ticks = 0
+        self._cluster_ticks: Optional[int] = None
+        self.streams = 0
+        self.blocks = 0
+
+    def feed(self, data: bytes) -> bytes:
+        out = bytearray()
+        parser = self.parser
+        for event in parser.feed(data):
+            eid = event.element_id
+            if eid == EBML_ID:
+                self.streams += 1
+                self._cluster_ticks = None
+                if not self._header_written:
+                    out += event.raw
+                else:
+                    self._offset_ticks = self._end_ticks
+            elif eid == SEGMENT_ID:
+                if not self._header_written and self.streams == 1:
+                    out += _UNKNOWN_SIZE_SEGMENT
+            elif eid == INFO_ID:
+                if not self._header_written:
+                    self._timecode_scale = event.state.timecode_scale
+                    out += event.raw
+            elif eid == TRACKS_ID:
+                if not self._header_written:
+                    out += event.raw
+                    self._header_written = True
+            elif eid == CLUSTER_ID:
+                self._cluster_ticks = None
+            elif eid == CLUSTER_TIMECODE_ID:
+                if not self._header_written:
+                    continue
+                ticks = event.state.cluster_timecode * event.state.timecode_scale
+                self._cluster_ticks = ticks // self._timecode_scale + self._offset_ticks
+                out += _UNKNOWN_SIZE_CLUSTER
+                out += encode_element(
+                    CLUSTER_TIMECODE_ID, encode_uint(self._cluster_ticks)
+                )
+            elif eid in (SIMPLE_BLOCK_ID, BLOCK_GROUP_ID):
+                if self._cluster_ticks is None:
+                    continue  # блок без заголовка потока или кластера
+                out += event.raw
+                self._track_end(event)
+        return bytes(out)
+
+    def _track_end(self, event: Event):
+        self.blocks += 1
+        try:
+            block = self.parser.block_of(event)
+        except WebMError:
+            return
+        if block is None:
+            return
+        state = event.state
+        duration_ns = self.parser.block_duration_ns(block, state) or 0
+        end = (
+            self._cluster_ticks
+            + (block.timecode * state.timecode_scale + duration_ns)
+            // self._timecode_scale
+        )
+        self._end_ticks = max(self._end_ticks, end)
+
@@ -0,0 +1,132 @@
+# backend/worker.py
+"""
+Отдельный процесс пост-обработки звонков.
+
+Забирает задачи из таблицы post_processing_jobs и выполняет
+process_and_merge_audio не более чем в POSTPROCESS_CONCURRENCY задач
+одновременно, чтобы пачка ffmpeg-склеек после серии интервью не отнимала
+ресурсы у процесса, который обслуживает живые звонки. Пока задача
+выполняется, воркер продлевает ее аренду; потеряв аренду, он прерывает
+обработку, чтобы сессию не склеивали два воркера сразу. Здесь же периодически
+работает уборщик брошенных чанков (services.sweeper, SWEEP_ENABLED).
+
+Запуск:
+    python -m backend.worker
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+import anyio
+
+from . import database, models
+from .services import post_processing
+from .services.post_processing_jobs import (POSTPROCESS_JOB_HEARTBEAT_SEC,
+                                            claim_jobs_sync, complete_job_sync,
+                                            fail_job_sync, heartbeat_job_sync)
+from .services.storage import get_storage
+from .services.sweeper import SWEEP_ENABLED, Sweeper
+
+logger = logging.getLogger("uvicorn.error")
+
+POSTPROCESS_CONCURRENCY = int(
+    os.getenv("POSTPROCESS_CONCURRENCY", str(os.cpu_count() or 1))
+)
+POSTPROCESS_POLL_INTERVAL = float(os.getenv("POSTPROCESS_POLL_INTERVAL", "2"))
+
+
+async def _keep_lease(job_id: int, worker_id: str):
+    """Продлевает аренду задачи, пока она выполняется; выходит, если аренда потеряна."""
+    while True:
+        await asyncio.sleep(POSTPROCESS_JOB_HEARTBEAT_SEC)
+        try:
+            owned = await anyio.to_thread.run_sync(
+                heartbeat_job_sync, job_id, worker_id
+            )
+        except Exception as e:
+            # БД недоступна: попробуем на следующем такте, аренда еще не истекла
+            logger.warning(f"Could not renew lease of job {job_id}: {e}")
+            continue
+        if not owned:
+            return
+
+
+async def _run_job(job_id: int, meeting_id: int, session_id: str, worker_id: str):
+    work = asyncio.create_task(
+        post_processing.process_and_merge_audio(meeting_id, session_id)
+    )
+    lease = asyncio.create_task(_keep_lease(job_id, worker_id))
+    try:
+        await asyncio.wait({work, lease}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        lease.cancel()
+        if not work.done():
+            # Аренда потеряна (задачу забрал другой воркер) или воркер
+            # останавливается: не обрабатываем сессию параллельно с другим
+            work.cancel()
+            try:
+                await work
+            except BaseException:
+                pass
+
+    if work.cancelled():
+        logger.error(f"Lost lease of post-processing job {job_id}, abandoned it")
+        return
+    error = work.exception()
+    if error is not None:
+        await anyio.to_thread.run_sync(fail_job_sync, job_id, repr(error), worker_id)
+    else:
+        await anyio.to_thread.run_sync(complete_job_sync, job_id, worker_id)
+
+
+async def run_worker(concurrency: int = POSTPROCESS_CONCURRENCY):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    logger.info(f"Post-processing worker {worker_id} started, concurrency {concurrency}")
+    running = set()
+    sweeper_task = None
+    if SWEEP_ENABLED:
+        sweeper_task = asyncio.create_task(Sweeper().run_forever())
+
+    try:
+        while True:
+            free_slots = concurrency - len(running)
+            jobs = []
+            if free_slots > 0:
+                try:
+                    jobs = await anyio.to_thread.run_sync(
+                        claim_jobs_sync, worker_id, free_slots
+                    )
+                except Exception as e:
+                    logger.error(f"Could not claim post-processing jobs: {e}")
+
+            for job_id, meeting_id, session_id in jobs:
+                task = asyncio.create_task(
+                    _run_job(job_id, meeting_id, session_id, worker_id)
+                )
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+            if not jobs:
+                await asyncio.sleep(POSTPROCESS_POLL_INTERVAL)
+            elif len(running) >= concurrency:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Прерванные задачи вернутся в очередь по истечении аренды
+        for task in running:
+            task.cancel()
+        if sweeper_task is not None:
+            sweeper_task.cancel()
+        await get_storage().close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(database.engine)
+    post_processing.ensure_final_recording_index_sync()
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# bench/call_load.py
+"""
+Нагрузочный тест WebSocket пути /call/{token}.
+
+Поднимает фейковый STT/TTS сервис (bench.fake_stt), запускает backend.main:app
+через uvicorn в отдельном процессе (SQLite по умолчанию, MinIO из
+docker-compose) и гоняет N симулированных браузерных клиентов, которые шлют
+чанки по 100 мс. Результат печатается в JSON:
+
+    python -m bench.call_load --clients 50 --duration 60 --call-seconds 20
+
+Задержка реле измеряется по кругу клиент -> backend -> STT -> backend -> клиент:
+фейковый STT возвращает кадр эхом, а в начале кадра (у первого - после EBML
+magic) лежит время отправки.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from bench.fake_stt import start_fake_stt
+
+# Начало EBML заголовка WebM: первый чанк MediaRecorder всегда начинается с него
+_EBML_MAGIC = b"\x1a\x45\xdf\xa3"
+_FRAME_HEADER = struct.Struct("!Qd")  # номер кадра, время отправки (perf_counter)
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+# Объекты, реально записанные в хранилище (сегменты, части multipart, дорожки
+# спула), и неудачные записи кадров
+PERSISTED_METRIC = "call_audio_objects_persisted_total"
+FAILED_METRIC = "call_audio_persist_failures_total"
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+def _synthetic_frame(seq: int, size: int) -> bytes:
+    """
+    Синтетический кадр Opus/WebM: заголовок с номером и временем + шум.
+    Первый кадр, как у MediaRecorder, начинается с EBML magic, а заголовок
+    идет сразу за ним.
+    """
+    header = _FRAME_HEADER.pack(seq, time.perf_counter())
+    prefix = _EBML_MAGIC if seq == 0 else b""
+    body = os.urandom(max(0, size - len(header) - len(prefix)))
+    return prefix + header + body
+
+
+def _frame_sent_at(frame: bytes) -> float:
+    # Номер кадра big-endian начинается с нулевых байтов и не спутается с magic
+    offset = len(_EBML_MAGIC) if frame.startswith(_EBML_MAGIC) else 0
+    _, sent_at = _FRAME_HEADER.unpack_from(frame, offset)
+    return sent_at
+
+
+def _read_proc_usage(pid: int) -> Optional[Dict[str, float]]:
+    """CPU-время (с) и RSS (байты) процесса из /proc (только Linux)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            status = f.read()
+    except OSError:
+        return None
+    rss_kb = int(re.search(r"VmRSS:\s+(\d+)", status).group(1))
+    hwm_kb = int(re.search(r"VmHWM:\s+(\d+)", status).group(1))
+    return {
+        "cpu_sec": (int(fields[11]) + int(fields[12])) / _CLK_TCK,
+        "rss_bytes": rss_kb * 1024,
+        "rss_peak_bytes": hwm_kb * 1024,
+    }
+
+
+async def _scrape_metric(session: aiohttp.ClientSession, base_url: str, name: str):
+    """Суммирует значения метрики name по всем меткам из /metrics."""
+    async with session.get(f"{base_url}/metrics") as resp:
+        text = await resp.text()
+    total = 0.0
+    for line in text.splitlines():
+        if line.startswith(name + "{") or line.startswith(name + " "):
+            total += float(line.rsplit(" ", 1)[1])
+    return total
+
+
+def _seed_meetings(count: int) -> List[str]:
+    """Создает встречи для звонков напрямую в БД, которой пользуется backend."""
+    from backend import database, models
+
+    models.Base.metadata.create_all(database.engine)
+    tokens = [uuid.uuid4().hex for _ in range(count)]
+    db = database.SessionLocal()
+    try:
+        db.add_all(
+            models.Meeting(token=t, resume_id=0, organizer_username="bench")
+            for t in tokens
+        )
+        db.commit()
+    finally:
+        db.close()
+    return tokens
+
+
+class CallResult:
+    def __init__(self):
+        self.sent = 0
+        self.echoed = 0
+        self.latencies: List[float] = []
+        self.error: Optional[str] = None
+
+
+async def _run_call(
+    session: aiohttp.ClientSession,
+    ws_url: str,
+    call_seconds: float,
+    chunk_ms: int,
+    chunk_bytes: int,
+) -> CallResult:
+    result = CallResult()
+    try:
+        async with session.ws_connect(ws_url) as ws:
+
+            async def receiver():
+                async for msg in ws:
+                    if msg.type == aiohttp.WSMsgType.BINARY:
+                        sent_at = _frame_sent_at(msg.data)
+                        result.latencies.append(time.perf_counter() - sent_at)
+                        result.echoed += 1
+                    elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.ERROR):
+                        break
+
+            receive_task = asyncio.create_task(receiver())
+            interval = chunk_ms / 1000
+            deadline = time.perf_counter() + call_seconds
+            next_at = time.perf_counter()
+            while time.perf_counter() < deadline and not ws.closed:
+                await ws.send_bytes(_synthetic_frame(result.sent, chunk_bytes))
+                result.sent += 1
+                next_at += interval
+                await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+
+            # Даем последним эхо-кадрам вернуться
+            await asyncio.sleep(min(1.0, interval * 5))
+            await ws.close()
+            await receive_task
+            if ws.close_code and ws.close_code >= 4000:
+                result.error = f"closed with {ws.close_code}"
+    except Exception as e:
+        result.error = repr(e)
+    return result
+
+
+async def _client_loop(session, base_ws_url, tokens, results, stop_at, args):
+    """Один симулированный браузер: звонок за звонком до конца теста."""
+    while time.perf_counter() < stop_at and tokens:
+        token = tokens.pop()
+        results.append(
+            await _run_call(
+                session,
+                f"{base_ws_url}/call/{token}",
+                args.call_seconds,
+                args.chunk_ms,
+                args.chunk_bytes,
+            )
+        )
+
+
+def _start_backend(args, stt_url: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["DATABASE_URL"] = args.database_url
+    env["STT_TTS_WS_URL"] = stt_url
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "backend.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(args.backend_port),
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+    )
+
+
+async def _wait_ready(session: aiohttp.ClientSession, base_url: str, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            async with session.get(f"{base_url}/calls/status") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"Backend at {base_url} did not become ready")
+
+
+async def run(args) -> Dict:
+    stt_runner = await start_fake_stt("127.0.0.1", args.stt_port)
+    stt_url = f"ws://127.0.0.1:{args.stt_port}/call"
+    backend = None
+    base_url = args.backend_url
+    if not base_url:
+        backend = _start_backend(args, stt_url)
+        base_url = f"http://127.0.0.1:{args.backend_port}"
+    base_ws_url = base_url.replace("http", "ws", 1)
+
+    # Токенов с запасом: по звонку на клиента на каждый интервал call_seconds
+    calls_per_client = int(args.duration / args.call_seconds) + 2
+    tokens = _seed_meetings(args.clients * calls_per_client)
+    results: List[CallResult] = []
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            await _wait_ready(session, base_url, timeout=30)
+            persisted_before = await _scrape_metric(session, base_url, PERSISTED_METRIC)
+            failed_before = await _scrape_metric(session, base_url, FAILED_METRIC)
+            usage_before = _read_proc_usage(backend.pid) if backend else None
+
+            started = time.perf_counter()
+            stop_at = started + args.duration
+            await asyncio.gather(
+                *(
+                    _client_loop(session, base_ws_url, tokens, results, stop_at, args)
+                    for _ in range(args.clients)
+                )
+            )
+            elapsed = time.perf_counter() - started
+
+            # Ждем, пока backend допишет очереди и пакет метаданных
+            await asyncio.sleep(2)
+            persisted = (
+                await _scrape_metric(session, base_url, PERSISTED_METRIC)
+                - persisted_before
+            )
+            persist_failures = (
+                await _scrape_metric(session, base_url, FAILED_METRIC) - failed_before
+            )
+            usage_after = _read_proc_usage(backend.pid) if backend else None
+    finally:
+        if backend:
+            backend.terminate()
+            backend.wait(timeout=30)
+        await stt_runner.cleanup()
+
+    latencies = [v for r in results for v in r.latencies]
+    completed = [r for r in results if r.error is None]
+    report = {
+        "clients": args.clients,
+        "duration_sec": round(elapsed, 2),
+        "calls_total": len(results),
+        "calls_failed": len(results) - len(completed),
+        "calls_per_sec": round(len(completed) / elapsed, 3),
+        "frames_sent": sum(r.sent for r in results),
+        "frames_echoed": sum(r.echoed for r in results),
+        "relay_latency_ms": {
+            "p50": _ms(_percentile(latencies, 0.5)),
+            "p99": _ms(_percentile(latencies, 0.99)),
+            "max": _ms(max(latencies) if latencies else None),
+        },
+        "persisted_objects_per_sec": round(persisted / elapsed, 1),
+        "persist_failures": int(persist_failures),
+        "errors": sorted({r.error[:200] for r in results if r.error})[:10],
+    }
+    if usage_before and usage_after:
+        report["backend"] = {
+            "cpu_sec": round(usage_after["cpu_sec"] - usage_before["cpu_sec"], 2),
+            "cpu_sec_per_call": round(
+                (usage_after["cpu_sec"] - usage_before["cpu_sec"])
+                / max(1, len(results)),
+                3,
+            ),
+            "rss_peak_bytes": usage_after["rss_peak_bytes"],
+            "rss_per_concurrent_call_bytes": int(
+                (usage_after["rss_peak_bytes"] - usage_before["rss_bytes"])
+                / args.clients
+            ),
+        }
+    return report
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 2) if value is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--call-seconds", type=float, default=10)
+    parser.add_argument("--chunk-ms", type=int, default=100)
+    parser.add_argument(
+        "--chunk-bytes", type=int, default=1600, help="~128 kbit/s Opus at 100 ms"
+    )
+    parser.add_argument("--stt-port", type=int, default=18080)
+    parser.add_argument("--backend-port", type=int, default=18000)
+    parser.add_argument(
+        "--backend-url",
+        default=None,
+        help="use an already running backend instead of starting one",
+    )
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv(
+            "DATABASE_URL",
+            "sqlite:///" + os.path.join(tempfile.gettempdir(), "aihr_bench.db"),
+        ),
+    )
+    args = parser.parse_args()
+
+    # Сидинг встреч идет в ту же БД, что и у backend
+    os.environ["DATABASE_URL"] = args.database_url
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
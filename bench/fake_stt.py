@@ -0,0 +1,68 @@
+# bench/fake_stt.py
+"""
+Фейковый STT/TTS сервис для нагрузочных тестов: реализует контракт
+STT_TTS_WS_URL/{token}. Эхом возвращает бинарные кадры (как будто это ответ
+TTS) и раз в несколько кадров присылает текстовое сообщение.
+
+Запуск отдельно:
+    python -m bench.fake_stt --port 8080
+"""
+import argparse
+import json
+import logging
+
+from aiohttp import WSMsgType, web
+
+logger = logging.getLogger("bench.fake_stt")
+
+
+def create_app(text_every: int = 50) -> web.Application:
+    async def call_handler(request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        token = request.match_info["token"]
+        frames = 0
+        async for msg in ws:
+            if msg.type == WSMsgType.BINARY:
+                frames += 1
+                await ws.send_bytes(msg.data)
+                if text_every and frames % text_every == 0:
+                    await ws.send_str(
+                        json.dumps({"type": "transcript", "token": token, "n": frames})
+                    )
+            elif msg.type == WSMsgType.TEXT and msg.data == "end_session":
+                break
+        await ws.close()
+        return ws
+
+    async def health(request: web.Request):
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_get("/call/{token}", call_handler)
+    # HEAD / используется прогревом соединения в STTClient.warm_up
+    app.router.add_route("*", "/", health)
+    return app
+
+
+async def start_fake_stt(host: str, port: int, text_every: int = 50) -> web.AppRunner:
+    runner = web.AppRunner(create_app(text_every))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Fake STT/TTS listening on ws://%s:%d/call/{token}", host, port)
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--text-every", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(args.text_every), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
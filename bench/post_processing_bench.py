@@ -0,0 +1,471 @@
+# bench/post_processing_bench.py
+"""
+Бенчмарк пост-обработки записи (backend.services.post_processing).
+
+Генерирует синтетические дорожки участника и бота (Opus/WebM, как у
+MediaRecorder) для звонков заданной длины, режет их на чанки, кладет в
+локальную замену MinIO (каталог на диске, запросы считаются) и SQLite, после
+чего замеряет process_and_merge_audio от начала до конца. Результат - JSON:
+
+    python -m bench.post_processing_bench
+    python -m bench.post_processing_bench --minutes 90 --chunk-seconds 0.5
+    python -m bench.post_processing_bench --layout track --no-streaming
+
+Для каждого прогона: время, CPU процесса и ffmpeg, пик RSS (сэмплируется из
+/proc, только Linux), пик временных файлов пост-обработки и число запросов к
+хранилищу по операциям. Сгенерированные дорожки кэшируются в --cache-dir.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+_SOURCES = {
+    # Роль -> источник lavfi: разные сигналы, чтобы amix не схлопывал дорожки
+    "participant": "anoisesrc=color=pink:amplitude=0.2:sample_rate=48000",
+    "bot": "sine=frequency=220:sample_rate=48000",
+}
+
+
+def _rusage_cpu(who: int) -> float:
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _read_rss() -> Optional[int]:
+    """Текущий RSS процесса в байтах из /proc (только Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            status = f.read()
+    except OSError:
+        return None
+    return int(re.search(r"VmRSS:\s+(\d+)", status).group(1)) * 1024
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass  # файл удалили между listdir и lstat
+    return total
+
+
+class _Sampler(threading.Thread):
+    """Фоново отслеживает максимум RSS и объема временного каталога."""
+
+    def __init__(self, temp_dir: str, interval: float):
+        super().__init__(daemon=True)
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.rss_peak = 0
+        self.temp_peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._sample()
+            self._stop_event.wait(self.interval)
+        self._sample()
+
+    def _sample(self):
+        self.rss_peak = max(self.rss_peak, _read_rss() or 0)
+        self.temp_peak = max(self.temp_peak, _dir_size(self.temp_dir))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# --- ЛОКАЛЬНАЯ ЗАМЕНА MINIO ---
+
+
+class _LocalBody:
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._file.close()
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+
+class LocalS3Client:
+    """
+    Подмножество API клиента aioboto3 S3, которым пользуется AsyncStorage,
+    поверх каталога на диске. Считает запросы по операциям и добавляет
+    задержку latency на каждый, имитируя сетевой round-trip.
+    """
+
+    def __init__(self, root: str, latency: float = 0.0):
+        self.root = root
+        self.latency = latency
+        self.requests: Dict[str, int] = collections.Counter()
+        self._uploads: Dict[str, List[str]] = {}
+        os.makedirs(os.path.join(root, ".uploads"), exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    async def _request(self, operation: str):
+        self.requests[operation] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def write_object(self, key: str, data: bytes):
+        """Кладет объект без учета в запросах (для подготовки данных)."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    async def get_object(self, Bucket: str, Key: str):
+        from botocore.exceptions import ClientError
+
+        await self._request("get_object")
+        if not os.path.exists(self._path(Key)):
+            raise ClientError(
+                {"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject"
+            )
+        return {"Body": _LocalBody(self._path(Key))}
+
+    async def put_object(self, Bucket: str, Key: str, Body: bytes, ContentType=None):
+        await self._request("put_object")
+        self.write_object(Key, Body)
+
+    async def upload_file(self, file_path: str, bucket: str, key: str, ExtraArgs=None):
+        await self._request("upload_file")
+        os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+        shutil.copyfile(file_path, self._path(key))
+
+    async def create_multipart_upload(self, Bucket: str, Key: str, ContentType=None):
+        await self._request("create_multipart_upload")
+        upload_id = uuid.uuid4().hex
+        self._uploads[upload_id] = []
+        return {"UploadId": upload_id}
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        await self._request("upload_part")
+        part_path = os.path.join(self.root, ".uploads", f"{UploadId}.{PartNumber}")
+        with open(part_path, "wb") as f:
+            f.write(Body)
+        self._uploads[UploadId].append(part_path)
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    async def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        await self._request("complete_multipart_upload")
+        os.makedirs(os.path.dirname(self._path(Key)), exist_ok=True)
+        with open(self._path(Key), "wb") as out:
+            for part_path in self._uploads.pop(UploadId):
+                with open(part_path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+                os.unlink(part_path)
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        await self._request("abort_multipart_upload")
+        for part_path in self._uploads.pop(UploadId, []):
+            os.unlink(part_path)
+
+    async def delete_objects(self, Bucket: str, Delete: Dict):
+        await self._request("delete_objects")
+        for item in Delete["Objects"]:
+            try:
+                os.unlink(self._path(item["Key"]))
+            except FileNotFoundError:
+                pass
+        return {"Errors": []}
+
+
+def _install_local_storage(root: str, latency: float) -> LocalS3Client:
+    from backend.services import storage
+
+    client = LocalS3Client(root, latency)
+
+    class LocalStorage(storage.AsyncStorage):
+        async def client(self):
+            return client
+
+    storage._storage = LocalStorage()
+    return client
+
+
+# --- СИНТЕТИЧЕСКИЙ ЗВОНОК ---
+
+
+def _synthetic_track(cache_dir: str, role: str, seconds: int, bitrate: str) -> str:
+    """Opus/WebM дорожка роли длиной seconds (live-режим, как у MediaRecorder)."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{role}_{seconds}s_{bitrate}.webm")
+    if os.path.exists(path):
+        return path
+    partial = path + ".part"
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            f"{_SOURCES[role]}:duration={seconds}",
+            "-c:a",
+            "libopus",
+            "-b:a",
+            bitrate,
+            "-vbr",
+            "off",
+            "-ac",
+            "1",
+            "-live",
+            "1",
+            "-f",
+            "webm",
+            partial,
+        ],
+        check=True,
+    )
+    os.replace(partial, path)
+    return path
+
+
+def _seed_call(
+    client: LocalS3Client, tracks: Dict[str, str], seconds: int, args
+) -> Dict:
+    """Кладет чанки дорожек в хранилище, а встречу и AudioObject - в БД."""
+    from backend import database, models
+    from backend.services.post_processing_jobs import enqueue_post_processing_sync
+
+    session_id = uuid.uuid4().hex
+    db = database.SessionLocal()
+    try:
+        meeting = models.Meeting(
+            token=session_id,
+            resume_id=0,
+            organizer_username="bench",
+            is_finished=True,
+            last_session_id=session_id,
+            ended_at=datetime.datetime.now(datetime.timezone.utc),
+        )
+        db.add(meeting)
+        db.commit()
+        meeting_id = meeting.id
+
+        # Явный created_at: пост-обработка упорядочивает чанки по нему
+        started = datetime.datetime.now(datetime.timezone.utc)
+        chunks = 0
+        source_bytes = 0
+        for role, path in tracks.items():
+            with open(path, "rb") as f:
+                data = f.read()
+            if args.layout == "track":
+                pieces = [data]
+            else:
+                chunk_bytes = max(1, int(len(data) / seconds * args.chunk_seconds))
+                pieces = [
+                    data[i : i + chunk_bytes] for i in range(0, len(data), chunk_bytes)
+                ]
+            for index, piece in enumerate(pieces):
+                key = f"audio/{session_id}/{role}/{index:06d}.webm"
+                client.write_object(key, piece)
+                db.add(
+                    models.AudioObject(
+                        session_id=session_id,
+                        meeting_id=meeting_id,
+                        object_key=key,
+                        role=role,
+                        size_bytes=len(piece),
+                        created_at=started
+                        + datetime.timedelta(seconds=index * args.chunk_seconds),
+                    )
+                )
+            chunks += len(pieces)
+            source_bytes += len(data)
+        db.commit()
+    finally:
+        db.close()
+    enqueue_post_processing_sync(meeting_id, session_id)
+    return {
+        "meeting_id": meeting_id,
+        "session_id": session_id,
+        "chunks": chunks,
+        "source_bytes": source_bytes,
+    }
+
+
+def _final_size(client: LocalS3Client, meeting_id: int) -> Optional[int]:
+    from backend.services.post_processing import final_recording_key
+
+    path = client._path(final_recording_key(meeting_id))
+    return os.path.getsize(path) if os.path.exists(path) else None
+
+
+def _run_scenario(client: LocalS3Client, minutes: float, temp_dir: str, args) -> Dict:
+    from backend.services import post_processing
+
+    seconds = int(minutes * 60)
+    tracks = {
+        role: _synthetic_track(args.cache_dir, role, seconds, args.bitrate)
+        for role in _SOURCES
+    }
+    call = _seed_call(client, tracks, seconds, args)
+    client.requests.clear()
+
+    sampler = _Sampler(temp_dir, args.sample_ms / 1000)
+    rss_before = _read_rss()
+    cpu_before = _rusage_cpu(resource.RUSAGE_SELF)
+    ffmpeg_cpu_before = _rusage_cpu(resource.RUSAGE_CHILDREN)
+    sampler.start()
+    started = time.perf_counter()
+    error = None
+    try:
+        asyncio.run(
+            post_processing.process_and_merge_audio(
+                call["meeting_id"], call["session_id"]
+            )
+        )
+    except Exception as e:
+        error = repr(e)
+    wall = time.perf_counter() - started
+    sampler.stop()
+
+    return {
+        "call_minutes": minutes,
+        "layout": args.layout,
+        "chunk_seconds": args.chunk_seconds if args.layout == "chunks" else None,
+        "chunks": call["chunks"],
+        "source_bytes": call["source_bytes"],
+        "final_bytes": _final_size(client, call["meeting_id"]),
+        "wall_sec": round(wall, 3),
+        "cpu_sec": round(_rusage_cpu(resource.RUSAGE_SELF) - cpu_before, 3),
+        "ffmpeg_cpu_sec": round(
+            _rusage_cpu(resource.RUSAGE_CHILDREN) - ffmpeg_cpu_before, 3
+        ),
+        # ru_maxrss в KiB на Linux; это максимум среди всех дочерних процессов
+        "ffmpeg_peak_rss_bytes": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        ),
+        "rss_before_bytes": rss_before,
+        "rss_peak_bytes": sampler.rss_peak or None,
+        "temp_disk_peak_bytes": sampler.temp_peak,
+        "storage_requests": dict(
+            sorted(client.requests.items()), total=sum(client.requests.values())
+        ),
+        "error": error,
+    }
+
+
+def run(args) -> Dict:
+    from backend import models, database
+    from backend.services import post_processing
+
+    models.Base.metadata.create_all(database.engine)
+    post_processing.POSTPROCESS_STREAMING = args.streaming and hasattr(os, "mkfifo")
+    post_processing.RECORDING_DERIVATIVES = set(args.derivatives)
+    client = _install_local_storage(args.storage_dir, args.storage_latency_ms / 1000)
+
+    results = [
+        _run_scenario(client, minutes, args.temp_dir, args) for minutes in args.minutes
+    ]
+    return {
+        "streaming": post_processing.POSTPROCESS_STREAMING,
+        "derivatives": sorted(post_processing.RECORDING_DERIVATIVES),
+        "bitrate": args.bitrate,
+        "storage_latency_ms": args.storage_latency_ms,
+        "chunk_download_window": _chunk_download_window(),
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+
+
+def _chunk_download_window() -> int:
+    from backend.services.chunk_downloader import CHUNK_DOWNLOAD_WINDOW
+
+    return CHUNK_DOWNLOAD_WINDOW
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--minutes", type=float, nargs="+", default=[5, 30, 90], help="call lengths"
+    )
+    parser.add_argument(
+        "--chunk-seconds", type=float, default=1.0, help="audio per stored chunk"
+    )
+    parser.add_argument(
+        "--layout",
+        choices=("chunks", "track"),
+        default="chunks",
+        help="many chunk objects per role, or one object per role (multipart/spool)",
+    )
+    parser.add_argument("--bitrate", default="32k", help="Opus bitrate of each track")
+    parser.add_argument(
+        "--no-streaming",
+        dest="streaming",
+        action="store_false",
+        help="use the temp-file path instead of FIFOs",
+    )
+    parser.add_argument(
+        "--derivatives",
+        type=lambda value: [name for name in value.split(",") if name],
+        default=[],
+        help="comma-separated RECORDING_DERIVATIVES to encode alongside the mix",
+    )
+    parser.add_argument(
+        "--storage-latency-ms",
+        type=float,
+        default=5.0,
+        help="simulated round-trip of every storage request",
+    )
+    parser.add_argument("--sample-ms", type=float, default=50, help="RSS/disk sampling")
+    parser.add_argument(
+        "--cache-dir",
+        default=os.path.join(tempfile.gettempdir(), "aihr_ppbench_cache"),
+        help="where generated tracks are kept between runs",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="aihr_ppbench_")
+    args.storage_dir = os.path.join(work_dir, "s3")
+    args.temp_dir = os.path.join(work_dir, "tmp")
+    os.makedirs(args.temp_dir)
+    # Временные файлы пост-обработки (tempfile.mkdtemp) попадают в замеряемый каталог
+    tempfile.tempdir = args.temp_dir
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(work_dir, "bench.db")
+    os.environ["AUDIO_SPOOL_DIR"] = os.path.join(work_dir, "spool")
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        logging.getLogger("uvicorn.error").setLevel(logging.WARNING)
+
+    try:
+        report = run(args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
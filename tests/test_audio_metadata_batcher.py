@@ -0,0 +1,113 @@
+# tests/test_audio_metadata_batcher.py
+"""
+Пакетная запись метаданных AudioObject не должна терять строки, пока БД
+недоступна: объекты уже лежат в MinIO, и без строк уборщик удалит их как сирот.
+"""
+import datetime
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend import database, models
+from backend.services.audio_store import AudioMetadataBatcher
+
+
+class Outage:
+    """Фабрика сессий, которая пока down=True падает на каждом запросе."""
+
+    def __init__(self, engine):
+        self.down = False
+        self._sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def __call__(self):
+        db = self._sessions()
+        if self.down:
+
+            def execute(*args, **kwargs):
+                raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+            db.execute = execute
+        return db
+
+
+@pytest.fixture()
+def outage(monkeypatch):
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    models.Base.metadata.create_all(engine)
+    sessions = Outage(engine)
+    monkeypatch.setattr(database, "SessionLocal", sessions)
+    yield sessions
+    engine.dispose()
+
+
+def _row(n, session_id="s1"):
+    return {
+        "session_id": session_id,
+        "object_key": f"calls/{session_id}/participant_{n}.webm",
+        "role": "participant",
+        "duration_sec": 5.0,
+        "size_bytes": 1024,
+        "is_final": False,
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+    }
+
+
+def _count(sessions):
+    db = sessions()
+    try:
+        return db.scalar(select(func.count()).select_from(models.AudioObject))
+    finally:
+        db.close()
+
+
+def test_outage_does_not_drop_rows(outage):
+    batcher = AudioMetadataBatcher(interval=1, max_retries=5)
+    for n in range(3):
+        batcher.add(_row(n))
+
+    # 10 секунд недоступности БД при интервале записи в 1 секунду
+    outage.down = True
+    for _ in range(10):
+        with pytest.raises(OperationalError):
+            batcher.flush_sync()
+        batcher.add(_row(len(batcher._rows)))
+
+    outage.down = False
+    assert batcher.flush_sync() == 13
+    assert _count(outage) == 13
+
+
+def test_invalid_row_is_dropped_without_blocking_others(outage):
+    batcher = AudioMetadataBatcher(max_retries=5)
+    bad = _row(0)
+    bad["size_bytes"] = None  # NOT NULL
+    batcher.add(bad)
+    batcher.add(_row(1))
+
+    assert batcher.flush_sync() == 1
+    assert batcher._rows == []
+    assert _count(outage) == 1
+
+
+def test_pending_rows_are_capped(outage):
+    batcher = AudioMetadataBatcher(max_pending=2)
+    outage.down = True
+    for n in range(3):
+        batcher.add(_row(n))
+    with pytest.raises(OperationalError):
+        batcher.flush_sync()
+
+    assert [row["object_key"] for row, _ in batcher._rows] == [
+        _row(1)["object_key"],
+        _row(2)["object_key"],
+    ]
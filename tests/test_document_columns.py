@@ -0,0 +1,107 @@
+# tests/test_document_columns.py
+"""
+Списки и метаданные резюме и вакансий не должны выбирать file_data: байты
+файлов нужны только скачиванию еще не перенесенных строк.
+"""
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend import database, models
+from backend.main import app
+
+OWNER = "hr"
+CANDIDATE = "candidate"
+
+
+@pytest.fixture()
+def client():
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    models.Base.metadata.create_all(engine)
+    TestingSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = TestingSession()
+    db.add(
+        models.Vacancy(
+            id=1,
+            title="Backend developer",
+            telegram_username=OWNER,
+            file_name="vacancy.pdf",
+            file_data=b"v" * 1024,
+        )
+    )
+    db.add(
+        models.Resume(
+            id=1,
+            vacancy_id=1,
+            telegram_username=CANDIDATE,
+            telegram_user_id="1",
+            original_filename="cv.pdf",
+            file_data=b"r" * 1024,
+        )
+    )
+    db.commit()
+    db.close()
+
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def get_test_db():
+        db = TestingSession()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = get_test_db
+    # Без контекстного менеджера: события startup (хранилище, STT) не нужны
+    client = TestClient(app)
+    client.statements = statements
+    yield client
+    app.dependency_overrides.clear()
+    engine.dispose()
+
+
+def _selects(client, url, user=None):
+    client.statements.clear()
+    headers = {"X-Telegram-User": user} if user else {}
+    response = client.get(url, headers=headers)
+    assert response.status_code == 200, response.text
+    selects = [s for s in client.statements if s.lstrip().upper().startswith("SELECT")]
+    assert selects
+    return selects
+
+
+@pytest.mark.parametrize(
+    "url, user",
+    [
+        ("/resumes/vacancy/1", OWNER),
+        ("/user/resumes", CANDIDATE),
+        ("/user/vacancies", OWNER),
+        ("/resumes/1", None),
+        ("/vacancies/1", None),
+    ],
+)
+def test_metadata_endpoints_do_not_select_file_data(client, url, user):
+    for statement in _selects(client, url, user):
+        assert "file_data" not in statement
+
+
+def test_legacy_download_loads_file_data(client):
+    # Контроль: запросы действительно перехватываются, и скачивание строки без
+    # file_key по-прежнему читает байты из БД
+    selects = _selects(client, "/resumes/1/download", CANDIDATE)
+    assert sum("file_data" in statement for statement in selects) == 1